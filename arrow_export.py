@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Export the per-point (quality-checked), area average and sample average data as Parquet or Arrow IPC (Feather)
+datasets, partitioned by mineral and sample, for datasets too large for Excel (which is limited to 1,048,576 rows
+per sheet) or for reading into other tools without going through the spreadsheet.
+
+The columns are named as in the output spreadsheet (see inout.group_output_data), with the sample and area
+columns called 'Sample' and 'Area'. The '<mean> ± <2SD>' sample averages are split into a numeric column of the
+means and a '2SD_<column>' column. Each table is written as a hive-partitioned dataset, e.g.
+    <path>/points/Mineral=olivine/Sample=<sample>/part-0.parquet
+so that a single mineral or sample can be read without reading the rest, e.g. with load_exported_table, or
+    pandas.read_parquet('<path>/points/Mineral=olivine')
+for a single mineral. (The minerals have different columns, so when reading several minerals at once with other
+tools, make sure they combine the schemas of all of the files - see load_exported_table.)
+
+Requires pyarrow (pip install pyarrow), which is only imported when this module is used.
+"""
+
+import os
+
+import pandas as pd
+
+from averaging import split_sample_average
+from inout import group_point_table
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+    ds = None
+
+EXPORT_FORMATS = {'parquet': 'parquet', 'arrow': 'ipc', 'ipc': 'ipc', 'feather': 'ipc'}
+PARTITION_COLUMNS = ['Mineral', 'Sample']
+
+
+def _check_pyarrow():
+    if pa is None:
+        raise ImportError('Parquet/Arrow export requires pyarrow - install it with "pip install pyarrow"')
+
+
+def area_export_table(output_data):
+    """
+    Tidy the area averages (the output_data of pipeline.analyse_mineral) for export - rename the sample and area
+    columns and the number of datapoints averaged, as in the output spreadsheet.
+    """
+    return output_data.drop(columns='index', errors='ignore').rename(
+        columns={'Project Path (2)': 'Sample', 'Project Path (3)': 'Area', 'counts': 'Number of datapoints averaged'})
+
+
+def sample_export_table(sample_avg_output_data):
+    """
+    Tidy the sample averages (the sample_avg_output_data of pipeline.analyse_mineral) for export, splitting the
+    '<mean> ± <2SD>' strings into a numeric column and a '2SD_<column>' column.
+    """
+    data = sample_avg_output_data.rename(columns={'Project Path (2)': 'Sample', 'counts': 'Number of areas averaged'})
+    data = data.loc[:, ~data.columns.duplicated()]
+    columns = {}
+    for col in data.columns:
+        if col != 'Sample' and (data[col].dtype == 'O' or pd.api.types.is_string_dtype(data[col])):
+            columns[col], columns[f'2SD_{col}'] = split_sample_average(data[col])
+        else:
+            columns[col] = data[col]
+    return pd.DataFrame(columns, index=data.index)
+
+
+def write_partitioned_table(path, data, mintype='olivine', fmt='parquet'):
+    """
+    Write one table for one mineral type as a dataset partitioned by mineral and sample. Any existing data
+    for the same mineral and samples is replaced; other minerals and samples are left as they are.
+
+    Args:
+        path: Folder of the dataset, e.g. 'output_data/points'.
+        data: DataFrame to write, with a 'Sample' column.
+        mintype: Mineral type, written as the 'Mineral' partition.
+        fmt: 'parquet' (default) or 'arrow' (Arrow IPC/Feather, which can be memory-mapped).
+
+    Returns:
+        None
+    """
+    _check_pyarrow()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Format must be one of {list(EXPORT_FORMATS)}')
+    if data.empty:
+        # no rows (e.g. no datapoints of this mineral passed the quality check) - no partitions to write
+        return
+    # the same column can appear twice in the grouped output (e.g. 'Depth' in the sample averages of both the
+    # oxides and the elements) - Parquet needs unique column names
+    data = data.loc[:, ~data.columns.duplicated()].copy()
+    data['Sample'] = data['Sample'].astype(str)
+    data.insert(0, 'Mineral', mintype.lower())
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    ds.write_dataset(table, path, format=EXPORT_FORMATS[fmt],
+                     partitioning=ds.partitioning(pa.schema([(col, pa.string()) for col in PARTITION_COLUMNS]),
+                                                  flavor='hive'),
+                     existing_data_behavior='delete_matching',
+                     basename_template='part-{i}.' + ('parquet' if fmt == 'parquet' else 'arrow'))
+
+
+def export_mineral_results(path, results, mintype='olivine', fmt='parquet'):
+    """
+    Export the per-point, area average and sample average data for one mineral type to the 'points', 'areas' and
+    'samples' datasets in path.
+
+    Args:
+        path: Folder to write the datasets to. Created if it does not already exist.
+        results: Dictionary of results from pipeline.analyse_mineral.
+        mintype: Mineral type.
+        fmt: 'parquet' (default) or 'arrow'.
+
+    Returns:
+        None
+    """
+    _check_pyarrow()
+    os.makedirs(path, exist_ok=True)
+    write_partitioned_table(os.path.join(path, 'points'), group_point_table(results['points']), mintype=mintype, fmt=fmt)
+    write_partitioned_table(os.path.join(path, 'areas'), area_export_table(results['output_data']),
+                            mintype=mintype, fmt=fmt)
+    write_partitioned_table(os.path.join(path, 'samples'), sample_export_table(results['sample_avg_output_data']),
+                            mintype=mintype, fmt=fmt)
+
+
+def load_exported_table(path, table='points', fmt='parquet', minerals=None, samples=None, columns=None):
+    """
+    Read (part of) an exported table back into a DataFrame. Only the partitions for the requested minerals and
+    samples are read.
+
+    Args:
+        path: Folder the datasets were written to.
+        table: 'points', 'areas' or 'samples'.
+        fmt: Format the data was written in.
+        minerals: List of mineral types to read. Default None, i.e. all of them.
+        samples: List of samples to read. Default None, i.e. all of them.
+        columns: List of columns to read. Default None, i.e. all of them.
+
+    Returns:
+        data: DataFrame of the selected data, including the 'Mineral' and 'Sample' columns.
+    """
+    _check_pyarrow()
+    partitioning = ds.partitioning(pa.schema([(col, pa.string()) for col in PARTITION_COLUMNS]), flavor='hive')
+    dataset = ds.dataset(os.path.join(path, table), format=EXPORT_FORMATS[fmt], partitioning=partitioning)
+    # each mineral has different columns (e.g. Fo for olivine, Mg# for pyroxene), so combine the schemas of all
+    # of the files rather than using the first one found (this only reads the file metadata)
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()] +
+                              [partitioning.schema])
+    dataset = ds.dataset(os.path.join(path, table), format=EXPORT_FORMATS[fmt], partitioning=partitioning,
+                         schema=schema)
+    condition = None
+    for col, values in [('Mineral', minerals), ('Sample', samples)]:
+        if values is not None:
+            expr = ds.field(col).isin([str(value).lower() if col == 'Mineral' else str(value) for value in values])
+            condition = expr if condition is None else condition & expr
+    if columns is not None:
+        columns = PARTITION_COLUMNS + [col for col in columns if col not in PARTITION_COLUMNS]
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
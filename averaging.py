@@ -83,3 +83,113 @@ def average_over_samples(agg_data, oxides=True):
 
     sample_average_data = agg_data
     return sample_average_data
+
+
+def split_sample_average(values):
+    """
+    Split a column of sample averages written by average_over_samples as strings of the form
+    '<mean> ± <2SD>' back into numbers.
+
+    Args:
+        values: Series of sample averages. Numeric Series are passed through with a 2SD of NaN.
+
+    Returns:
+        mean: Series of the averages.
+        sd: Series of the 2 * standard deviations.
+    """
+    if len(values) == 0 or (values.dtype != 'O' and not pd.api.types.is_string_dtype(values)):
+        # (no samples, e.g. if no datapoints passed the quality check - nothing to split)
+        return pd.to_numeric(values, errors='coerce'), pd.Series(np.nan, index=values.index)
+    split = values.astype(str).str.split('±', n=1, expand=True)
+    mean = pd.to_numeric(split[0].str.strip(), errors='coerce')
+    if len(split.columns) < 2:
+        return mean, pd.Series(np.nan, index=values.index)
+    sd = pd.to_numeric(split[1].str.strip(), errors='coerce')
+    return mean, sd
+
+
+def bootstrap_sample_averages(data, columns=None, n_boot=1000, ci=95., seed=None, max_draws=20000000):
+    """
+    Calculate bootstrap confidence intervals on the sample averages, by resampling (with replacement)
+    the areas within each sample and then the datapoints within each resampled area, and averaging
+    in the same way as average_over_areas and average_over_samples.
+
+    The resampling is done with arrays of random indices for many replicates at once, rather than
+    looping over the replicates, so thousands of replicates of a full dataset take seconds.
+
+    Args:
+        data: DataFrame of quality-checked datapoints, with the 'Project Path (2)' (sample) and
+              'Project Path (3)' (area) columns.
+        columns: Columns to calculate the confidence intervals for. Default None, in which case
+                 the oxides are used.
+        n_boot: Number of bootstrap replicates.
+        ci: Width of the confidence interval, in percent. Default 95, i.e. the 2.5th to 97.5th percentiles.
+        seed: Seed for the random number generator, for reproducible results.
+        max_draws: Maximum number of resampled datapoints to hold in memory at once. The replicates
+                   are processed in chunks to stay below this.
+
+    Returns:
+        bootstrap: DataFrame indexed by sample, with the sample average of each column and the lower and
+                   upper bounds of its confidence interval (CI_lower_<column>, CI_upper_<column>).
+    """
+    if columns is None:
+        columns = [name for name in ['Si', 'Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Ni', 'Fe', 'Ca', 'Na', 'K']
+                   if name in data.columns]
+    if len(data) == 0:
+        # no datapoints passed the quality check - no samples to resample
+        return pd.DataFrame({f'{prefix}{column}': pd.Series(dtype=float)
+                             for column in columns for prefix in ['', 'CI_lower_', 'CI_upper_']},
+                            index=pd.Index([], name='Project Path (2)'))
+    rng = np.random.default_rng(seed)
+
+    # sort the datapoints by sample and then area, so each area is a contiguous block of rows
+    # and the areas of each sample are a contiguous block of areas
+    sample_codes, samples = pd.factorize(data['Project Path (2)'])
+    area_codes = data.groupby(['Project Path (2)', 'Project Path (3)'], sort=False).ngroup().to_numpy()
+    order = np.lexsort((area_codes, sample_codes))
+    values = data[columns].to_numpy(dtype=float)[order]
+    area_codes = area_codes[order]
+    sample_codes = sample_codes[order]
+
+    area_start = np.flatnonzero(np.r_[True, area_codes[1:] != area_codes[:-1]])
+    area_count = np.diff(np.r_[area_start, len(values)])
+    area_sample = sample_codes[area_start]
+    sample_area_start = np.flatnonzero(np.r_[True, area_sample[1:] != area_sample[:-1]])
+    sample_area_count = np.diff(np.r_[sample_area_start, len(area_start)])
+
+    chunk = int(max(1, min(n_boot, max_draws // max(len(values), 1))))
+    replicates = []
+    for start in range(0, n_boot, chunk):
+        n_rep = min(chunk, n_boot - start)
+        # resample the areas within each sample - one slot per area, for each replicate
+        chosen = (sample_area_start[area_sample] +
+                  (rng.random((n_rep, len(area_start))) * sample_area_count[area_sample]).astype(int)).ravel()
+        counts = area_count[chosen]
+        # then resample the datapoints within each chosen area
+        # (single precision is enough for the offsets into an area, and halves the memory traffic,
+        # but rounding can then give an offset equal to the area size so clip it)
+        area_size = np.repeat(counts.astype(np.float32), counts)
+        offset = (rng.random(len(area_size), dtype=np.float32) * area_size).astype(np.int32)
+        np.minimum(offset, area_size - 1, out=offset, casting='unsafe')
+        idx = np.repeat(area_start[chosen], counts) + offset
+        slot_start = np.r_[0, np.cumsum(counts)[:-1]]
+        area_means = np.add.reduceat(np.take(values, idx, axis=0), slot_start, axis=0) / counts[:, np.newaxis]
+        # average the areas of each sample
+        area_means = area_means.reshape(n_rep, len(area_start), len(columns))
+        replicates.append(np.add.reduceat(area_means, sample_area_start, axis=1) /
+                          sample_area_count[np.newaxis, :, np.newaxis])
+    replicates = np.concatenate(replicates)
+
+    lower, upper = np.percentile(replicates, [50 - ci / 2, 50 + ci / 2], axis=0)
+    # the sample average itself, for reference - the mean of the area means, as in average_over_samples
+    area_means = np.add.reduceat(values, area_start, axis=0) / area_count[:, np.newaxis]
+    sample_means = np.add.reduceat(area_means, sample_area_start, axis=0) / sample_area_count[:, np.newaxis]
+
+    bootstrap = {}
+    for idx, column in enumerate(columns):
+        bootstrap[column] = sample_means[:, idx]
+        bootstrap[f'CI_lower_{column}'] = lower[:, idx]
+        bootstrap[f'CI_upper_{column}'] = upper[:, idx]
+    bootstrap = pd.DataFrame(bootstrap, index=pd.Index(samples[area_sample[sample_area_start]],
+                                                       name='Project Path (2)'))
+    return bootstrap
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Depth-profile analysis of the quality-checked results. The data are sorted by depth once,
+and then binned or rolling-window statistics (mean, 2SD, min and max) are calculated for
+each variable using cumulative sums, so that the cost grows linearly with the number of points
+rather than with the number of points multiplied by the window size.
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import os
+
+from plotting_functions import save_figure
+
+# Default variable to plot for each mineral type in the downhole profiles
+DEPTH_PROFILE_KEYS = {'olivine': 'Fo', 'orthopyroxene': 'Mg#', 'clinopyroxene': 'Mg#', 'spinel': 'CrN'}
+
+
+def depth_profile_table(data, ratios, depth_col='Depth'):
+    """
+    Group the quality-checked oxide data and the ratios (Fo/Mg#/CrN etc.) into one DataFrame
+    sorted by depth, ready to be passed into binned_depth_statistics or rolling_depth_statistics.
+
+    Args:
+        data: DataFrame of (quality-checked) oxide data containing a depth column.
+        ratios: DataFrame of cation ratios, with the same index as data.
+        depth_col: Name of the depth column. Default 'Depth'.
+
+    Returns:
+        profile: DataFrame with the depth, oxide and ratio columns, sorted by depth.
+                 Points without a depth are discarded.
+    """
+    if depth_col not in data.columns:
+        raise ValueError(f'No "{depth_col}" column found in input data - cannot generate a depth profile')
+    names = [depth_col, 'Si', 'Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Ni', 'Fe', 'Ca', 'Na', 'K']
+    names = [name for name in names if name in data.columns]
+    # olivine ratios include 'Fe' (the fayalite fraction), which clashes with the FeO data
+    profile = data[names].join(ratios.drop(columns=[depth_col], errors='ignore'), rsuffix='_ratio')
+    profile = profile[profile[depth_col].notna()]
+    # stable sort, so points at the same depth keep their original order
+    return profile.sort_values(depth_col, kind='stable')
+
+
+def _prefix_sums(values):
+    """
+    Cumulative count, sum and sum of squares of a (points x variables) array, with a leading row
+    of zeros so that the sum over values[lo:hi] is prefix[hi] - prefix[lo]. NaNs are ignored.
+    The column means are subtracted first to reduce the loss of precision in the sum of squares.
+    """
+    valid = ~np.isnan(values)
+    offset = np.nanmean(values, axis=0)
+    offset = np.where(np.isnan(offset), 0, offset)
+    centred = np.where(valid, values - offset, 0)
+    zeros = np.zeros((1, values.shape[1]))
+    count = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    total = np.concatenate([zeros, np.cumsum(centred, axis=0)])
+    total_sq = np.concatenate([zeros, np.cumsum(centred ** 2, axis=0)])
+    return count, total, total_sq, offset
+
+
+def _window_moments(values, lo, hi):
+    """
+    Mean and 2 * standard deviation (ddof=1, as in pandas) of values[lo:hi] for every window,
+    obtained from differences of the prefix sums.
+    """
+    count, total, total_sq, offset = _prefix_sums(values)
+    n = count[hi] - count[lo]
+    s = total[hi] - total[lo]
+    s2 = total_sq[hi] - total_sq[lo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = s / n + offset
+        var = (s2 - s ** 2 / n) / (n - 1)
+    var = np.where(n > 1, np.maximum(var, 0), np.nan)
+    return n, mean, 2 * np.sqrt(var)
+
+
+def _range_extrema(values, lo, hi):
+    """
+    Minimum and maximum of values[lo:hi] for every (non-empty) window, using a sparse table so that
+    each query is answered in constant time after an O(n log n) set-up. NaNs are ignored.
+    """
+    out_min = np.full((len(lo), values.shape[1]), np.nan)
+    out_max = np.full((len(lo), values.shape[1]), np.nan)
+    if len(lo) == 0:
+        return out_min, out_max
+    # level k of the table holds the extrema of the 2**k values starting at each row, so any window
+    # is covered by two (overlapping) entries of the level with 2**k <= window length
+    levels = np.floor(np.log2(np.maximum(hi - lo, 1))).astype(int)
+    table_min = values
+    table_max = values
+    for level in range(levels.max() + 1):
+        if level > 0:
+            half = 1 << (level - 1)
+            table_min = np.fmin(table_min[:-half], table_min[half:])
+            table_max = np.fmax(table_max[:-half], table_max[half:])
+        sel = levels == level
+        if sel.any():
+            width = 1 << level
+            out_min[sel] = np.fmin(table_min[lo[sel]], table_min[hi[sel] - width])
+            out_max[sel] = np.fmax(table_max[lo[sel]], table_max[hi[sel] - width])
+    return out_min, out_max
+
+
+def _stats_frame(depth, n, mean, sd2, vmin, vmax, columns, depth_name):
+    """
+    Collect the window statistics into a DataFrame, using the same naming as averaging.py
+    (2SD_<variable>) plus min_<variable> and max_<variable>.
+    """
+    out = {depth_name: depth}
+    for idx, col in enumerate(columns):
+        out[col] = mean[:, idx]
+        out[f'2SD_{col}'] = sd2[:, idx]
+        out[f'min_{col}'] = vmin[:, idx]
+        out[f'max_{col}'] = vmax[:, idx]
+        out[f'counts_{col}'] = n[:, idx].astype(int)
+    return pd.DataFrame(out)
+
+
+def binned_depth_statistics(profile, columns=None, bin_width=10., bin_edges=None, depth_col='Depth'):
+    """
+    Calculate the mean, 2 * standard deviation, minimum and maximum of each variable in fixed depth bins.
+
+    Args:
+        profile: DataFrame sorted by depth, e.g. the output of depth_profile_table.
+        columns: Variables to calculate the statistics for. Default None, in which case all
+                 numeric columns except the depth are used.
+        bin_width: Width of the depth bins, in the same units as the depth column. Ignored if
+                   bin_edges is specified.
+        bin_edges: Optional array of bin edges to use instead of a regular spacing.
+        depth_col: Name of the depth column. Default 'Depth'.
+
+    Returns:
+        binned: DataFrame with one row per non-empty bin, with the bin centre in the depth column.
+    """
+    if columns is None:
+        columns = [col for col in profile.select_dtypes('number').columns if col != depth_col]
+    depth = profile[depth_col].to_numpy(dtype=float)
+    if np.any(np.diff(depth) < 0):
+        raise ValueError('Data must be sorted by depth - use depth_profile_table first')
+    if bin_edges is None and len(depth) == 0:
+        # no datapoints (e.g. none passed the quality check) - a single bin, which will be empty
+        bin_edges = [0., bin_width]
+    elif bin_edges is None:
+        start = np.floor(depth[0] / bin_width) * bin_width
+        bin_edges = np.arange(start, depth[-1] + bin_width, bin_width)
+        if len(bin_edges) < 2 or bin_edges[-1] <= depth[-1]:
+            bin_edges = np.append(bin_edges, bin_edges[-1] + bin_width)
+    bin_edges = np.asarray(bin_edges, dtype=float)
+
+    # since the depths are sorted, each bin is a contiguous run of rows [lo, hi)
+    bounds = np.searchsorted(depth, bin_edges, side='left')
+    lo, hi = bounds[:-1], bounds[1:]
+    nonempty = hi > lo
+    lo, hi = lo[nonempty], hi[nonempty]
+    centres = 0.5 * (bin_edges[:-1] + bin_edges[1:])[nonempty]
+
+    values = profile[columns].to_numpy(dtype=float)
+    n, mean, sd2 = _window_moments(values, lo, hi)
+    vmin, vmax = _range_extrema(values, lo, hi)
+    return _stats_frame(centres, n, mean, sd2, vmin, vmax, columns, depth_col)
+
+
+def rolling_depth_statistics(profile, columns=None, window=10., depth_col='Depth'):
+    """
+    Calculate the mean, 2 * standard deviation, minimum and maximum of each variable over a window
+    of fixed depth extent centred on each point (i.e. all points within +- window / 2 of it).
+
+    Args:
+        profile: DataFrame sorted by depth, e.g. the output of depth_profile_table.
+        columns: Variables to calculate the statistics for. Default None, in which case all
+                 numeric columns except the depth are used.
+        window: Full width of the rolling window, in the same units as the depth column.
+        depth_col: Name of the depth column. Default 'Depth'.
+
+    Returns:
+        rolling: DataFrame with one row per point, in the same order as profile.
+    """
+    if columns is None:
+        columns = [col for col in profile.select_dtypes('number').columns if col != depth_col]
+    depth = profile[depth_col].to_numpy(dtype=float)
+    if np.any(np.diff(depth) < 0):
+        raise ValueError('Data must be sorted by depth - use depth_profile_table first')
+    lo = np.searchsorted(depth, depth - window / 2, side='left')
+    hi = np.searchsorted(depth, depth + window / 2, side='right')
+
+    values = profile[columns].to_numpy(dtype=float)
+    n, mean, sd2 = _window_moments(values, lo, hi)
+    vmin, vmax = _range_extrema(values, lo, hi)
+    rolling = _stats_frame(depth, n, mean, sd2, vmin, vmax, columns, depth_col)
+    rolling.index = profile.index
+    return rolling
+
+
+def plot_depth_profiles(profiles, rolling=None, keys=None, depth_col='Depth',
+                        fname='depth_profiles.png', output_path='./plots', rasterize=False, dpi=300):
+    """
+    Plot downhole profiles for all mineral types side by side, with depth increasing downwards.
+
+    Args:
+        profiles: Dictionary of DataFrames with the mineral type as the key, e.g. the outputs of
+                  depth_profile_table.
+        rolling: Optional dictionary of the corresponding outputs of rolling_depth_statistics (or
+                 binned_depth_statistics). If given, the mean is plotted as a line and the 2SD as a
+                 shaded band over the top of the datapoints.
+        keys: Dictionary of the variable to plot for each mineral type. Defaults to DEPTH_PROFILE_KEYS.
+        depth_col: Name of the depth column. Default 'Depth'.
+        fname: Name of the file to save the figure to.
+        output_path: Where to save the plot, default is a new folder called 'plots' within the current folder.
+        rasterize: If True, draw the datapoints, rolling lines and 2SD bands as an image at the given dpi, keeping
+                   the axes and labels as vectors (see plotting_functions.save_figure).
+        dpi: Resolution of the rasterized layers if rasterize is True.
+
+    Returns:
+        None
+    """
+    if keys is None:
+        keys = DEPTH_PROFILE_KEYS
+    mintypes = [mintype for mintype in profiles.keys() if keys.get(mintype) in profiles[mintype].columns]
+    if not mintypes:
+        raise ValueError('None of the requested variables were found in the depth profile data')
+
+    fig, axes = plt.subplots(1, len(mintypes), sharey=True, squeeze=False,
+                             figsize=(4 * len(mintypes), 8))
+    for ax, mintype in zip(axes[0], mintypes):
+        key = keys[mintype]
+        profile = profiles[mintype]
+        ax.scatter(profile[key], profile[depth_col], marker='.', s=4, alpha=0.3, color='grey')
+        if rolling is not None and mintype in rolling:
+            stats = rolling[mintype]
+            ax.plot(stats[key], stats[depth_col], linewidth=2)
+            ax.fill_betweenx(stats[depth_col], stats[key] - stats[f'2SD_{key}'],
+                             stats[key] + stats[f'2SD_{key}'], alpha=0.3)
+        ax.set_title(mintype.capitalize())
+        ax.set_xlabel(key)
+        ax.grid()
+    axes[0][0].set_ylabel(depth_col)
+    # depth increases downhole
+    axes[0][0].invert_yaxis()
+
+    # Create output path if it does not already exist
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    save_figure(output_path + '/' + fname, rasterize=rasterize, dpi=dpi, bbox_inches='tight')
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Fe-Mg exchange equilibrium between olivine, orthopyroxene and clinopyroxene.
+
+For a pair of minerals 1 and 2, the Fe-Mg exchange coefficient is
+    Kd = (Fe/Mg)_1 / (Fe/Mg)_2 = [(1 - X_1) / X_1] / [(1 - X_2) / X_2]
+where X is the Mg# (Fo for olivine, as a fraction) calculated by get_composition.check_mineral_composition from
+the area averages. Minerals in Fe-Mg equilibrium have a Kd within a fairly narrow range for each pair, so pairs
+with a Kd outside the range (DEFAULT_KD_RANGES, or your own) are flagged.
+
+Three tables are calculated, each for every pair of minerals at once as array operations:
+    kd_table(...): the sample averages of the Mg#, paired by sample, with the 2SD of Kd propagated from the 2SD
+                   of the Mg# over the areas of each sample (as in averaging.average_over_samples).
+    kd_table(..., by_area=True): the area averages, paired by sample and area name, for where areas of the
+                                 different minerals were measured together (e.g. minerals in contact).
+    area_pair_kd(...): every area of one mineral against every area of the other within each sample, from the
+                       (samples x areas) arrays of Mg# of each mineral broadcast against each other, to show the
+                       spread of Kd within each sample.
+"""
+
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from inout import get_sheet_prefix
+from plotting_functions import save_figure
+
+# column of the ratios holding the Mg# of each mineral
+MG_NUMBER_COLUMNS = {'olivine': 'Fo', 'orthopyroxene': 'Mg#', 'clinopyroxene': 'Mg#'}
+EQUILIBRIUM_PAIRS = [('olivine', 'orthopyroxene'), ('olivine', 'clinopyroxene'), ('orthopyroxene', 'clinopyroxene')]
+# Broad ranges of Kd (with all Fe as Fe2+) for mantle peridotites equilibrated at ~900-1300 C - narrow these for
+# a known temperature and pressure
+DEFAULT_KD_RANGES = {('olivine', 'orthopyroxene'): (1.0, 1.3),
+                     ('olivine', 'clinopyroxene'): (1.1, 1.7),
+                     ('orthopyroxene', 'clinopyroxene'): (1.0, 1.5)}
+
+
+def get_pair_name(pair):
+    """
+    Name of a mineral pair as in the output sheets, e.g. 'Olivine-Opx'.
+    """
+    return '-'.join(get_sheet_prefix(mintype) for mintype in pair)
+
+
+def area_mg_numbers(agg_ratios, mintype='olivine'):
+    """
+    Mg# of each area average of a mineral.
+
+    Args:
+        agg_ratios: Ratios of the area averages (the 'agg_ratios' of pipeline.analyse_mineral), indexed by
+                    sample and area.
+        mintype: Mineral type.
+
+    Returns:
+        mg_numbers: Series of the Mg# of each area, indexed by sample and area.
+    """
+    if mintype not in MG_NUMBER_COLUMNS:
+        raise ValueError(f'Fe-Mg equilibrium can only be calculated for {list(MG_NUMBER_COLUMNS)}')
+    return agg_ratios[MG_NUMBER_COLUMNS[mintype]].astype(float).rename('Mg#')
+
+
+def sample_mg_numbers(mg_numbers):
+    """
+    Average the Mg# of the areas of each sample.
+
+    Args:
+        mg_numbers: Series of the Mg# of each area, from area_mg_numbers.
+
+    Returns:
+        averages: DataFrame indexed by sample, with the mean Mg# ('Mg#'), its 2SD over the areas ('2SD_Mg#') and
+                  the number of areas.
+    """
+    grouped = mg_numbers.groupby(level=0, sort=False)
+    return pd.DataFrame({'Mg#': grouped.mean(), '2SD_Mg#': 2 * grouped.std(), 'Number of areas': grouped.count()})
+
+
+def fe_mg_kd(mg_1, mg_2):
+    """
+    Fe-Mg exchange coefficient Kd = (Fe/Mg)_1 / (Fe/Mg)_2 from the Mg# (as fractions) of the two minerals.
+    Works element-wise on arrays of any (broadcastable) shapes.
+    """
+    mg_1 = np.asarray(mg_1, dtype=float)
+    mg_2 = np.asarray(mg_2, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ((1 - mg_1) / mg_1) / ((1 - mg_2) / mg_2)
+
+
+def fe_mg_kd_2sd(mg_1, sd_1, mg_2, sd_2):
+    """
+    2SD of Kd from the 2SDs of the Mg# of the two minerals, by linear error propagation
+    (d ln Kd / d X = -1 / (X (1 - X)) for each mineral).
+    """
+    mg_1, sd_1, mg_2, sd_2 = (np.asarray(values, dtype=float) for values in (mg_1, sd_1, mg_2, sd_2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.hypot(sd_1 / (mg_1 * (1 - mg_1)), sd_2 / (mg_2 * (1 - mg_2)))
+    return fe_mg_kd(mg_1, mg_2) * relative
+
+
+def _get_pairs(mg_numbers, pairs, kd_ranges):
+    """
+    Mineral pairs that both have data, and the lower and upper limits of Kd for each of them.
+    """
+    if pairs is None:
+        pairs = EQUILIBRIUM_PAIRS
+    kd_ranges = dict(DEFAULT_KD_RANGES, **(kd_ranges or {}))
+    pairs = [tuple(pair) for pair in pairs if pair[0] in mg_numbers and pair[1] in mg_numbers]
+    missing = [pair for pair in pairs if pair not in kd_ranges]
+    if missing:
+        raise ValueError(f'No equilibrium Kd range given for {missing}')
+    limits = np.array([kd_ranges[pair] for pair in pairs], dtype=float).reshape(-1, 2)
+    return pairs, limits
+
+
+def kd_table(mg_numbers, by_area=False, pairs=None, kd_ranges=None):
+    """
+    Kd and equilibrium flag for every mineral pair in every sample (or area) they are both found in.
+
+    Args:
+        mg_numbers: Dictionary of {mineral type: Series of the Mg# of each area}, from area_mg_numbers.
+        by_area: If False (default), pair the sample averages of the Mg# by sample. If True, pair the area
+                 averages by sample and area name.
+        pairs: List of (mineral 1, mineral 2) pairs. Default None, i.e. EQUILIBRIUM_PAIRS.
+        kd_ranges: Dictionary of {(mineral 1, mineral 2): (lowest Kd, highest Kd)} in equilibrium, replacing the
+                   DEFAULT_KD_RANGES for those pairs.
+
+    Returns:
+        kd: Tidy DataFrame with one row per sample (or area) and pair, and columns 'Sample' (and 'Area'), 'Pair',
+            'Mg# 1', 'Mg# 2', 'Kd', 'Kd min', 'Kd max' and 'In equilibrium'. For the sample averages, the 2SDs
+            ('2SD_Mg# 1', '2SD_Mg# 2', '2SD_Kd') and the number of areas of each mineral are included too.
+    """
+    pairs, limits = _get_pairs(mg_numbers, pairs, kd_ranges)
+    if not pairs:
+        return pd.DataFrame()
+    minerals = list(dict.fromkeys(mintype for pair in pairs for mintype in pair))
+    if by_area:
+        tables = {mintype: mg_numbers[mintype].to_frame('Mg#') for mintype in minerals}
+    else:
+        tables = {mintype: sample_mg_numbers(mg_numbers[mintype]) for mintype in minerals}
+    columns = ['Mg#'] if by_area else ['Mg#', '2SD_Mg#', 'Number of areas']
+
+    # (samples x minerals) arrays of each column, aligned on every sample (or area) found in any of the minerals
+    keys = tables[minerals[0]].index.append([tables[mintype].index for mintype in minerals[1:]]).unique()
+    values = {col: np.column_stack([tables[mintype][col].reindex(keys).to_numpy(dtype=float)
+                                    for mintype in minerals])
+              for col in columns}
+    first = [minerals.index(pair[0]) for pair in pairs]
+    second = [minerals.index(pair[1]) for pair in pairs]
+
+    # (samples x pairs) arrays for every pair at once
+    mg_1, mg_2 = values['Mg#'][:, first], values['Mg#'][:, second]
+    kd = fe_mg_kd(mg_1, mg_2)
+    columns = {'Pair': np.tile([get_pair_name(pair) for pair in pairs], len(keys)),
+               'Mg# 1': mg_1.ravel(), 'Mg# 2': mg_2.ravel()}
+    if not by_area:
+        sd_1, sd_2 = values['2SD_Mg#'][:, first], values['2SD_Mg#'][:, second]
+        columns.update({'2SD_Mg# 1': sd_1.ravel(), '2SD_Mg# 2': sd_2.ravel()})
+    columns['Kd'] = kd.ravel()
+    if not by_area:
+        columns['2SD_Kd'] = fe_mg_kd_2sd(mg_1, sd_1, mg_2, sd_2).ravel()
+        columns['Number of areas 1'] = values['Number of areas'][:, first].ravel()
+        columns['Number of areas 2'] = values['Number of areas'][:, second].ravel()
+    columns['Kd min'] = np.tile(limits[:, 0], len(keys))
+    columns['Kd max'] = np.tile(limits[:, 1], len(keys))
+    with np.errstate(invalid='ignore'):
+        columns['In equilibrium'] = ((limits[:, 0] <= kd) & (kd <= limits[:, 1])).ravel()
+
+    key_columns = {'Sample': np.repeat(keys.get_level_values(0), len(pairs))}
+    if by_area:
+        key_columns['Area'] = np.repeat(keys.get_level_values(1), len(pairs))
+    table = pd.DataFrame(dict(key_columns, **columns))
+    # only the samples (or areas) where both minerals of the pair were found
+    table = table[np.isfinite(mg_1.ravel()) & np.isfinite(mg_2.ravel())].reset_index(drop=True)
+    if not by_area:
+        table = table.astype({'Number of areas 1': int, 'Number of areas 2': int})
+    return table
+
+
+def _pad_by_sample(mg_numbers, samples):
+    """
+    Arrange the Mg# of the areas into a (samples x areas) array, padded with NaN, with the areas of each sample
+    in their original order.
+
+    Returns:
+        values: Array of the Mg#.
+        areas: Object array of the matching area names (None for padding).
+    """
+    sample_codes = samples.get_indexer(mg_numbers.index.get_level_values(0))
+    keep = sample_codes >= 0
+    sample_codes = sample_codes[keep]
+    position = pd.Series(sample_codes).groupby(sample_codes).cumcount().to_numpy()
+    width = position.max() + 1 if len(position) else 0
+    values = np.full((len(samples), width), np.nan)
+    areas = np.full((len(samples), width), None, dtype=object)
+    values[sample_codes, position] = mg_numbers.to_numpy(dtype=float)[keep]
+    areas[sample_codes, position] = np.asarray(mg_numbers.index.get_level_values(1), dtype=object)[keep]
+    return values, areas
+
+
+def area_pair_kd(mg_numbers, pairs=None, kd_ranges=None):
+    """
+    Kd of every area of one mineral against every area of the other, within each sample.
+
+    Args:
+        mg_numbers: Dictionary of {mineral type: Series of the Mg# of each area}, from area_mg_numbers.
+        pairs: List of (mineral 1, mineral 2) pairs. Default None, i.e. EQUILIBRIUM_PAIRS.
+        kd_ranges: Equilibrium Kd ranges, see kd_table.
+
+    Returns:
+        kd: Tidy DataFrame with one row per pair of areas, and columns 'Sample', 'Pair', 'Area 1', 'Area 2',
+            'Mg# 1', 'Mg# 2', 'Kd' and 'In equilibrium'.
+    """
+    pairs, limits = _get_pairs(mg_numbers, pairs, kd_ranges)
+    tables = []
+    for pair, (kd_min, kd_max) in zip(pairs, limits):
+        mg_1, mg_2 = mg_numbers[pair[0]], mg_numbers[pair[1]]
+        samples = pd.Index(pd.unique(mg_1.index.get_level_values(0)))
+        samples = samples[samples.isin(mg_2.index.get_level_values(0))]
+        values_1, areas_1 = _pad_by_sample(mg_1, samples)
+        values_2, areas_2 = _pad_by_sample(mg_2, samples)
+        # (samples x areas 1 x areas 2)
+        kd = fe_mg_kd(values_1[:, :, np.newaxis], values_2[:, np.newaxis, :])
+        sample_idx, idx_1, idx_2 = np.nonzero(np.isfinite(values_1)[:, :, np.newaxis] &
+                                              np.isfinite(values_2)[:, np.newaxis, :])
+        kd = kd[sample_idx, idx_1, idx_2]
+        with np.errstate(invalid='ignore'):
+            in_equilibrium = (kd_min <= kd) & (kd <= kd_max)
+        tables.append(pd.DataFrame({'Sample': np.asarray(samples, dtype=object)[sample_idx],
+                                    'Pair': get_pair_name(pair),
+                                    'Area 1': areas_1[sample_idx, idx_1], 'Area 2': areas_2[sample_idx, idx_2],
+                                    'Mg# 1': values_1[sample_idx, idx_1], 'Mg# 2': values_2[sample_idx, idx_2],
+                                    'Kd': kd, 'In equilibrium': in_equilibrium}))
+    if not tables:
+        return pd.DataFrame(columns=['Sample', 'Pair', 'Area 1', 'Area 2', 'Mg# 1', 'Mg# 2', 'Kd', 'In equilibrium'])
+    return pd.concat(tables, ignore_index=True)
+
+
+def calc_equilibrium(results, by_area=False, kd_ranges=None):
+    """
+    Calculate the Fe-Mg equilibrium tables from the results of the analysis.
+
+    Args:
+        results: Dictionary of {mineral type: dictionary of results from pipeline.analyse_mineral}. Mineral types
+                 other than olivine and the pyroxenes are ignored.
+        by_area: If True, also pair the area averages of the minerals by sample and area name.
+        kd_ranges: Equilibrium Kd ranges, see kd_table.
+
+    Returns:
+        tables: Dictionary with the 'samples' table from kd_table, the 'area pairs' table from area_pair_kd and,
+                if by_area is True, the 'areas' table from kd_table(..., by_area=True).
+    """
+    mg_numbers = {mintype: area_mg_numbers(results[mintype]['agg_ratios'], mintype=mintype)
+                  for mintype in MG_NUMBER_COLUMNS if mintype in results}
+    tables = {'samples': kd_table(mg_numbers, kd_ranges=kd_ranges),
+              'area pairs': area_pair_kd(mg_numbers, kd_ranges=kd_ranges)}
+    if by_area:
+        tables['areas'] = kd_table(mg_numbers, by_area=True, kd_ranges=kd_ranges)
+    return tables
+
+
+def plot_equilibrium(sample_kd, area_kd=None, fname='fe_mg_equilibrium.png', output_path='./plots',
+                     rasterize=False, dpi=300):
+    """
+    Plot the Kd of each sample (with its 2SD) for each mineral pair, coloured by whether it is within the
+    equilibrium range (shaded), with the Kd of all of the area pairs of each sample behind them.
+
+    Args:
+        sample_kd: Sample table from kd_table.
+        area_kd: Area pairs table from area_pair_kd. Default None, i.e. don't plot the area pairs.
+        fname: Name of the file to save the figure to.
+        output_path: Where to save the plot, default is a new folder called 'plots' within the current folder.
+        rasterize: If True, draw the points as an image at the given dpi (see plotting_functions.save_figure).
+        dpi: Resolution of the rasterized layers if rasterize is True.
+
+    Returns:
+        None
+    """
+    pair_names = list(pd.unique(sample_kd['Pair']))
+    samples = pd.Index(pd.unique(sample_kd['Sample']))
+    fig, axes = plt.subplots(len(pair_names), 1, sharex=True, squeeze=False,
+                             figsize=(max(6, min(0.3 * len(samples), 20)), 3 * max(len(pair_names), 1)))
+    axes = axes[:, 0]
+    for ax, pair_name in zip(axes, pair_names):
+        kd = sample_kd[sample_kd['Pair'] == pair_name]
+        ax.axhspan(kd['Kd min'].iloc[0], kd['Kd max'].iloc[0], color='tab:green', alpha=0.15,
+                   label='Equilibrium range')
+        if area_kd is not None and len(area_kd):
+            areas = area_kd[area_kd['Pair'] == pair_name]
+            ax.scatter(samples.get_indexer(areas['Sample']), areas['Kd'], color='0.6', s=6, alpha=0.5,
+                       label='Area pairs')
+        x = samples.get_indexer(kd['Sample'])
+        for in_equilibrium, colour, label in [(True, 'tab:green', 'In equilibrium'),
+                                              (False, 'tab:red', 'Not in equilibrium')]:
+            selected = kd['In equilibrium'].to_numpy() == in_equilibrium
+            ax.errorbar(x[selected], kd['Kd'][selected], yerr=kd['2SD_Kd'][selected], fmt='o', color=colour,
+                        label=label)
+        ax.set_ylabel(f'{pair_name} Kd')
+        ax.grid()
+    axes[0].legend(fontsize='small')
+    axes[0].set_title('Fe-Mg exchange equilibrium')
+    # a label for every sample is only readable for a few dozen of them
+    if len(samples) <= 40:
+        axes[-1].set_xticks(np.arange(len(samples)), samples, rotation=90)
+    axes[-1].set_xlabel('Sample')
+
+    # Create output path if it does not already exist
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    save_figure(output_path + '/' + fname, rasterize=rasterize, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Small local HTTP service for calculating mineral formulae, ratios (Fo/Mg#/CrN etc.) and quality-check
+verdicts for oxide analyses pasted in from other tools, without running the whole spreadsheet pipeline.
+
+Start the service with:
+    python formula_service.py --port 8050
+
+Endpoints:
+    GET  /health          - returns {"status": "ok"}
+    POST /formula         - a single analysis as a JSON object, e.g.
+                            {"mintype": "olivine", "SiO2": 40.8, "MgO": 49.0, "FeO": 9.5, ...}
+    POST /formula/batch   - several analyses, either as JSON {"mintype": "olivine", "analyses": [{...}, ...]}
+                            or as CSV (Content-Type: text/csv) with the mineral type given as ?mintype=olivine.
+                            Add ?format=csv (or send Accept: text/csv) to get CSV back.
+
+The oxides can be named either as in the output spreadsheet (e.g. 'SiO2', 'FeO') or as in the input
+spreadsheet (e.g. 'Si', 'Fe'). Oxides that are not given are taken to be zero. The cation quality check
+error can be given with "error" (or ?error=), otherwise the default for the mineral type is used.
+
+Requests that arrive at the same time are grouped together ("micro-batched") and calculated with a single
+call to calc_composition per mineral type, so many small concurrent requests cost about the same
+as one large one. See formula_service_loadtest.py for measuring latency and throughput.
+"""
+
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from get_composition import calc_composition
+from inout import OXIDE_NAMES
+from quality_checking import cation_quality_mask
+
+# Map the oxide names used in the output spreadsheet onto the column names of the input spreadsheet
+ELEMENT_COLUMNS = dict({val: key for key, val in OXIDE_NAMES.items()}, Na2O='Na', K2O='K')
+ELEMENT_NAMES = ['Si', 'Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Ni', 'Fe', 'Ca', 'Na']
+
+
+def prepare_analyses(analyses):
+    """
+    Convert a DataFrame of pasted oxide analyses into the same format as the data from inout.load_and_filter.
+
+    Args:
+        analyses: DataFrame with one row per analysis, with the oxide columns named either as in the output
+                  spreadsheet (e.g. 'SiO2') or the input spreadsheet (e.g. 'Si').
+
+    Returns:
+        data: DataFrame of the oxide columns (with the input spreadsheet column names, missing oxides set to zero)
+              and 'Total' - the sum of the oxides if it was not given. Other columns are left out, and values
+              that aren't numbers become NaN.
+    """
+    data = analyses.rename(columns=ELEMENT_COLUMNS)
+    for name in ELEMENT_NAMES:
+        if name not in data.columns:
+            data[name] = 0.
+    oxide_cols = ELEMENT_NAMES + (['K'] if 'K' in data.columns else [])
+    for col in oxide_cols:
+        if not pd.api.types.is_numeric_dtype(data[col]):
+            data[col] = pd.to_numeric(data[col], errors='coerce')
+    if 'Total' not in data.columns:
+        data['Total'] = data[oxide_cols].sum(axis=1)
+    elif not pd.api.types.is_numeric_dtype(data['Total']):
+        data['Total'] = pd.to_numeric(data['Total'], errors='coerce')
+    return data[oxide_cols + ['Total']]
+
+
+def calculate_formula(analyses, mintype='olivine', error=None):
+    """
+    Calculate the mineral formula, ratios and quality-check verdicts for a set of oxide analyses.
+
+    Args:
+        analyses: DataFrame of oxide analyses (see prepare_analyses).
+        mintype: Mineral type of the analyses.
+        error: Error threshold for the cation quality check. Default None, i.e. the default for the
+               mineral type.
+
+    Returns:
+        results: DataFrame with one row per analysis, containing the cations per formula unit, the ratios,
+                 the cation sum, and whether the analysis passes the oxide total check (99 < total < 101,
+                 as in inout.load_and_filter) and the cation quality check.
+    """
+    return _formula_results(prepare_analyses(analyses).reset_index(drop=True), mintype=mintype, error=error)
+
+
+def _formula_results(data, mintype='olivine', error=None):
+    """
+    calculate_formula for analyses that have already been through prepare_analyses.
+    """
+    values = {key: data[key].to_numpy(dtype=float) for key in data.columns if key != 'Total'}
+    elements, ratios, cat_props, _ = calc_composition(values, mintype=mintype)
+    # the olivine ratios include the fayalite fraction as 'Fe', which would clash with the Fe cations
+    results = pd.concat([pd.DataFrame(elements, index=data.index),
+                         pd.DataFrame(ratios, index=data.index).rename(columns={'Fe': 'Fa'}),
+                         pd.DataFrame({'Cation sum': cat_props['sum']}, index=data.index)], axis=1)
+    results['Oxide total'] = data['Total']
+    results['Total OK'] = (data['Total'] > 99) & (data['Total'] < 101)
+    results['Cation sum OK'] = cation_quality_mask(cat_props, error=error, mintype=mintype)
+    results['Passed QC'] = results['Total OK'] & results['Cation sum OK']
+    return results
+
+
+class MicroBatcher:
+    """
+    Collect analyses from concurrent requests and calculate them together. Each call to submit returns a
+    Future, and a background thread waits up to max_delay seconds (or until max_rows analyses are queued)
+    before calculating everything queued so far in one call per mineral type, error and set of oxide columns.
+    """
+
+    def __init__(self, max_delay=0.005, max_rows=100000):
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.requests = queue.Queue()
+        self.batches = 0
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def submit(self, analyses, mintype='olivine', error=None):
+        """
+        Queue a DataFrame of analyses for calculation. Returns a Future whose result is the output of
+        calculate_formula for these analyses.
+        """
+        future = Future()
+        # each request is prepared on its own, so a bad request (or one with different columns) can't change
+        # the results of the others it is batched with
+        try:
+            data = prepare_analyses(analyses)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        self.requests.put((data, mintype.lower(), error, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            n_rows = len(batch[0][0])
+            deadline = time.monotonic() + self.max_delay
+            while n_rows < self.max_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                n_rows += len(batch[-1][0])
+            self._calculate(batch)
+
+    def _calculate(self, batch):
+        self.batches += 1
+        # requests are calculated together if they have the same mineral type, error and columns (e.g. whether K
+        # was given), so none of them gets NaNs for columns only given in the others
+        groups = {}
+        for item in batch:
+            groups.setdefault((item[1], item[2], tuple(item[0].columns)), []).append(item)
+        for (mintype, error, _), items in groups.items():
+            try:
+                results = _formula_results(pd.concat([item[0] for item in items], ignore_index=True),
+                                           mintype=mintype, error=error)
+            except Exception as e:
+                for item in items:
+                    item[3].set_exception(e)
+                continue
+            # split the results back up into the individual requests
+            start = 0
+            for analyses, _, _, future in items:
+                future.set_result(results.iloc[start:start + len(analyses)].reset_index(drop=True))
+                start += len(analyses)
+
+
+def results_to_records(results):
+    """
+    Convert a DataFrame of results into a list of dictionaries that can be written as JSON (NaN -> null).
+    """
+    results = results.astype(object).where(results.notna(), None)
+    records = results.to_dict(orient='records')
+    for record in records:
+        for key, value in record.items():
+            if isinstance(value, (np.bool_, np.integer, np.floating)):
+                record[key] = value.item()
+    return records
+
+
+class FormulaServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a longer queue of pending connections than the default (5), so that bursts of
+    concurrent clients are not refused and made to retry.
+    """
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FormulaRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handle requests to the formula service - see the module docstring for the endpoints.
+    """
+    batcher = None
+
+    def _send(self, status, body, content_type='application/json'):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({'error': message}))
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send(200, json.dumps({'status': 'ok', 'batches': self.batcher.batches}))
+        else:
+            self._send_error(404, f'Unknown endpoint {self.path}')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path not in ['/formula', '/formula/batch']:
+            self._send_error(404, f'Unknown endpoint {url.path}')
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        try:
+            if 'csv' in self.headers.get('Content-Type', ''):
+                analyses = pd.read_csv(io.StringIO(body))
+                options = {}
+            else:
+                options = json.loads(body)
+                if not isinstance(options, dict):
+                    self._send_error(400, 'The request body should be a JSON object')
+                    return
+                if url.path == '/formula':
+                    analyses = pd.DataFrame([{key: value for key, value in options.items()
+                                              if key not in ['mintype', 'error']}])
+                else:
+                    analyses = pd.DataFrame(options['analyses'])
+            mintype = options.get('mintype', query.get('mintype', 'olivine'))
+            if not isinstance(mintype, str):
+                self._send_error(400, f'mintype should be a string, not {json.dumps(mintype)}')
+                return
+            error = options.get('error', query.get('error'))
+            error = float(error) if error is not None else None
+            results = self.batcher.submit(analyses, mintype=mintype, error=error).result()
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_error(400, f'{type(e).__name__}: {e}')
+            return
+
+        if query.get('format') == 'csv' or 'text/csv' in self.headers.get('Accept', ''):
+            self._send(200, results.to_csv(index=False), content_type='text/csv')
+        elif url.path == '/formula':
+            self._send(200, json.dumps(results_to_records(results)[0]))
+        else:
+            self._send(200, json.dumps(results_to_records(results)))
+
+    def log_message(self, format, *args):
+        # don't print a line for every request - this slows things down a lot under load
+        pass
+
+
+def run_service(host='127.0.0.1', port=8050, max_delay=0.005):
+    """
+    Start the formula service and serve requests until interrupted.
+
+    Args:
+        host: Address to listen on. Default 127.0.0.1 (local connections only).
+        port: Port to listen on.
+        max_delay: Maximum time (in seconds) to wait for other requests to group together with a request.
+
+    Returns:
+        None
+    """
+    FormulaRequestHandler.batcher = MicroBatcher(max_delay=max_delay)
+    server = FormulaServer((host, port), FormulaRequestHandler)
+    print(f'Formula service running at http://{host}:{port} - press Ctrl+C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local HTTP service for mineral formula calculation.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8050, help='Port to listen on')
+    parser.add_argument('--max-delay', type=float, default=0.005,
+                        help='Maximum time (s) to wait to group concurrent requests together')
+    args = parser.parse_args()
+    run_service(host=args.host, port=args.port, max_delay=args.max_delay)
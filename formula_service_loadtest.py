@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for formula_service.py. Sends requests to a running service from several threads at once
+and reports the throughput and latency percentiles.
+
+Example usage (with the service already running on the default port):
+    python formula_service_loadtest.py --clients 16 --duration 10 --batch-size 1
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+# A typical olivine analysis (wt% oxides)
+EXAMPLE_ANALYSIS = {'SiO2': 40.8, 'TiO2': 0.01, 'Al2O3': 0.03, 'Cr2O3': 0.03, 'MnO': 0.14, 'MgO': 49.0,
+                    'NiO': 0.38, 'FeO': 9.5, 'CaO': 0.08, 'Na2O': 0.01}
+
+
+def send_request(url, batch_size=1, mintype='olivine'):
+    """
+    Send one request to the service - a single analysis to /formula if batch_size is 1, else batch_size
+    copies of the example analysis to /formula/batch. Returns the time taken in seconds.
+    """
+    if batch_size == 1:
+        endpoint = '/formula'
+        body = dict(EXAMPLE_ANALYSIS, mintype=mintype)
+    else:
+        endpoint = '/formula/batch'
+        body = {'mintype': mintype, 'analyses': [EXAMPLE_ANALYSIS] * batch_size}
+    request = urllib.request.Request(url + endpoint, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run_load_test(url='http://127.0.0.1:8050', clients=8, duration=10., batch_size=1, mintype='olivine'):
+    """
+    Send requests from several client threads for a fixed length of time.
+
+    Args:
+        url: Address of the running service.
+        clients: Number of threads sending requests at the same time.
+        duration: How long to send requests for, in seconds.
+        batch_size: Number of analyses per request.
+        mintype: Mineral type to send.
+
+    Returns:
+        stats: Dictionary of the number of requests, errors, throughput (requests and analyses per second)
+               and latency percentiles (ms).
+    """
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    stop = time.perf_counter() + duration
+
+    def client(idx):
+        while time.perf_counter() < stop:
+            try:
+                latencies[idx].append(send_request(url, batch_size=batch_size, mintype=mintype))
+            except Exception:
+                errors[idx] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(idx,)) for idx in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate([np.asarray(lat) for lat in latencies]) * 1000
+    stats = {'requests': len(latencies), 'errors': sum(errors),
+             'requests/s': len(latencies) / elapsed, 'analyses/s': len(latencies) * batch_size / elapsed}
+    for percentile in [50, 90, 99]:
+        stats[f'p{percentile} latency (ms)'] = np.percentile(latencies, percentile) if len(latencies) else np.nan
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test for formula_service.py.')
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='Address of the running service')
+    parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=10., help='Length of the test (s)')
+    parser.add_argument('--batch-size', type=int, default=1, help='Number of analyses per request')
+    parser.add_argument('--mintype', default='olivine', help='Mineral type to send')
+    args = parser.parse_args()
+
+    stats = run_load_test(url=args.url, clients=args.clients, duration=args.duration,
+                          batch_size=args.batch_size, mintype=args.mintype)
+    for key, value in stats.items():
+        print(f'{key}: {value:.1f}' if isinstance(value, float) else f'{key}: {value}')
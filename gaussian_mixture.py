@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Gaussian mixture fitting for compositions that have more than one population in a sample (e.g. xenocrysts and
+groundmass olivine with different Fo), where the single Gaussian fit in plot_hist is a poor description.
+
+Mixtures with 1 to max_components components are fitted by expectation-maximisation (EM), and the number of
+components is chosen for each sample by the Bayesian Information Criterion (BIC):
+    BIC = -2 ln L + (3K - 1) ln n
+for K components (K means, K sigmas and K - 1 independent weights) fitted to n values.
+
+All samples are fitted together: the values for each sample are stacked into one padded 2D array (samples x
+values), and every EM step is a single array operation over all of the samples and components, rather than a
+separate fit for each sample.
+"""
+
+import numpy as np
+import pandas as pd
+
+LOG_2PI = np.log(2 * np.pi)
+
+
+def _pad_groups(values, weights, groups, max_cells):
+    """
+    Split the values up by group, and stack them into padded 2D arrays (groups x values) with a weight of zero
+    for the padding. Groups are sorted by size and split into batches of at most max_cells array elements
+    (where possible), so that one large sample does not make every row of the array as long as it is.
+
+    Yields:
+        labels: Group labels of the rows in this batch.
+        x: 2D array of values.
+        w: 2D array of weights (0 for padding).
+    """
+    order = np.argsort(groups, kind='stable')
+    labels, starts, counts = np.unique(groups[order], return_index=True, return_counts=True)
+    by_size = np.argsort(counts, kind='stable')
+    batch_start = 0
+    while batch_start < len(by_size):
+        # add groups (smallest first) until the padded array would be too big
+        batch_stop = batch_start + 1
+        while batch_stop < len(by_size) and (batch_stop + 1 - batch_start) * counts[by_size[batch_stop]] <= max_cells:
+            batch_stop += 1
+        batch = by_size[batch_start:batch_stop]
+        width = counts[batch].max()
+        x = np.zeros((len(batch), width))
+        w = np.zeros((len(batch), width))
+        for row, group in enumerate(batch):
+            rows = order[starts[group]:starts[group] + counts[group]]
+            x[row, :counts[group]] = values[rows]
+            w[row, :counts[group]] = weights[rows]
+        yield labels[batch], x, w
+        batch_start = batch_stop
+
+
+def _bin_large_groups(values, weights, groups, max_bins):
+    """
+    Replace the values of each group with more than max_bins values by the (weighted) mean value and total
+    weight in each of max_bins equal-width bins across the range of the group. The EM steps then cost the
+    same for a sample of a million datapoints as for one of max_bins, and because the bins are narrow compared
+    with the spread of the data the fitted mixture is practically unchanged.
+
+    Returns:
+        values, weights, groups: The binned data (groups with max_bins values or fewer are left as they are).
+    """
+    labels, group_idx = np.unique(groups, return_inverse=True)
+    large = np.bincount(group_idx)[group_idx] > max_bins
+    if not np.any(large):
+        return values, weights, groups
+
+    group_idx_large = group_idx[large]
+    values_large = values[large]
+    lo = np.full(len(labels), np.inf)
+    hi = np.full(len(labels), -np.inf)
+    np.minimum.at(lo, group_idx_large, values_large)
+    np.maximum.at(hi, group_idx_large, values_large)
+    width = (hi - lo) / max_bins
+    width[~(width > 0)] = 1.
+    bins = np.minimum(((values_large - lo[group_idx_large]) / width[group_idx_large]).astype(np.int64), max_bins - 1)
+    bin_idx = group_idx_large * max_bins + bins
+    bin_weights = np.bincount(bin_idx, weights=weights[large], minlength=len(labels) * max_bins)
+    bin_sums = np.bincount(bin_idx, weights=weights[large] * values_large, minlength=len(labels) * max_bins)
+    filled = np.flatnonzero(bin_weights > 0)
+
+    return (np.r_[values[~large], bin_sums[filled] / bin_weights[filled]],
+            np.r_[weights[~large], bin_weights[filled]],
+            np.r_[groups[~large], labels[filled // max_bins]])
+
+
+def _initial_parameters(x, w, n_components):
+    """
+    Starting guesses for EM: equal weights, means spread evenly through the (weighted) distribution of each
+    group, and sigmas of the overall standard deviation divided by the number of components.
+    """
+    n = w.sum(axis=1)
+    mean = (w * x).sum(axis=1) / n
+    sd = np.sqrt((w * (x - mean[:, np.newaxis]) ** 2).sum(axis=1) / n)
+
+    # weighted quantiles at the middle of each of n_components equal slices of the distribution
+    order = np.argsort(np.where(w > 0, x, np.inf), axis=1)
+    x_sorted = np.take_along_axis(x, order, axis=1)
+    cum_weight = np.cumsum(np.take_along_axis(w, order, axis=1), axis=1) / n[:, np.newaxis]
+    quantiles = (np.arange(n_components) + 0.5) / n_components
+    idx = np.array([np.searchsorted(row, quantiles) for row in cum_weight])
+    means = np.take_along_axis(x_sorted, np.minimum(idx, x.shape[1] - 1), axis=1)
+
+    sigmas = np.repeat((sd / n_components)[:, np.newaxis], n_components, axis=1)
+    weights = np.full((len(x), n_components), 1. / n_components)
+    return weights, means, sigmas
+
+
+def _log_component_densities(x, weights, means, sigmas):
+    """
+    ln(weight_k * N(x | mean_k, sigma_k)) for every value and component, shape (groups, values, components),
+    written as a quadratic in x so that only a few operations are done on the full 3D array.
+    """
+    inv_var = 1 / sigmas ** 2
+    a = np.log(weights) - np.log(sigmas) - 0.5 * (LOG_2PI + means ** 2 * inv_var)
+    b = means * inv_var
+    c = -0.5 * inv_var
+    x = x[:, :, np.newaxis]
+    return a[:, np.newaxis, :] + x * (b[:, np.newaxis, :] + x * c[:, np.newaxis, :])
+
+
+def _fit_em(x, w, n_components, max_iter=300, tol=1e-5, min_sigma=None):
+    """
+    Fit a Gaussian mixture with n_components components to every row of x at once by EM. Groups drop out of
+    the calculation as they converge, so the remaining iterations only work on the groups still changing.
+
+    Args:
+        x: 2D array (groups x values).
+        w: 2D array of weights of each value (0 for padding, 1 for a normal datapoint, or the counts of a
+           histogram bin).
+        n_components: Number of components.
+        max_iter: Maximum number of EM iterations.
+        tol: Stop once the log-likelihood of a group changes by less than tol per datapoint.
+        min_sigma: Smallest allowed sigma for each group (stops a component collapsing onto a single value).
+
+    Returns:
+        weights, means, sigmas: 2D arrays (groups x components).
+        log_likelihood: 1D array of the log-likelihood of each group.
+    """
+    n = w.sum(axis=1)
+    weights, means, sigmas = _initial_parameters(x, w, n_components)
+    if min_sigma is None:
+        min_sigma = np.full(len(x), 1e-12)
+    sigmas = np.maximum(sigmas, min_sigma[:, np.newaxis])
+    log_likelihood = np.full(len(x), -np.inf)
+    active = np.arange(len(x))
+
+    for _ in range(max_iter):
+        xa, wa = x[active], w[active]
+        # E step - the responsibility of each component for each value
+        log_dens = _log_component_densities(xa, weights[active], means[active], sigmas[active])
+        log_max = log_dens.max(axis=2, keepdims=True)
+        dens = np.exp(log_dens - log_max)
+        total = dens.sum(axis=2, keepdims=True)
+        resp = dens * (wa[:, :, np.newaxis] / total)
+
+        new_log_likelihood = (wa * (np.log(total[:, :, 0]) + log_max[:, :, 0])).sum(axis=1)
+        converged = np.abs(new_log_likelihood - log_likelihood[active]) < tol * n[active]
+        log_likelihood[active] = new_log_likelihood
+
+        # M step - update the weights, means and sigmas from the responsibilities
+        resp_sum = np.maximum(resp.sum(axis=1), 1e-300)
+        weights[active] = np.maximum(resp_sum / n[active, np.newaxis], 1e-300)
+        means[active] = np.einsum('gnk,gn->gk', resp, xa) / resp_sum
+        # x is centred on the mean of each group (see fit_gaussian_mixtures), so E[x^2] - mean^2 is accurate
+        variance = np.einsum('gnk,gn->gk', resp, xa ** 2) / resp_sum - means[active] ** 2
+        sigmas[active] = np.maximum(np.sqrt(np.clip(variance, 0, None)), min_sigma[active, np.newaxis])
+
+        active = active[~converged]
+        if len(active) == 0:
+            break
+
+    return weights, means, sigmas, log_likelihood
+
+
+def fit_gaussian_mixtures(values, groups=None, weights=None, max_components=3, max_iter=300, tol=1e-5,
+                          min_points=10, max_bins=500, max_cells=2000000):
+    """
+    Fit Gaussian mixtures to the values for each group (e.g. each sample), choosing the number of components
+    for each group by BIC.
+
+    Args:
+        values: 1D array (or Series) of values, e.g. Fo for every datapoint. NaNs are ignored.
+        groups: Group (e.g. sample) of each value. Default None, i.e. fit all of the values together.
+        weights: Optional weight of each value, e.g. the counts of histogram bins (see fit_histogram_mixture).
+                 Default None, i.e. every value counts once.
+        max_components: Largest number of components to try.
+        max_iter: Maximum number of EM iterations.
+        tol: Convergence tolerance on the change in log-likelihood per datapoint.
+        min_points: Groups with fewer (weighted) values than min_points * K are not fitted with K components.
+        max_bins: Groups with more values than this are binned into max_bins narrow bins before fitting
+                  (see _bin_large_groups), so the fitting time does not grow with the number of datapoints.
+                  None to always fit the individual values.
+        max_cells: Maximum size of the padded arrays fitted at once - groups are split into several batches
+                   if needed, to limit memory use.
+
+    Returns:
+        mixtures: DataFrame with one row per component of the best mixture for each group, sorted by group and
+                  then by mean, with columns 'Group', 'Components' (the number of components chosen), 'Component',
+                  'Weight', 'Mean', 'Sigma', 'n' (number of values), 'Log-likelihood' and 'BIC'.
+    """
+    values = np.asarray(values, dtype=float)
+    groups = np.zeros(len(values), dtype=int) if groups is None else np.asarray(groups)
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+    keep = ~np.isnan(values) & (weights > 0)
+    values, groups, weights = values[keep], groups[keep], weights[keep]
+    if len(values) == 0:
+        raise ValueError('No values to fit a Gaussian mixture to')
+    if max_bins is not None:
+        values, weights, groups = _bin_large_groups(values, weights, groups, max_bins)
+
+    tables = []
+    for labels, x, w in _pad_groups(values, weights, groups, max_cells):
+        n = w.sum(axis=1)
+        # don't let a component get narrower than a small fraction of the overall spread
+        mean = (w * x).sum(axis=1) / n
+        sd = np.sqrt((w * (x - mean[:, np.newaxis]) ** 2).sum(axis=1) / n)
+        min_sigma = np.maximum(1e-3 * sd, 1e-12)
+        # fit about the mean of each group, and add it back on at the end
+        x = np.where(w > 0, x - mean[:, np.newaxis], 0.)
+
+        best_bic = np.full(len(x), np.inf)
+        best = [None] * len(x)
+        for n_components in range(1, max_components + 1):
+            enough = n >= min_points * n_components
+            if n_components > 1 and not np.any(enough):
+                break
+            fit_weights, means, sigmas, log_likelihood = _fit_em(x, w, n_components, max_iter=max_iter, tol=tol,
+                                                                 min_sigma=min_sigma)
+            bic = -2 * log_likelihood + (3 * n_components - 1) * np.log(n)
+            # always keep the single Gaussian, even if there are very few values
+            better = (bic < best_bic) & (enough | (n_components == 1))
+            for row in np.flatnonzero(better):
+                best_bic[row] = bic[row]
+                best[row] = (fit_weights[row], means[row] + mean[row], sigmas[row], log_likelihood[row])
+
+        for row, label in enumerate(labels):
+            fit_weights, means, sigmas, log_likelihood = best[row]
+            order = np.argsort(means)
+            tables.append(pd.DataFrame({'Group': label, 'Components': len(means),
+                                        'Component': np.arange(1, len(means) + 1),
+                                        'Weight': fit_weights[order], 'Mean': means[order], 'Sigma': sigmas[order],
+                                        'n': n[row], 'Log-likelihood': log_likelihood, 'BIC': best_bic[row]}))
+    mixtures = pd.concat(tables, ignore_index=True)
+    return mixtures.sort_values(['Group', 'Component'], kind='stable').reset_index(drop=True)
+
+
+def fit_sample_mixtures(data, key, group_col='Sample', **kwargs):
+    """
+    Fit Gaussian mixtures to one column of a DataFrame, separately for each sample.
+
+    Args:
+        data: DataFrame of per-point data (e.g. from inout.group_point_table) or area averages.
+        key: Column to fit, e.g. 'Fo'.
+        group_col: Column to group by. Default 'Sample'. None to fit all of the data together.
+        **kwargs: Passed to fit_gaussian_mixtures.
+
+    Returns:
+        mixtures: DataFrame as from fit_gaussian_mixtures, with 'Group' renamed to group_col (or dropped if
+                  group_col is None) and a 'Variable' column.
+    """
+    groups = data[group_col].astype(str).to_numpy() if group_col is not None else None
+    mixtures = fit_gaussian_mixtures(data[key].to_numpy(dtype=float), groups=groups, **kwargs)
+    if group_col is None:
+        mixtures = mixtures.drop(columns='Group')
+    else:
+        mixtures = mixtures.rename(columns={'Group': group_col})
+    mixtures.insert(1 if group_col is not None else 0, 'Variable', key)
+    return mixtures
+
+
+def fit_histogram_mixture(hist, **kwargs):
+    """
+    Fit a Gaussian mixture to a pre-binned histogram (see histograms.py), using the centre of each bin weighted
+    by its count. Values outside of the bins are not included.
+
+    Args:
+        hist: Histogram dictionary.
+        **kwargs: Passed to fit_gaussian_mixtures.
+
+    Returns:
+        mixtures: DataFrame as from fit_gaussian_mixtures (with a single group).
+    """
+    centres = 0.5 * (hist['edges'][1:] + hist['edges'][:-1])
+    return fit_gaussian_mixtures(centres, weights=hist['counts'], **kwargs)
+
+
+def mixture_pdf(x, mixture):
+    """
+    Evaluate the probability density of a fitted mixture.
+
+    Args:
+        x: Array of values at which to evaluate the density.
+        mixture: The rows of a mixtures table (from fit_gaussian_mixtures) for a single group.
+
+    Returns:
+        total: Array of the total density at x.
+        components: 2D array (values x components) of the density of each (weighted) component.
+    """
+    x = np.asarray(x, dtype=float)
+    weights, means, sigmas = (mixture[col].to_numpy(dtype=float) for col in ['Weight', 'Mean', 'Sigma'])
+    z = (x[:, np.newaxis] - means) / sigmas
+    components = weights * np.exp(-0.5 * z ** 2) / (sigmas * np.sqrt(2 * np.pi))
+    return components.sum(axis=1), components
+
+
+def get_mixture_keys(mintype):
+    """
+    The ratios to fit mixtures to for each mineral type.
+    """
+    if 'olivine' in mintype.lower():
+        return ['Fo']
+    elif 'pyroxene' in mintype.lower():
+        return ['Mg#']
+    elif 'spinel' in mintype.lower():
+        return ['CrN', 'MgN']
+    raise ValueError('Mintype must be "olivine", "spinel" or contain "pyroxene"')
+
+
+def fit_mineral_mixtures(point_data, area_data, mintype='olivine', keys=None, **kwargs):
+    """
+    Fit Gaussian mixtures to the per-point data and the area averages of each sample, for writing out to the
+    output spreadsheet.
+
+    Args:
+        point_data: DataFrame of per-point data, from inout.group_point_table.
+        area_data: DataFrame of area averages (the output_data of pipeline.analyse_mineral).
+        mintype: Mineral type.
+        keys: Columns to fit. Default None, i.e. the ratios from get_mixture_keys.
+        **kwargs: Passed to fit_gaussian_mixtures.
+
+    Returns:
+        mixtures: DataFrame of the fitted components, with a 'Data' column saying whether each fit is to the
+                  points or the area averages.
+    """
+    if keys is None:
+        keys = get_mixture_keys(mintype)
+    area_data = area_data.rename(columns={'Project Path (2)': 'Sample'})
+    mixtures = []
+    for label, data in [('Points', point_data), ('Area averages', area_data)]:
+        for key in keys:
+            if not np.any(pd.to_numeric(data[key], errors='coerce').notna()):
+                # nothing to fit, e.g. if no datapoints passed the quality check
+                continue
+            fit = fit_sample_mixtures(data, key, group_col='Sample', **kwargs)
+            fit.insert(0, 'Data', label)
+            mixtures.append(fit)
+    if not mixtures:
+        return pd.DataFrame(columns=['Data', 'Sample', 'Variable', 'Components', 'Component', 'Weight', 'Mean',
+                                     'Sigma', 'n', 'Log-likelihood', 'BIC'])
+    return pd.concat(mixtures, ignore_index=True)
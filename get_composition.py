@@ -1,26 +1,23 @@
 import numpy as np
 import pandas as pd
 
+ELEMENT_NAMES = ('Si', 'Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Ni', 'Fe', 'Ca', 'Na', 'K')
+# groups of columns in the per-point table from composition_table
+POINT_TABLE_GROUPS = ['data', 'elements', 'ratios', 'cat_props', 'ox_props', 'qc']
 
-def check_mineral_composition(data, names=('Si', 'Ti', 'Al', 'Cr', 'Mn',
-                                           'Mg', 'Ni', 'Fe', 'Ca', 'Na', 'K'),
-                              mintype='olivine'):
+
+def calc_composition(values, names=ELEMENT_NAMES, mintype='olivine'):
     """
-    Determine the mineral formula for the specified mineral type.
+    Determine the mineral formula for the specified mineral type from arrays of the oxide concentrations.
+    This is the calculation behind check_mineral_composition and composition_table.
 
     Args:
-        data: Pandas DataFrame containing the loaded-in data from inout.load_and_filter.
-        names: Element names to check for. In the file provided, all of these are included
-               except potassium (K).
+        values: Dictionary of {element name: 1D array of oxide concentrations (wt%)}.
+        names: Element names to check for. Elements not in values are skipped.
         mintype: Mineral type (default 'olivine') for which to perform this analysis.
-                 Used as the output element ratios we want to obtain are different
-                 depending on mineral type.
 
     Returns:
-        elements_out: Pandas DataFrame containing the results of the mineral composition calculation.
-        ratios: Pandas DataFrame containing the calculated element ratios (e.g. MgN, Wo, En, Fs)
-        cat_props: Pandas DataFrame of cation properties. Should sum to 3 (for olivine) or 4 (for pyroxene).
-        ox_props: Pandas DataFrame of oxygen numbers for each element.
+        elements_out, ratios, cat_props, ox_props: Dictionaries of 1D arrays - see check_mineral_composition.
     """
 
     # scale factors taken from Johan's MATLAB code
@@ -30,45 +27,28 @@ def check_mineral_composition(data, names=('Si', 'Ti', 'Al', 'Cr', 'Mn',
     props = {}
     cat_props = {}
     ox_props = {}
-    prop_scaling = {}
-    cat_scaling = {}
-    ox_scaling = {}
     elements_out = {}
 
-    # write the scaling factors and resulting values into dictionaries
-    # in case we need them later
     for idx, key in enumerate(names):
         # skip elements where we don't have data - e.g. potassium in the file Johan sent
-        if key not in data.columns:
+        if key not in values:
             continue
-
-        prop_scaling[key] = prop_scalefactors[idx]
-        cat_scaling[key] = cat_scalefactors[idx]
-        ox_scaling[key] = ox_scalefactors[idx]
-
-        props[key] = data[key] / prop_scaling[key]
-
-        cat_props[key] = props[key] * cat_scaling[key]
-        ox_props[key] = props[key] * ox_scaling[key]
+        props[key] = np.asarray(values[key], dtype=float) / prop_scalefactors[idx]
+        cat_props[key] = props[key] * cat_scalefactors[idx]
+        ox_props[key] = props[key] * ox_scalefactors[idx]
 
     ox_props['sum'] = np.sum([ox_props[key] for key in ox_props.keys()], axis=0)
 
     if 'olivine' in mintype.lower() or 'spinel' in mintype.lower():
         ox_factor = 4 / ox_props['sum']
-
     elif 'pyroxene' in mintype.lower():
         ox_factor = 6 / ox_props['sum']
-
-
-
     else:
         raise ValueError('Rock type not recognised, should be "olivine" or "pyroxene"')
 
-    for idx, key in enumerate(names):
-        # skip elements where we don't have data - e.g. potassium in the file Johan sent
-        if key not in data.columns:
+    for key in names:
+        if key not in values:
             continue
-
         elements_out[key] = ox_factor * cat_props[key]
 
     cat_props['sum'] = np.sum([elements_out[key] for key in elements_out.keys()], axis=0)
@@ -76,7 +56,6 @@ def check_mineral_composition(data, names=('Si', 'Ti', 'Al', 'Cr', 'Mn',
     ratios = {}
     Al_IV = np.zeros(len(elements_out['Si']))
 
-
     if 'spinel' in mintype.lower():
         """
         Spinel calculation
@@ -87,20 +66,14 @@ def check_mineral_composition(data, names=('Si', 'Ti', 'Al', 'Cr', 'Mn',
         O_def = 4 - O_sum_temp2
         Fe3 = 2 * O_def
         Fe2 = elements_out['Fe'] * (3 / cat_props['sum']) - Fe3
-        cat_tot_temp2 = cat_props['sum'] - elements_out['Fe'] + Fe3 + Fe2
-        O_sum_temp3 = (3 / cat_tot_temp2) * (
-                    2 * elements_out['Ti'] + 1.5 * elements_out['Al'] + 1.5 * elements_out['Cr'] + Fe2 + 1.5 * Fe3 +
-                    elements_out['Mn'] + elements_out['Mg'])
         cat_factor = (3 - Fe2 - Fe3) / (elements_out['Ti'] + elements_out['Al'] + elements_out['Cr'] +
                                          elements_out['Mn'] + elements_out['Mg'])
 
         # overwrite the temporary values with the correct values
-        for idx, key in enumerate(elements_out.keys()):
+        for key in elements_out.keys():
             if key in ['Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Fe']:
                 elements_out[key] = elements_out[key] * cat_factor
 
-        # cat_tot = np.sum(np.array([elements_out[key] for key in elements_out.keys() \
-        #                            if key in ['Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Fe']]), axis=0) + Fe2 + Fe3
         cat_tot = elements_out['Ti'] + elements_out['Al'] + elements_out['Cr'] + elements_out['Mn'] + elements_out['Mg'] \
                         + elements_out['Fe'] + Fe2 + Fe3
         ox_Ti = 2. * elements_out['Ti']
@@ -115,6 +88,9 @@ def check_mineral_composition(data, names=('Si', 'Ti', 'Al', 'Cr', 'Mn',
         ratios['MgN'] = 100 * elements_out['Mg'] / (Fe2 + elements_out['Mg'])
         ox_props['O_sum'] = O_sum
         cat_props['cat_tot'] = cat_tot
+        # keep the ferrous/ferric iron split, e.g. for olivine-spinel thermometry
+        cat_props['Fe2'] = Fe2
+        cat_props['Fe3'] = Fe3
 
     elif 'olivine' in mintype.lower():
         """
@@ -138,34 +114,112 @@ def check_mineral_composition(data, names=('Si', 'Ti', 'Al', 'Cr', 'Mn',
                                              + elements_out['Fe'])
         ratios['Mg#'] = elements_out['Mg'] / (elements_out['Mg']  # * 100
                                               + elements_out['Fe'])  # * 100
-        for idx, Si_val in enumerate(elements_out['Si']):
-            if Si_val < 2:
+        # tetrahedral Al - fills up the tetrahedral site (2 per formula unit) left empty by Si
+        Si_val = elements_out['Si']
+        Al_val = elements_out['Al']
+        Al_IV = np.where(Si_val < 2, np.where(Si_val + Al_val < 2, Al_val, 2 - Si_val), 0.)
+    elements_out['Al_IV'] = Al_IV
+
+    return elements_out, ratios, cat_props, ox_props
+
+
+def check_mineral_composition(data, names=ELEMENT_NAMES, mintype='olivine'):
+    """
+    Determine the mineral formula for the specified mineral type.
 
-                if Si_val + elements_out['Al'].array[idx] < 2:
+    Args:
+        data: Pandas DataFrame containing the loaded-in data from inout.load_and_filter.
+        names: Element names to check for. In the file provided, all of these are included
+               except potassium (K).
+        mintype: Mineral type (default 'olivine') for which to perform this analysis.
+                 Used as the output element ratios we want to obtain are different
+                 depending on mineral type.
 
-                    Al_IV[idx] = elements_out['Al'].array[idx]
+    Returns:
+        elements_out: Pandas DataFrame containing the results of the mineral composition calculation.
+        ratios: Pandas DataFrame containing the calculated element ratios (e.g. MgN, Wo, En, Fs)
+        cat_props: Pandas DataFrame of cation properties. Should sum to 3 (for olivine) or 4 (for pyroxene).
+        ox_props: Pandas DataFrame of oxygen numbers for each element.
+    """
+    values = {key: data[key].to_numpy(dtype=float) for key in names if key in data.columns}
+    elements_out, ratios, cat_props, ox_props = calc_composition(values, names=names, mintype=mintype)
 
-                else:
-                    Al_IV[idx] = 2 - Si_val
-            else:
-                Al_IV[idx] = 0
     # Stick depth column into oxide properties - to keep around for later
     try:
-        ox_props['Depth'] = data['Depth']
+        ox_props['Depth'] = data['Depth'].to_numpy()
     except Exception as e:
         print(e)
         print('No depth column found in input data - output will not have it either')
     # turn our dictionaries into Pandas DataFrame objects, so we can manipulate
     # them later with the Pandas library
-    elements_out = pd.DataFrame.from_dict(elements_out)
-    ratios = pd.DataFrame.from_dict(ratios)
-    cat_props = pd.DataFrame.from_dict(cat_props)
-    elements_out['Al_IV'] = Al_IV
-    ox_props = pd.DataFrame.from_dict(ox_props)
+    elements_out = pd.DataFrame(elements_out, index=data.index)
+    ratios = pd.DataFrame(ratios, index=data.index)
+    cat_props = pd.DataFrame(cat_props, index=data.index)
+    ox_props = pd.DataFrame(ox_props, index=data.index)
 
     return elements_out, ratios, cat_props, ox_props
 
 
+def composition_table(data, names=ELEMENT_NAMES, mintype='olivine', composition=None):
+    """
+    Calculate the mineral formula for every datapoint, and hold it together with the input data in a single
+    per-point table, rather than the four separate DataFrames of check_mineral_composition. Later stages add
+    columns to this table (e.g. the quality check flags, see quality_checking.flag_cation_quality) instead of
+    making filtered copies of each DataFrame.
+
+    Args:
+        data: Pandas DataFrame containing the loaded-in data from inout.load_and_filter.
+        names: Element names to check for.
+        mintype: Mineral type for which to perform this analysis.
+        composition: Optional output of calc_composition for data that has already been calculated, or a
+                     DataFrame of it with the same two levels of column names as points (e.g. calculated in
+                     parallel, see parallel_composition.parallel_composition_table), which is joined on without
+                     copying it. Default None, i.e. calculate it here.
+
+    Returns:
+        points: DataFrame with the same index as data and two levels of column names - the group ('data' for
+                the input columns, then 'elements', 'ratios', 'cat_props' and 'ox_props' as returned by
+                check_mineral_composition) and the column name, e.g. points[('ratios', 'Fo')]. A single group
+                can be selected with e.g. points['elements'].
+    """
+    if composition is None:
+        values = {key: data[key].to_numpy(dtype=float) for key in names if key in data.columns}
+        composition = calc_composition(values, names=names, mintype=mintype)
+    # the input columns keep their own dtypes (converting text columns to NumPy object arrays and back is
+    # slower than the whole formula calculation)
+    columns = {('data', col): data[col].array for col in data.columns}
+    if isinstance(composition, pd.DataFrame):
+        return pd.concat([pd.DataFrame(columns, index=data.index), composition.set_axis(data.index)], axis=1)
+    groups = dict(zip(POINT_TABLE_GROUPS[1:], composition))
+    for group, arrays in groups.items():
+        columns.update({(group, key): value for key, value in arrays.items()})
+    return pd.DataFrame(columns, index=data.index)
+
+
+def select_point_columns(points, columns, names=None, passed_only=True):
+    """
+    Select columns from a per-point table (see composition_table) as a DataFrame with a single level of column
+    names, in one copy.
+
+    Args:
+        points: Per-point table.
+        columns: List of (group, column) pairs to select.
+        names: Optional list of the names to give the selected columns. Default None, i.e. the column names
+               without the group.
+        passed_only: If True (default), only the datapoints that passed the quality check (see
+                     quality_checking.flag_cation_quality) are selected, if it has been done.
+
+    Returns:
+        selected: DataFrame of the selected columns.
+    """
+    if passed_only and ('qc', 'Passed') in points.columns:
+        selected = points.loc[points[('qc', 'Passed')].to_numpy(), columns]
+    else:
+        selected = points.loc[:, columns]
+    selected.columns = [col for _, col in columns] if names is None else names
+    return selected
+
+
 def calc_ratio_uncertainty(ratios):
     """
     Calculate the 2SD and delta (max - min) for the ratios (e.g. Fo).
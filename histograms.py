@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Histograms with fixed bin edges for each variable, which can be built up chunk by chunk, merged across
+files and runs, and saved alongside the results. Because the bin edges are fixed (rather than chosen from
+the data each time), histograms from different runs or campaigns can be added together, and
+plotting_functions.plot_hist can draw them directly from the counts without needing the original data.
+
+A histogram is a dictionary with keys:
+    'edges'     - the bin edges.
+    'counts'    - the number of values in each bin.
+    'underflow' - the number of values below the first edge.
+    'overflow'  - the number of values above the last edge.
+    'n', 'sum', 'sum_sq' - the number, sum and sum of squares of all of the (non-NaN) values, including
+                           those outside the bins, so the mean and standard deviation are exact.
+"""
+
+import numpy as np
+
+# Default bin edges for each variable. Oxides are in wt%, cations in atoms per formula unit,
+# Fo and Mg# as fractions, and CrN and MgN in percent (as calculated in get_composition).
+DEFAULT_BIN_EDGES = {'Fo': np.linspace(0.5, 1., 501),
+                     'Fa': np.linspace(0., 0.5, 501),
+                     'Mg#': np.linspace(0.5, 1., 501),
+                     'En': np.linspace(0., 1., 501),
+                     'Fs': np.linspace(0., 1., 501),
+                     'Wo': np.linspace(0., 1., 501),
+                     'CrN': np.linspace(0., 100., 501),
+                     'MgN': np.linspace(0., 100., 501),
+                     'Cation sum': np.linspace(2.5, 4.5, 2001)}
+for _oxide in ['SiO2', 'TiO2', 'Al2O3', 'Cr2O3', 'MnO', 'MgO', 'NiO', 'FeO', 'CaO', 'NaO2', 'K2O']:
+    DEFAULT_BIN_EDGES[_oxide] = np.linspace(0., 100., 2001)
+for _element in ['Si', 'Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Ni', 'Fe', 'Ca', 'Na', 'K', 'Al_IV']:
+    DEFAULT_BIN_EDGES[_element] = np.linspace(0., 4., 801)
+
+
+def get_bin_edges(key, bin_edges=None):
+    """
+    Get the bin edges for a variable - from bin_edges if given, else from DEFAULT_BIN_EDGES.
+
+    Args:
+        key: Variable name, e.g. 'Fo'.
+        bin_edges: Optional dictionary of {variable: edges} overriding the defaults.
+
+    Returns:
+        edges: Array of bin edges.
+    """
+    if bin_edges is not None and key in bin_edges:
+        return np.asarray(bin_edges[key], dtype=float)
+    if key in DEFAULT_BIN_EDGES:
+        return DEFAULT_BIN_EDGES[key]
+    raise ValueError(f'No bin edges defined for "{key}" - pass them in with bin_edges')
+
+
+def new_histogram(edges):
+    """
+    Create an empty histogram with the given bin edges.
+    """
+    edges = np.asarray(edges, dtype=float)
+    return {'edges': edges, 'counts': np.zeros(len(edges) - 1, dtype=np.int64),
+            'underflow': 0, 'overflow': 0, 'n': 0, 'sum': 0., 'sum_sq': 0.}
+
+
+def update_histogram(hist, values):
+    """
+    Add values to a histogram (in place).
+
+    Args:
+        hist: Histogram to update.
+        values: Array (or Series) of new values. NaNs are ignored.
+
+    Returns:
+        hist: The updated histogram.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    edges = hist['edges']
+    widths = np.diff(edges)
+    if np.allclose(widths, widths[0]):
+        # regularly spaced bins - np.histogram can work out the bin of each value directly
+        counts, _ = np.histogram(values, bins=len(widths), range=(edges[0], edges[-1]))
+    else:
+        counts, _ = np.histogram(values, bins=edges)
+    hist['counts'] += counts
+    hist['underflow'] += int(np.count_nonzero(values < edges[0]))
+    hist['overflow'] += int(np.count_nonzero(values > edges[-1]))
+    hist['n'] += len(values)
+    hist['sum'] += float(values.sum())
+    hist['sum_sq'] += float(np.square(values).sum())
+    return hist
+
+
+def merge_histograms(hist1, hist2):
+    """
+    Add two histograms with the same bin edges together.
+
+    Returns:
+        hist: New histogram containing the counts of both.
+    """
+    if not np.array_equal(hist1['edges'], hist2['edges']):
+        raise ValueError('Histograms can only be merged if they have the same bin edges')
+    hist = new_histogram(hist1['edges'])
+    for key in ['counts', 'underflow', 'overflow', 'n', 'sum', 'sum_sq']:
+        hist[key] = hist1[key] + hist2[key]
+    return hist
+
+
+def histogram_stats(hist):
+    """
+    Mean and standard deviation of all of the values added to a histogram.
+    """
+    if hist['n'] == 0:
+        return np.nan, np.nan
+    mean = hist['sum'] / hist['n']
+    return mean, np.sqrt(max(hist['sum_sq'] / hist['n'] - mean ** 2, 0.))
+
+
+def update_histograms(hists, data, label, keys=None, bin_edges=None):
+    """
+    Add a chunk of data to a set of histograms (in place), creating them if they do not already exist.
+
+    Args:
+        hists: Dictionary of histograms, with keys '<label>/<variable>', e.g. 'Olivine data/Fo'.
+        data: DataFrame containing the new data.
+        label: Label for this dataset, e.g. the sheet name 'Olivine data' or 'Olivine points'.
+        keys: Variables to add. Default None, i.e. every column that has bin edges defined.
+        bin_edges: Optional dictionary of {variable: edges} overriding DEFAULT_BIN_EDGES.
+
+    Returns:
+        hists: The updated dictionary of histograms.
+    """
+    if keys is None:
+        keys = [key for key in data.columns
+                if key in DEFAULT_BIN_EDGES or (bin_edges is not None and key in bin_edges)]
+    for key in keys:
+        name = f'{label}/{key}'
+        if name not in hists:
+            hists[name] = new_histogram(get_bin_edges(key, bin_edges))
+        update_histogram(hists[name], data[key])
+    return hists
+
+
+def merge_histogram_sets(hists1, hists2):
+    """
+    Merge two sets of histograms, e.g. from different files or runs. Histograms only present in one of the
+    sets are copied across unchanged.
+    """
+    merged = dict(hists1)
+    for name, hist in hists2.items():
+        merged[name] = merge_histograms(merged[name], hist) if name in merged else hist
+    return merged
+
+
+def save_histograms(path, hists):
+    """
+    Save a set of histograms to a NumPy .npz file.
+    """
+    arrays = {}
+    for name, hist in hists.items():
+        for key, value in hist.items():
+            arrays[f'{name}::{key}'] = np.asarray(value)
+    np.savez_compressed(path, **arrays)
+
+
+def load_histograms(path):
+    """
+    Load a set of histograms saved with save_histograms.
+    """
+    hists = {}
+    with np.load(path) as arrays:
+        for array_name in arrays.files:
+            name, key = array_name.rsplit('::', 1)
+            value = arrays[array_name]
+            hists.setdefault(name, {})[key] = value if key in ['edges', 'counts'] else value.item()
+    return hists
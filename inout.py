@@ -3,6 +3,12 @@ from tkinter import filedialog
 import pandas as pd
 import os
 
+from get_composition import select_point_columns
+
+# Names of the oxides in the output data, for each element column in the input data
+OXIDE_NAMES = {'Na': 'NaO2', 'Mg': 'MgO', 'Al': 'Al2O3', 'Si': 'SiO2', 'Ca': 'CaO',
+               'Ti': 'TiO2', 'Cr': 'Cr2O3', 'Mn': 'MnO', 'Fe': 'FeO', 'Ni': 'NiO'}
+
 def get_data_filename(fname=False):
     """
     Get data filename using the file browser and return it.
@@ -32,7 +38,9 @@ def load_and_filter(input_file, mintype='olivine'):
 
 
     Args:
-        input_file: Excel spreadsheet containing mineral data to be loaded in.
+        input_file: Excel spreadsheet containing mineral data to be loaded in, or a DataFrame of
+                    analyses of all of the phases with a 'Phase' column from
+                    phase_classification.add_phase_columns.
         mintype: Mineral type that you want to load in.
                  Assuming that the input files are the same format as
                  the initial file Johan specified, this chooses which
@@ -55,7 +63,15 @@ def load_and_filter(input_file, mintype='olivine'):
     else:
         raise ValueError('Mineral type should be olivine, spinel, orthopyroxene or clinopyroxene.')
 
-    data = pd.read_excel(input_file, sheet_name=sheet_name).dropna()
+    if isinstance(input_file, pd.DataFrame):
+        # unsorted analyses already classified with phase_classification.add_phase_columns - take the
+        # ones of this mineral type. Columns empty for all of them only belong to the other phases (e.g. the
+        # sheets of a workbook read into one DataFrame had different columns), so aren't missing values
+        data = input_file[input_file['Phase'] == mintype.lower()].drop(columns=['Phase', 'Phase distance'],
+                                                                        errors='ignore')
+        data = data.dropna(axis=1, how='all').dropna()
+    else:
+        data = pd.read_excel(input_file, sheet_name=sheet_name).dropna()
 
     # Remove commas as these break things later on
     data = data.replace(',', ' ', regex=True)
@@ -88,14 +104,11 @@ def group_output_data(oxides, elements, ratios, cat_props, mintype='olivine', sa
         output_data: combined DataFrame.
     """
     # first we need to rename the columns in the oxides data
-    oxides['Oxide total'] = oxides.drop('counts', axis=1).sum(axis=1, numeric_only=True)
-
-    oxides.rename(columns={'Na': 'NaO2', 'Mg': 'MgO', 'Al': 'Al2O3', 'Si': 'SiO2', 'Ca': 'CaO',
-                           'Ti': 'TiO2', 'Cr': 'Cr2O3', 'Mn': 'MnO', 'Fe': 'FeO', 'Ni': 'NiO'}, inplace=True)
-    oxides.rename(columns={'2SD_Na': '2SD_NaO2', '2SD_Mg': '2SD_MgO', '2SD_Al': '2SD_Al2O3', '2SD_Si': '2SD_SiO2', '2SD_Ca': '2SD_CaO',
-                           '2SD_Ti': '2SD_TiO2', '2SD_Cr': '2SD_Cr2O3', '2SD_Mn': '2SD_MnO', '2SD_Fe': '2SD_FeO', '2SD_Ni': '2SD_NiO'}, inplace=True)
-    oxides.rename(columns={'delta_Na': 'delta_NaO2', 'delta_Mg': 'delta_MgO', 'delta_Al': 'delta_Al2O3', 'delta_Si': 'delta_SiO2', 'delta_Ca': 'delta_CaO',
-                           'delta_Ti': 'delta_TiO2', 'delta_Cr': 'delta_Cr2O3', 'delta_Mn': 'delta_MnO', 'delta_Fe': 'delta_FeO', 'delta_Ni': 'delta_NiO'}, inplace=True)
+    oxides['Oxide total'] = oxides.drop(columns='counts', errors='ignore').sum(axis=1, numeric_only=True)
+
+    oxides.rename(columns=OXIDE_NAMES, inplace=True)
+    oxides.rename(columns={f'2SD_{key}': f'2SD_{val}' for key, val in OXIDE_NAMES.items()}, inplace=True)
+    oxides.rename(columns={f'delta_{key}': f'delta_{val}' for key, val in OXIDE_NAMES.items()}, inplace=True)
     oxides = oxides.reset_index()
     ratios = ratios.reset_index(drop=True)
     cat_props = cat_props.reset_index(drop=True)
@@ -139,6 +152,35 @@ def group_output_data(oxides, elements, ratios, cat_props, mintype='olivine', sa
     return output_data
 
 
+def group_point_table(points, passed_only=True):
+    """
+    Select the per-point data from a per-point table (see get_composition.composition_table) as one
+    DataFrame, in a single copy. The columns have the same names as group_output_data uses for the area
+    averages: the input data with the oxides renamed (e.g. 'SiO2') and the sample and area columns renamed to
+    'Sample' and 'Area', then the mineral formula (e.g. 'Si'), the cation ratios (Fo/Mg# etc., with the olivine
+    fayalite fraction as 'Fa') and the cation sum ('Cation sum').
+
+    Args:
+        points: Per-point table, e.g. the 'points' of pipeline.analyse_mineral.
+        passed_only: If True (default), only the datapoints that passed the quality check are kept.
+                     If False, every datapoint is kept, and the quality check flags are included as
+                     columns (e.g. 'Passed').
+
+    Returns:
+        point_data: combined DataFrame, with one row per datapoint.
+    """
+    columns = [col for col in points.columns if col[0] in ('data', 'elements', 'ratios')]
+    columns.append(('cat_props', 'sum'))
+    if not passed_only:
+        columns += [col for col in points.columns if col[0] == 'qc']
+    names = {'data': dict(OXIDE_NAMES, **{'Project Path (2)': 'Sample', 'Project Path (3)': 'Area'}),
+             # the olivine ratios include the fayalite fraction as 'Fe', which would clash with the Fe cations
+             'ratios': {'Fe': 'Fa'},
+             'cat_props': {'sum': 'Cation sum'}}
+    return select_point_columns(points, columns, names=[names.get(group, {}).get(col, col) for group, col in columns],
+                                passed_only=passed_only)
+
+
 def setup_output(data, avg=False):
     """
     Perform a few tidy-up steps on the data we wish to write out. Specifically,
@@ -219,3 +261,52 @@ def save_to_xlsx(path, data, avgdata=False, mintype='olivine'):
             if isinstance(avgdata, pd.DataFrame):
                 avgout.to_excel(writer, sheet_name='Spinel average')
 
+
+
+def get_sheet_prefix(mintype):
+    """
+    Get the prefix used for the sheet names of a given mineral type in the output spreadsheet,
+    e.g. 'Opx' for 'orthopyroxene', so that 'Opx data' and 'Opx average' are consistent with save_to_xlsx.
+
+    Args:
+        mintype: Mineral type, e.g. 'olivine', 'orthopyroxene', 'clinopyroxene' or 'spinel'.
+
+    Returns:
+        prefix: The sheet name prefix.
+    """
+    if 'olivine' in mintype.lower():
+        return 'Olivine'
+    elif 'ortho' in mintype.lower():
+        return 'Opx'
+    elif 'clino' in mintype.lower():
+        return 'Cpx'
+    elif 'spinel' in mintype.lower():
+        return 'Spinel'
+    else:
+        raise ValueError('Mineral type should be olivine, spinel, orthopyroxene or clinopyroxene.')
+
+
+def save_sheet_to_xlsx(path, data, sheet_name, index=False):
+    """
+    Save a single DataFrame to its own sheet of the Excel spreadsheet at location <path>,
+    e.g. for additional outputs such as depth profiles that don't fit into the
+    per-mineral data and average sheets written by save_to_xlsx.
+
+    Args:
+        path: Location/filename you want to save the output data to.
+        data: Pandas DataFrame we wish to write.
+        sheet_name: Name of the sheet to write to. Replaced if it exists already.
+        index: Whether to write the DataFrame index as well. Default False.
+
+    Returns:
+        None
+    """
+    # If file doesn't exist already, create it.
+    if not os.path.exists(path):
+        excel_writer = pd.ExcelWriter(path, mode='w')
+    # Otherwise, append to it.
+    else:
+        excel_writer = pd.ExcelWriter(path, mode='a', if_sheet_exists='replace')
+
+    with excel_writer as writer:
+        data.to_excel(writer, sheet_name=sheet_name, index=index)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Interactive HTML copies of the plots made by plotting_functions (scatter_plot, plot_hist, make_rectangle_plot and
+pyroxene_quadrilateral_plot), which can be zoomed and panned in any web browser without a server, and show the
+sample and area of a point (or the range and count of a histogram bar) when the mouse is over it.
+
+Every point is written into the HTML file, so scatters of large datasets are thinned out first. The points are
+binned by the screen pixel they are drawn on and only one (chosen at random) is kept for each sample (or area) in
+each pixel, as more would be hidden behind it anyway. If that still leaves more than max_points, a random selection
+is kept from each sample in proportion to its number of points (but at least one), so that small samples are not
+lost.
+Only the HTML copy is thinned out - the PNG/EPS figures are saved first and keep every point.
+
+The d3 and mpld3 javascript libraries are written into each file, so they also open without an internet connection.
+
+Requires mpld3 (pip install mpld3), which is only needed when an HTML file is written.
+"""
+
+import html
+import os
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PathCollection
+
+try:
+    import mpld3
+    from mpld3 import plugins, urls
+except ImportError:
+    mpld3 = None
+    plugins = None
+    urls = None
+
+TOOLTIP_CSS = ('div.mpld3-tooltip {background-color: white; border: 1px solid #999; padding: 2px 5px; '
+               'font-family: sans-serif; font-size: 12px;}')
+HTML_PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>{css}</style>
+<script>{d3}</script>
+<script>{mpld3}</script>
+</head>
+<body>
+{figure}
+</body>
+</html>
+'''
+
+
+def _check_mpld3():
+    if mpld3 is None:
+        raise ImportError('Interactive HTML plots require mpld3 - install it with "pip install mpld3"')
+
+
+def tooltip_labels(sheet):
+    """
+    Tooltip text for each row of a sheet of data - its sample and area ('Sample'/'Area' columns as in the output
+    spreadsheet, or 'Project Path (2)'/'Project Path (3)' as in the input data), or its index if it has neither.
+
+    Returns:
+        labels: List of HTML strings, one per row.
+    """
+    columns = []
+    for name, cols in [('Sample', ['Sample', 'Project Path (2)']), ('Area', ['Area', 'Project Path (3)'])]:
+        found = [col for col in cols if col in sheet.columns]
+        if found:
+            columns.append((name, found[0]))
+    if not columns:
+        return [html.escape(str(idx)) for idx in sheet.index]
+    values = [sheet[col].astype(str).to_numpy() for _, col in columns]
+    return ['<br>'.join(f'{name}: {html.escape(value[i])}' for (name, _), value in zip(columns, values))
+            for i in range(len(sheet))]
+
+
+def downsample_points(xy, groups=None, max_points=5000, seed=0):
+    """
+    Choose which points of a scatter plot to keep - one per group (e.g. sample) in each pixel, then at most
+    max_points, taken from each group in proportion to its size (see the top of this file).
+
+    Args:
+        xy: (points x 2) array of the positions of the points on the screen, in pixels.
+        groups: Array of the group of each point. Default None, i.e. all in one group.
+        max_points: Largest number of points to keep.
+        seed: Seed for the random choice of points, so the same data always gives the same file.
+
+    Returns:
+        keep: Sorted array of the indices of the points to keep. Points that are not finite are dropped.
+    """
+    xy = np.asarray(xy, dtype=float)
+    if groups is None:
+        codes = np.zeros(len(xy), dtype=np.int64)
+    else:
+        codes = pd.factorize(np.asarray(groups), use_na_sentinel=False)[0].astype(np.int64)
+    order = np.random.default_rng(seed).permutation(len(xy))
+    order = order[np.isfinite(xy[order]).all(axis=1)]
+    if len(order) == 0:
+        return order
+
+    # one point per group and pixel - the first in the random order
+    pixels = np.floor(xy[order]).astype(np.int64)
+    pixels -= pixels.min(axis=0)
+    width, height = pixels.max(axis=0) + 1
+    cells = (codes[order] * width + pixels[:, 0]) * height + pixels[:, 1]
+    _, first = np.unique(cells, return_index=True)
+    order = order[np.sort(first)]
+
+    # then a random selection from each group, in proportion to its size
+    if len(order) > max_points:
+        group = codes[order]
+        counts = np.bincount(group)
+        quota = np.maximum(np.floor(max_points * counts / len(order)), 1)
+        # rank of each point within its group, in the random order
+        sort = np.argsort(group, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[sort] = np.arange(len(order)) - np.searchsorted(group[sort], group[sort])
+        order = order[rank < quota[group]]
+    return np.sort(order)
+
+
+def _thin_collection(ax, collection, keep):
+    """
+    Keep only the points keep of a scatter collection (with their colours and sizes), and the matching segments
+    of any error bars with one segment per point.
+    """
+    n = len(collection.get_offsets())
+    collection.set_offsets(collection.get_offsets()[keep])
+    for get, set_ in [(collection.get_facecolors, collection.set_facecolors),
+                      (collection.get_edgecolors, collection.set_edgecolors),
+                      (collection.get_sizes, collection.set_sizes)]:
+        values = get()
+        if len(values) == n:
+            set_(values[keep])
+    for lines in ax.collections:
+        if isinstance(lines, LineCollection) and len(lines.get_segments()) == n:
+            segments = lines.get_segments()
+            colours = lines.get_colors()
+            lines.set_segments([segments[i] for i in keep])
+            if len(colours) == n:
+                lines.set_colors(colours[keep])
+
+
+def save_interactive_html(fname, fig=None, point_labels=None, patch_labels=None, max_points=5000):
+    """
+    Save a figure as an interactive HTML file with tooltips, thinning out the scatters of large datasets first
+    (see the top of this file). The figure is changed, so call this after it has been saved as usual.
+
+    Args:
+        fname: Filename to save the HTML to.
+        fig: Figure to save. Default None, i.e. the current figure.
+        point_labels: Dictionary of {scatter collection (from plt.scatter): list of tooltip text for each point},
+                      e.g. from tooltip_labels. Scatters not in point_labels are labelled with their legend label,
+                      if they have one.
+        patch_labels: Dictionary of {patch (e.g. a histogram bar or rectangle): tooltip text}.
+        max_points: Largest total number of scatter points to write to the file.
+
+    Returns:
+        None
+    """
+    _check_mpld3()
+    if fig is None:
+        fig = plt.gcf()
+    point_labels = point_labels or {}
+    patch_labels = patch_labels or {}
+    scatters = [(ax, collection) for ax in fig.axes if ax.get_label() != '<colorbar>'
+                for collection in ax.collections
+                if isinstance(collection, PathCollection) and len(collection.get_offsets())]
+    n_total = sum(len(collection.get_offsets()) for _, collection in scatters)
+
+    for ax, collection in scatters:
+        n = len(collection.get_offsets())
+        labels = point_labels.get(collection)
+        if labels is None and not collection.get_label().startswith('_'):
+            labels = [html.escape(collection.get_label())] * n
+        if n_total > max_points:
+            xy = collection.get_offset_transform().transform(collection.get_offsets())
+            keep = downsample_points(xy, groups=labels, max_points=max(int(max_points * n / n_total), 1))
+            _thin_collection(ax, collection, keep)
+            if labels is not None:
+                labels = [labels[i] for i in keep]
+        if labels is not None:
+            plugins.connect(fig, plugins.PointHTMLTooltip(collection, labels=list(labels)))
+    for patch, label in patch_labels.items():
+        plugins.connect(fig, plugins.LineLabelTooltip(patch, label=label))
+    if n_total > max_points:
+        print(f'{fname}: {n_total} points thinned out to '
+              f'{sum(len(collection.get_offsets()) for _, collection in scatters)} for the interactive plot')
+    # the figure, with the libraries included rather than loaded from the internet
+    libraries = {}
+    for name, path in [('d3', urls.D3_LOCAL), ('mpld3', urls.MPLD3MIN_LOCAL)]:
+        with open(path, encoding='utf-8') as f:
+            libraries[name] = f.read()
+    with open(fname, 'w', encoding='utf-8') as f:
+        f.write(HTML_PAGE.format(title=html.escape(os.path.basename(fname)),
+                                 css=TOOLTIP_CSS, figure=mpld3.fig_to_html(fig), **libraries))
@@ -1,112 +1,37 @@
-import plotting_functions as pf
-from matplotlib import rcParams
-from matplotlib import pyplot as plt
+from plot_manifest import render_manifest
 
 # Figures are saved with automatically-generated filenames based on the mineral
 # type and x/y data. They will automatically overwrite previous plots with the same
 # name, so be careful and make sure you save data in different folders if you don't
 # want this to be the case.
 
-# Change parameters regarding the plots, e.g. default font size.
+# The plots to make are listed in plot_manifest.json - this covers all of the plots that you specified in your
+# initial email I think. To add more, add another entry to "plots", e.g.
+#   {"type": "hist", "sheet": "Olivine data", "key": "NiO"}
+# for a histogram, or
+#   {"type": "scatter", "x_sheet": "Olivine data", "x": "Fo", "y_sheet": "Olivine data", "y": "CaO"}
+# for a scatter plot. Add "z_sheet" and "z" to colour the points by a third variable, or
+#   {"type": "quadrilateral", "sheets": ["Opx data", "Cpx data"], "level": "samples"}
+# to plot the pyroxenes on the En-Fs-Wo quadrilateral. Any other settings
+# (e.g. "bins": 20, "gaussian_fit": true) are passed on to plot_hist/scatter_plot.
+
+# The scatter plots of sample averages of one mineral against another are drawn as the panels of a single figure,
+# average_scatter_grid.png, by the "scatter_grid" entry. Add or remove panels in its "panels" list, e.g.
+#   {"x_sheet": "Olivine average", "x": "Fo", "y_sheet": "Cpx average", "y": "CaO"}
+# Add "sharex": true or "sharey": true (or "row"/"col") to the entry to share the axes between the panels. To save
+# any of them as a separate figure instead, add it as a "scatter" entry.
+
+# To also save an interactive HTML copy of every plot (with the sample/area of each point shown when the mouse is
+# over it, which can be opened in any web browser), add "html": true to the "defaults" section of the manifest.
+# This needs mpld3 (pip install mpld3).
+
+# Change parameters regarding the plots, e.g. default font size, in the "rcParams" section of the manifest.
 # A full list of these can be found at:
 # https://matplotlib.org/stable/api/matplotlib_configuration_api.html#matplotlib.rcParams
-# To change one, add another line to do e.g. rcParams['axes.linewidth'] = 2 to set the linewidth of the axes to 2
-# This will affect all plots generated by this script.
-
-rcParams['font.size'] = 14
-rcParams['figure.figsize'] = [10, 8]
-#Load in data
-data = pf.load_excel_data_for_plots(path='output_data.xlsx')
-
-# Example histogram plots - this covers all of the plots that you specified in your initial email I think. To add
-# more, add the relevant sheet name and column name to hist_plots as another pair like ['sheetname', 'colname']
-hist_plots = [['Olivine data', 'Fo'],
-              ['Opx data', 'Mg#'],
-              ['Opx data', 'Al2O3'],
-              ['Opx data', 'Cr2O3'],
-              ['Opx data', 'CaO'],
-              ['Cpx data', 'Mg'],
-              ['Cpx data', 'Al2O3'],
-              ['Cpx data', 'Cr2O3'],
-              ['Cpx data', 'CaO'],
-              ['Spinel data', 'Cr'],
-              ['Spinel data', 'Mg']]
-for mintype, key in hist_plots:
-    # generate them without the Gaussian fit
-    pf.plot_hist(data, mintype=mintype, key=key, gaussian_fit=False)
-    plt.close()  # uncomment if you want to see the plots
-
-# Example scatter plots.
-olivine_plots = [['Fo', 'NiO'],
-            ['Fo', 'MnO'],
-            ['NiO', 'MnO']]
-for x,y in olivine_plots:
-    pf.scatter_plot(data, 'Olivine data', 'Olivine data', var1=x, var2=y)
-    plt.close()  # uncomment if you want to see the plots
-
-opx_plots = [['Mg#', 'CaO'],
-             ['Mg#', 'Al2O3'],
-             ['Mg#', 'Cr2O3'],
-             ['CaO', 'Al2O3'],
-             ['CaO', 'Cr2O3']]
-
-for x, y in opx_plots:
-    pf.scatter_plot(data, 'Opx data', 'Opx data', var1=x, var2=y)
-    plt.close()  # uncomment if you want to see the plots
-
-cpx_plots = [['Mg#', 'CaO'],
-             ['Mg#', 'Al2O3'],
-             ['Mg#', 'Cr2O3'],
-             ['CaO', 'Al2O3'],
-             ['CaO', 'Cr2O3']]
-for x, y in cpx_plots:
-    pf.scatter_plot(data, 'Cpx data', 'Cpx data', var1=x, var2=y)
-    plt.close()  # uncomment if you want to see the plots
-
-spinel_plots = [['MgN', 'CrN'],
-                ['TiO2', 'CrN']]
-for x, y in spinel_plots:
-    pf.scatter_plot(data, 'Spinel data', 'Spinel data', var1=x, var2=y)
-    plt.close()  # uncomment if you want to see the plots
-# Plotting for the averages
-average_combos = [['Olivine average', 'Fo', 'Opx average', 'Mg#'],
-                  ['Olivine average', 'Fo', 'Cpx average', 'Mg#'],
-                  ['Olivine average', 'Fo', 'Spinel average', 'CrN'],
-                  ['Olivine average', 'Fo', 'Opx average', 'Al2O3'],
-                  ['Olivine average', 'Fo', 'Opx average', 'Cr2O3'],
-                  ['Olivine average', 'Fo', 'Cpx average', 'Al2O3'],
-                  ['Olivine average', 'Fo', 'Cpx average', 'Cr2O3'],
-                  ['Opx average', 'Mg#', 'Cpx average', 'Mg#'],
-                  ['Opx average', 'Mg#', 'Spinel average', 'CrN'],
-                  ['Opx average', 'Mg#', 'Cpx average', 'Cr2O3'],
-                  ['Opx average', 'Mg#', 'Cpx average', 'Al2O3'],
-                  ['Opx average', 'Al2O3', 'Cpx average', 'Al2O3'],
-                  ['Opx average', 'Cr2O3', 'Cpx average', 'Cr2O3'],
-                  ['Opx average', 'Cr2O3', 'Cpx average', 'Al2O3'],
-                  ['Opx average', 'Al2O3', 'Cpx average', 'Cr2O3'],
-                  ['Cpx average', 'Mg#', 'Spinel average', 'CrN'],
-                  ['Olivine average', 'delta_Fo', 'Opx average', 'delta_Mg#'],
-                  ['Olivine average', 'delta_Fo', 'Cpx average', 'delta_Mg#'],
-                  ['Olivine average', 'delta_Fo', 'Spinel average', 'delta_CrN'],
-                  ['Opx average', 'delta_Mg#', 'Cpx average', 'delta_Mg#']]
-
-for minx, x, miny, y in average_combos:
-    print(f'{minx} {x}, vs {miny} {y}')
-    print('Shape x = ', data[minx].shape)
-    print('Shape y = ', data[miny].shape)
-    pf.scatter_plot(data, minx, miny, var1=x, var2=y)
-    plt.close()  # uncomment if you want to see the plots
-
-# Example of a 3-variable scatterplot. You could do this in a loop like above if
-# you wanted to generate many of these.
-# z = the "colour" variable
-minx = 'Opx average'
-miny = 'Cpx average'
-x = 'Mg#'
-y = 'Mg#'
-pf.scatter_plot(data, minx, miny, var1=x, var2=y, mintype_z='Olivine average',
-                var3='Fo')
+# These will affect all plots generated by this script.
 
+# Plots are only re-made if the data that goes into them (or their settings) have changed since the last run -
+# set force=True to re-make all of them anyway.
+render_manifest('plot_manifest.json', data_file='output_data.xlsx', output_path='./plots', force=False)
 
 # plt.show()  # optionally display plots, will generate a lot if doing the automated plotting
-
@@ -3,11 +3,8 @@
 @author: Jon Elsey (ElseyJ1@cardiff.ac.uk)
 """
 
-from get_composition import check_mineral_composition
-from averaging import average_over_areas, average_over_samples
-from inout import load_and_filter, get_data_filename, save_to_xlsx, group_output_data
-from quality_checking import cation_quality_check
-from plotting_functions import get_rectangle_plot_data, make_rectangle_plot
+from inout import get_data_filename
+from pipeline import run_pipeline, PipelineConfig
 
 # load in the data from the spreadsheet and separate each tab into a different
 # DataFrame. This will prompt you to select a file from whatever file browser
@@ -21,82 +18,110 @@ Variables that handle input/output are stored here.
 output_data_fname = 'output_data.xlsx'
 output_figure_fname = 'rectangle_plot.eps'
 output_figure_format = 'eps'  # eps to save to eps, png to save to png, etc.
+# Set to True to draw the datapoints/rectangles as an image (at output_figure_dpi) inside the otherwise vector
+# figure - much smaller and faster eps/pdf/svg files for large datasets.
+output_figure_rasterize = False
+output_figure_dpi = 300
+# Set to True to also save interactive HTML copies of the figures, which show the sample of each point when the mouse
+# is over it and open in any web browser (large datasets are thinned out, see interactive_plots.py). Requires mpld3.
+output_figure_html = False
 # Replace False with '<your_filename>' if you don't want to use the browser
 # (e.g. if automating this with a script)
 data_filename = get_data_filename(fname='INPUT_depthtest.xls')
+# Merging spreadsheets - replace the filename above with a list of spreadsheets (e.g. the workbooks of different
+# campaigns, fname=['campaign1.xlsx', 'campaign2.xlsx']) to analyse them together. Analyses that appear more than once,
+# with the same Project Path (1-3) and Label and every oxide within merge_tolerance (wt%), are only counted once (the
+# first copy is kept, see workbook_merge.py). They are listed in the 'Merge duplicates' sheet, with the number from
+# each spreadsheet in 'Merge summary'. Set merge_keep_duplicates to True to only list them, and keep them all.
+merge_tolerance = 0.01
+merge_keep_duplicates = False
+
+# Phase classification - set to True if the analyses of all of the minerals are mixed together on the first sheet
+# of the input spreadsheet, rather than sorted onto one sheet per mineral. Each analysis is assigned to the nearest
+# of olivine/Opx/Cpx/spinel in oxide space (see phase_classification.py), and ones that are far from all of them
+# are left out. The number assigned to each is written to the 'Phase classification' sheet.
+classify_input_phases = False
 
 # Load in the data and perform simple filtering to remove outliers
 mintypes = ['olivine', 'orthopyroxene', 'clinopyroxene', 'spinel']
+# Rectangle plot - set recplot to True to plot the range of Fo (of recplot_x) against Mg# (of recplot_y) of the area
+# averages of each sample, saved to output_figure_fname.
 recplot = False
-# store data in a dictionary with the key as the mineral type
-data = {}
-elements = {}
-ratios = {}
-cat_props = {}
-ox_props = {}
-# likewise aggregated data
-agg_data = {}
-agg_elements = {}
-agg_ratios = {}
-agg_cat_props = {}
-agg_ox_props = {}
-sample_average_data = {}
-sample_average_elements = {}
-sample_average_cat_props = {}
-sample_average_ratios = {}
-
-# Main analysis loop.
-for mintype in mintypes:
-    print(f'Analysing {mintype} data...')
-
-    # Load in and perform data filtering - ensure that things are within sensible limits
-    data[mintype] = load_and_filter(data_filename, mintype=mintype)
-    # check the mineral composition - perform the scaling, calculate Fo etc.
-    elements[mintype], ratios[mintype], cat_props[mintype], ox_props[mintype] = \
-        check_mineral_composition(data[mintype], mintype=mintype)
-
-    # quality checking
-    data[mintype], elements[mintype], ratios[mintype], cat_props[mintype] = \
-        cation_quality_check(data[mintype], elements[mintype], ratios[mintype],
-                             cat_props[mintype], mintype=mintype)
-
-    # Now do the same, but averaging over each area, with the quality-checked data only.
-    agg_data[mintype] = average_over_areas(data[mintype])
-
-    # Repeat the composition calculation
-    agg_elements[mintype], agg_ratios[mintype], agg_cat_props[mintype], agg_ox_props[mintype] = \
-        check_mineral_composition(agg_data[mintype], mintype=mintype)
-
-    # Final averaging process - do averaging for the whole sample now.
-    sample_average_data[mintype] = average_over_samples(agg_data[mintype])
-    sample_average_ratios[mintype] = average_over_samples(agg_ratios[mintype],
-                                                         oxides=False)
-    sample_average_cat_props[mintype] = average_over_samples(agg_cat_props[mintype],
-                                                             oxides=False)
-    sample_average_elements[mintype] = average_over_samples(agg_ox_props[mintype],
-                                                            oxides=False)
-
-    # Generate output file - first group together all the data
-    output_data = group_output_data(agg_data[mintype], agg_elements[mintype], agg_ratios[mintype],
-                                    agg_cat_props[mintype], mintype=mintype)
-    # likewise for the sample average data
-    sample_avg_output_data = group_output_data(sample_average_data[mintype], sample_average_elements[mintype],
-                                               sample_average_ratios[mintype],
-                                    sample_average_cat_props[mintype], mintype=mintype, sampleavg=True)
-    output_filename = 'output_data.xlsx'
-    save_to_xlsx(output_filename, output_data, avgdata=sample_avg_output_data, mintype=mintype)
-
-if recplot:
-    xtype = 'olivine'
-    ytype = 'clinopyroxene'
-    # group up the data to pass into make_rectangle_plot
-    # x and y are specified here, the defaults are the same as what is written here (Fo and Mg# respectively)
-
-    grouped_data = get_rectangle_plot_data(xdata=data[xtype], ydata=data[ytype],
-                                           x='Fo', y='Mg#')
-    make_rectangle_plot(grouped_data, output_figure_fname, figformat=output_figure_format)
+recplot_x = 'olivine'
+recplot_y = 'clinopyroxene'
+# Cation quality check - set interactive_qc to False to apply the errors below without being prompted.
+# Minerals not in cation_errors use the default error (0.002 for spinel, 0.01 otherwise).
+interactive_qc = True
+cation_errors = {}
+# Bootstrap - set to the number of replicates (e.g. 2000) to calculate 95% confidence intervals on the
+# sample averages, written to extra sheets in the output spreadsheet (e.g. 'Olivine bootstrap'). 0 to skip.
+n_bootstrap = 0
+# Number of processes to calculate the mineral formula with - only worth increasing for sheets with millions of
+# datapoints (see parallel_composition.py).
+n_workers = 1
+# Depth profiles - set to True to calculate binned and rolling statistics down the core
+# (requires a 'Depth' column in the input data). Window and bin widths are in the units of the depth column.
+depth_profiles = False
+depth_window = 10.
+depth_bin_width = 10.
+# Thermometry - set to True to calculate two-pyroxene and olivine-spinel temperatures for each sample,
+# written to extra sheets in the output spreadsheet. The pressure (in GPa) is used for olivine-spinel.
+thermometry = False
+thermometry_pressure = 1.
+# Per-point store - replace False with a folder name to keep the quality-checked data for every datapoint
+# on disk (see pointstore.py), so it can be re-plotted or re-averaged later without re-running the analysis.
+point_store_path = False
+# Histograms - replace False with a filename (e.g. 'output_histograms.npz') to save fixed-bin histograms of
+# the per-point and area-average data, which can be merged with those from other runs (see histograms.py)
+# and plotted with plot_hist(..., histogram=...).
+histogram_path = False
+# Gaussian mixtures - set to True to fit mixtures of Gaussians (number chosen by BIC) to the Fo/Mg#/CrN/MgN of
+# the points and area averages of each sample, written to extra sheets (e.g. 'Olivine mixtures').
+mixture_fits = False
+# Parquet/Arrow export - replace False with a folder name to also write the per-point, area average and sample
+# average data as datasets partitioned by mineral and sample (no row limit, unlike Excel). Requires pyarrow.
+# Set arrow_export_format to 'arrow' for Arrow IPC files, which can be memory-mapped.
+arrow_export_path = False
+arrow_export_format = 'parquet'
+# Quality check sensitivity - replace False with a list of cation sum tolerances (e.g. [0.002, 0.005, 0.01, 0.02])
+# to calculate the area and sample averages for every tolerance in one pass, written to extra sheets
+# (e.g. 'Olivine QC sweep' and 'Olivine QC sweep areas') and plotted in e.g. plots/olivine_qc_sweep.png.
+qc_sweep_tolerances = False
+# Pyroxene quadrilateral - set to True to plot the En-Fs-Wo of every quality-checked pyroxene datapoint on the
+# pyroxene quadrilateral (binned into a density plot for large datasets), saved in ./plots. The area and sample
+# averages can be plotted from the output spreadsheet with make_plots.py.
+pyroxene_quadrilateral = False
+# Fe-Mg equilibrium - set to True to calculate the Fe-Mg exchange coefficient (Kd) between olivine, Opx and Cpx for
+# each sample and for every pair of areas within a sample, flag those outside the usual range for equilibrium (see
+# equilibrium.py), and write them to the 'Fe-Mg Kd' sheets and plots/fe_mg_equilibrium.png. Set equilibrium_by_area
+# to True to also pair up the areas of the different minerals that have the same name.
+equilibrium = False
+equilibrium_by_area = False
+# Sample reports - set to True to save a PDF for each sample in ./reports, with the histograms and scatter plots of
+# the datapoints of each mineral and the rectangle plot of its areas (recplot_x/recplot_y above) on separate pages
+# (see sample_reports.py). The reports are drawn by n_workers processes at once.
+sample_reports = False
+# Run the analysis - load in, filter, calculate the mineral composition, quality check and then average over areas
+# and samples for each mineral type, then make any of the extra outputs turned on above. The same can be done from
+# another script or a notebook with run_pipeline(PipelineConfig(...)) - see pipeline.py.
+result = run_pipeline(PipelineConfig(
+    data_filename=data_filename, output_data_fname=output_data_fname, mintypes=mintypes,
+    merge_tolerance=merge_tolerance, merge_keep_duplicates=merge_keep_duplicates,
+    classify_input_phases=classify_input_phases, interactive_qc=interactive_qc, cation_errors=cation_errors,
+    n_bootstrap=n_bootstrap, n_workers=n_workers, depth_profiles=depth_profiles, depth_window=depth_window,
+    depth_bin_width=depth_bin_width, thermometry=thermometry, thermometry_pressure=thermometry_pressure,
+    point_store_path=point_store_path, histogram_path=histogram_path, mixture_fits=mixture_fits,
+    arrow_export_path=arrow_export_path, arrow_export_format=arrow_export_format,
+    qc_sweep_tolerances=qc_sweep_tolerances, pyroxene_quadrilateral=pyroxene_quadrilateral,
+    equilibrium=equilibrium, equilibrium_by_area=equilibrium_by_area, recplot=recplot,
+    recplot_x=recplot_x, recplot_y=recplot_y, sample_reports=sample_reports, output_figure_fname=output_figure_fname,
+    output_figure_format=output_figure_format, output_figure_rasterize=output_figure_rasterize,
+    output_figure_dpi=output_figure_dpi, output_figure_html=output_figure_html))
+# the results for each mineral type - a dictionary of the DataFrames produced by each step of the analysis, see
+# pipeline.analyse_mineral
+results = result.minerals
 
-    # default - scatter = False
+# Other versions of the rectangle plot (grouped_data from plotting_functions.get_rectangle_plot_data):
 # un-filled rectangle, plotting the datapoints and the rectangle
 # make_rectangle_plot(grouped_data, f'rectangle_scatterplot.eps', scatter=True, figformat=figformat)
 # filled rectangle, so no need to plot the datapoints in addition
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Mineral formula calculation and cation quality check for very large sheets (tens of millions of datapoints),
+split across several worker processes.
+
+The oxide concentrations are copied once into a block of shared memory, and the outputs (mineral formula,
+ratios, cation and oxygen numbers in one block, one row per column, and the quality check mask) are allocated in
+shared memory up front. Each worker attaches to the shared blocks when it starts, and is then only sent a range of
+rows to work on - it calculates that range with get_composition.calc_composition and writes the results straight
+into the shared outputs, so no DataFrames (or arrays) are pickled between the processes. The output block is
+copied out of shared memory in one go, and the per-point table is built on that copy without copying each column.
+
+The results are identical to calc_composition and quality_checking.cation_quality_mask on the whole array.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from get_composition import calc_composition, composition_table, ELEMENT_NAMES, POINT_TABLE_GROUPS
+from quality_checking import get_cation_count, get_default_error
+
+# output groups of calc_composition, in the order it returns them
+COMPOSITION_GROUPS = POINT_TABLE_GROUPS[1:5]
+# shared arrays attached to by each worker process
+_shared = {}
+
+
+def get_worker_context(start_method=None):
+    """
+    Get the multiprocessing context to start worker processes with. Forked workers start quickly and don't re-run
+    the calling script (mineral_analysis.py has no "if __name__ == '__main__'" guard), but forking while other
+    threads are running (e.g. the reader threads of prefetch.PrefetchReader) can deadlock the workers - then, and
+    where fork isn't available (e.g. on Windows), they are started from a fresh process instead.
+
+    Args:
+        start_method: 'fork', 'forkserver' or 'spawn' to always use that start method. Default None, i.e. fork
+                      unless other threads are running.
+
+    Returns:
+        context: multiprocessing context, to pass into ProcessPoolExecutor as mp_context.
+    """
+    if start_method is not None:
+        return get_context(start_method)
+    methods = get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return get_context('fork')
+    return get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _attach_shared(name):
+    """
+    Attach to an existing shared memory block, without tracking it - it is removed by the process that created it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument - the workers share the resource tracker of the main process,
+        # so the block is only registered once either way
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(specs):
+    """
+    Attach a worker process to the shared input and output arrays.
+
+    Args:
+        specs: Dictionary of {array name: (shared memory name, shape, dtype)}.
+    """
+    for key, (name, shape, dtype) in specs.items():
+        shm = _attach_shared(name)
+        _shared[key] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _composition_rows(start, stop, names, mintype, error, layout):
+    """
+    Calculate the mineral formula and quality check mask for rows start:stop, writing them into the shared outputs.
+    """
+    oxides = _shared['oxides'][1]
+    values = {name: oxides[idx, start:stop] for idx, name in enumerate(names)}
+    groups = dict(zip(COMPOSITION_GROUPS, calc_composition(values, names=names, mintype=mintype)))
+    out = _shared['outputs'][1]
+    for idx, (group, key) in enumerate(layout):
+        out[idx, start:stop] = groups[group][key]
+    cation_count = get_cation_count(mintype)
+    cation_sum = groups['cat_props']['sum']
+    _shared['mask'][1][start:stop] = (cation_count - error < cation_sum) & (cation_sum < cation_count + error)
+    return stop - start
+
+
+def _create_shared(shape, dtype):
+    """
+    Allocate a shared memory block for an array of the given shape and dtype.
+    """
+    nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _parallel_outputs(values, names=ELEMENT_NAMES, mintype='olivine', error=None, n_workers=None,
+                      chunk_size=None, start_method=None):
+    """
+    Calculate the outputs of calc_composition and the cation quality check mask for every datapoint, split across
+    n_workers processes, as a single block. The arguments are as parallel_calc_composition.
+
+    Returns:
+        layout: List of the (group, column name) of each row of outputs.
+        outputs: 2D array of the outputs of calc_composition, with one row per column.
+        mask: Boolean array, True where the datapoint passes the cation quality check.
+    """
+    if error is None:
+        error = get_default_error(mintype)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    names = [name for name in names if name in values]
+    n_rows = len(values[names[0]])
+    if chunk_size is None:
+        chunk_size = max(-(-n_rows // (4 * n_workers)), 100000)
+
+    # work out the output columns from a single row - they depend on the mineral type, not the values
+    layout = [(group, key) for group, arrays in
+              zip(COMPOSITION_GROUPS, calc_composition({name: np.ones(1) for name in names}, names=names,
+                                                       mintype=mintype))
+              for key in arrays]
+    # one row per column, so each worker reads and writes contiguous slices
+    blocks = {}
+    try:
+        blocks['oxides'] = _create_shared((len(names), n_rows), np.float64)
+        for idx, name in enumerate(names):
+            blocks['oxides'][1][idx] = values[name]
+        blocks['outputs'] = _create_shared((len(layout), n_rows), np.float64)
+        blocks['mask'] = _create_shared((n_rows,), np.bool_)
+        specs = {key: (shm.name, array.shape, array.dtype.str) for key, (shm, array) in blocks.items()}
+
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=get_worker_context(start_method),
+                                 initializer=_init_worker, initargs=(specs,)) as executor:
+            futures = [executor.submit(_composition_rows, start, min(start + chunk_size, n_rows), names, mintype,
+                                       error, layout)
+                       for start in range(0, n_rows, chunk_size)]
+            for future in futures:
+                future.result()
+
+        # copy the results out of shared memory (in one go), so the blocks can be freed
+        outputs = blocks['outputs'][1].copy()
+        mask = blocks['mask'][1].copy()
+    finally:
+        # drop the arrays before closing, as they hold on to the shared buffers
+        while blocks:
+            shm = blocks.popitem()[1][0]
+            shm.close()
+            shm.unlink()
+    return layout, outputs, mask
+
+
+def parallel_calc_composition(values, names=ELEMENT_NAMES, mintype='olivine', error=None, n_workers=None,
+                              chunk_size=None, start_method=None):
+    """
+    Calculate the mineral formula (as calc_composition) and the cation quality check mask (as
+    cation_quality_mask) for every datapoint, split across n_workers processes.
+
+    Args:
+        values: Dictionary of {element name: 1D array of oxide concentrations (wt%)}, e.g. the columns of the
+                data from inout.load_and_filter.
+        names: Element names to check for. Elements not in values are skipped.
+        mintype: Mineral type for which to perform this analysis.
+        error: Error threshold on the cation sum for the quality check mask. Default None, i.e. the default
+               for the mineral type (see quality_checking.get_default_error).
+        n_workers: Number of worker processes. Default None, i.e. the number of CPUs.
+        chunk_size: Number of rows given to a worker at a time. Default None, i.e. enough for each worker to
+                    get about four chunks (at least 100000 rows each), to balance the load.
+        start_method: How to start the worker processes - see get_worker_context.
+
+    Returns:
+        elements_out, ratios, cat_props, ox_props: Dictionaries of 1D arrays, as calc_composition.
+        mask: Boolean array, True where the datapoint passes the cation quality check.
+    """
+    layout, outputs, mask = _parallel_outputs(values, names=names, mintype=mintype, error=error,
+                                              n_workers=n_workers, chunk_size=chunk_size, start_method=start_method)
+    groups = [{key: outputs[idx] for idx, (name, key) in enumerate(layout) if name == group}
+              for group in COMPOSITION_GROUPS]
+    return (*groups, mask)
+
+
+def parallel_composition_table(data, names=ELEMENT_NAMES, mintype='olivine', error=None, n_workers=None,
+                               chunk_size=None, start_method=None):
+    """
+    As get_composition.composition_table, but with the mineral formula and the cation quality check mask
+    calculated by parallel_calc_composition.
+
+    Args:
+        data: DataFrame containing the loaded-in data from inout.load_and_filter.
+        names: Element names to check for.
+        mintype: Mineral type for which to perform this analysis.
+        error: Error threshold on the cation sum for the quality check mask - see parallel_calc_composition.
+        n_workers: Number of worker processes. Default None, i.e. the number of CPUs.
+        chunk_size: Number of rows given to a worker at a time - see parallel_calc_composition.
+        start_method: How to start the worker processes - see get_worker_context.
+
+    Returns:
+        points: Per-point table, as composition_table.
+        mask: Boolean array, True where the datapoint passes the cation quality check with this error - to be
+              passed into quality_checking.flag_cation_quality, rather than calculating it again.
+    """
+    values = {key: data[key].to_numpy(dtype=float) for key in names if key in data.columns}
+    layout, outputs, mask = _parallel_outputs(values, names=names, mintype=mintype, error=error,
+                                              n_workers=n_workers, chunk_size=chunk_size, start_method=start_method)
+    # the block (transposed) is the data of the table as it is, rather than being copied column by column
+    composition = pd.DataFrame(outputs.T, columns=pd.MultiIndex.from_tuples(layout), copy=False)
+    return composition_table(data, names=names, mintype=mintype, composition=composition), mask
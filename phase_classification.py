@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Sort unsorted point analyses (e.g. a single SEM/microprobe export with every phase mixed together) into
+olivine, orthopyroxene, clinopyroxene and spinel, so they don't have to be sorted by hand onto separate
+sheets before running the analysis.
+
+Each analysis is assigned to the nearest phase centroid in oxide space, with each oxide scaled by the
+typical spread of that phase, i.e. the distance to phase k is
+    d_k = sqrt(mean over oxides of ((x - centroid_k) / spread_k)^2)
+The distances to every phase are calculated for all of the analyses at once with a single matrix product,
+so millions of analyses take a few seconds. Analyses further than max_distance from every centroid (e.g.
+glass, plagioclase, or mixed analyses on grain boundaries) are left 'unclassified'.
+
+The default centroids are typical mantle peridotite compositions. They can be replaced with centroids
+calculated from already-sorted data with fit_centroids, e.g. from a spreadsheet sorted by hand:
+    centroids = fit_centroids({mintype: load_and_filter('sorted.xlsx', mintype) for mintype in PHASES})
+
+Usage:
+    python phase_classification.py unsorted.xlsx sorted.xlsx
+writes the analyses to a spreadsheet with one sheet per phase, in the order expected by inout.load_and_filter.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+PHASES = ['olivine', 'orthopyroxene', 'clinopyroxene', 'spinel']
+UNCLASSIFIED = 'unclassified'
+# Sheet names for the sorted spreadsheet, in the order that inout.load_and_filter reads them
+PHASE_SHEETS = {'olivine': 'Olivine data', 'orthopyroxene': 'Opx data', 'clinopyroxene': 'Cpx data',
+                'spinel': 'Spinel data', UNCLASSIFIED: 'Unclassified'}
+
+# Typical compositions (wt%) of each phase, and the spread of each oxide about them
+DEFAULT_CENTROIDS = pd.DataFrame(
+    {'Si': [40.8, 55.5, 52.0, 0.1], 'Ti': [0.01, 0.1, 0.4, 0.15], 'Al': [0.03, 3.5, 5.5, 45.],
+     'Cr': [0.03, 0.5, 0.9, 22.], 'Mn': [0.13, 0.13, 0.1, 0.12], 'Mg': [49.5, 33., 16., 19.5],
+     'Ni': [0.38, 0.1, 0.05, 0.3], 'Fe': [9., 6., 2.8, 12.5], 'Ca': [0.05, 0.8, 20.5, 0.01],
+     'Na': [0.01, 0.1, 1.3, 0.01]}, index=PHASES)
+DEFAULT_SPREADS = pd.DataFrame(
+    {'Si': [1.5, 2., 2., 0.5], 'Ti': [0.5, 0.5, 0.5, 0.5], 'Al': [0.5, 2., 2.5, 15.],
+     'Cr': [0.5, 0.5, 0.6, 15.], 'Mn': [0.5, 0.5, 0.5, 0.5], 'Mg': [4., 3., 2., 4.],
+     'Ni': [0.5, 0.5, 0.5, 0.5], 'Fe': [4., 3., 1.5, 6.], 'Ca': [0.5, 1., 2.5, 0.5],
+     'Na': [0.5, 0.5, 1., 0.5]}, index=PHASES)
+
+
+def fit_centroids(sorted_data, min_spread=0.5):
+    """
+    Calculate the centroid and spread of each phase from already-sorted analyses.
+
+    Args:
+        sorted_data: Dictionary of {phase: DataFrame of analyses of that phase}, e.g. from inout.load_and_filter.
+        min_spread: Smallest spread to allow for any oxide (wt%), so that oxides that are nearly constant
+                    in the training data (e.g. CaO in olivine) don't dominate the distances.
+
+    Returns:
+        centroids: DataFrame of the mean of each oxide (columns) for each phase (index).
+        spreads: DataFrame of the standard deviation of each oxide for each phase, at least min_spread.
+    """
+    oxides = [name for name in DEFAULT_CENTROIDS.columns if all(name in data.columns for data in sorted_data.values())]
+    centroids = pd.DataFrame({phase: data[oxides].mean() for phase, data in sorted_data.items()}).T
+    spreads = pd.DataFrame({phase: data[oxides].std() for phase, data in sorted_data.items()}).T
+    return centroids, spreads.fillna(min_spread).clip(lower=min_spread)
+
+
+def phase_distances(data, centroids=None, spreads=None):
+    """
+    Scaled distance of every analysis to every phase centroid (see the top of this file).
+
+    Args:
+        data: DataFrame of analyses, with the oxides (wt%) in the columns 'Si', 'Al', 'Mg' etc. as in the
+              input spreadsheet. Oxides that are in the centroids but not in data are left out.
+        centroids: DataFrame of phase centroids (phases as the index, oxides as the columns). Default None,
+                   i.e. DEFAULT_CENTROIDS.
+        spreads: DataFrame of the spread of each oxide for each phase, in the same layout. Default None,
+                 i.e. DEFAULT_SPREADS.
+
+    Returns:
+        distances: DataFrame of the distance of each analysis (rows) to each phase (columns).
+    """
+    if centroids is None:
+        centroids = DEFAULT_CENTROIDS
+    if spreads is None:
+        spreads = DEFAULT_SPREADS
+    oxides = [name for name in centroids.columns if name in data.columns]
+    if not oxides:
+        raise ValueError('None of the oxides in the phase centroids were found in the data')
+    x = data[oxides].to_numpy(dtype=float)
+    c = centroids[oxides].to_numpy(dtype=float)
+    w = 1 / np.square(spreads.loc[centroids.index, oxides].to_numpy(dtype=float))
+    # sum over oxides of w * (x - c)^2, expanded so that every phase is done with one matrix product
+    sq_dist = np.square(x) @ w.T - 2 * x @ (c * w).T + np.sum(np.square(c) * w, axis=1)
+    distances = np.sqrt(np.clip(sq_dist, 0, None) / len(oxides))
+    return pd.DataFrame(distances, index=data.index, columns=centroids.index)
+
+
+def classify_phases(data, centroids=None, spreads=None, max_distance=3.):
+    """
+    Assign each analysis to the nearest phase.
+
+    Args:
+        data: DataFrame of unsorted analyses - see phase_distances.
+        centroids: Phase centroids - see phase_distances.
+        spreads: Spread of each oxide for each phase - see phase_distances.
+        max_distance: Analyses further than this from every centroid (in units of the spreads) are left
+                      unclassified. Default 3.
+
+    Returns:
+        phases: Series of the phase of each analysis ('olivine', 'orthopyroxene', 'clinopyroxene', 'spinel'
+                or 'unclassified').
+        distance: Series of the distance to the assigned (nearest) phase.
+    """
+    distances = phase_distances(data, centroids=centroids, spreads=spreads)
+    values = distances.to_numpy()
+    # analyses with missing oxides have NaN distances, and stay unclassified
+    valid = ~np.isnan(values).any(axis=1)
+    nearest = np.argmin(np.where(np.isnan(values), np.inf, values), axis=1)
+    distance = values[np.arange(len(values)), nearest]
+    labels = np.asarray(distances.columns, dtype=object)[nearest]
+    labels[~valid | (distance > max_distance)] = UNCLASSIFIED
+    return pd.Series(labels, index=data.index, name='Phase'), pd.Series(distance, index=data.index,
+                                                                         name='Phase distance')
+
+
+def add_phase_columns(data, **kwargs):
+    """
+    Classify the analyses and add the 'Phase' and 'Phase distance' columns to a copy of data. The result
+    can be passed straight into pipeline.analyse_mineral (or inout.load_and_filter) in place of the
+    input spreadsheet, which then uses the analyses of each phase in turn.
+
+    Args:
+        data: DataFrame of unsorted analyses.
+        **kwargs: Passed to classify_phases, e.g. max_distance.
+
+    Returns:
+        data: Copy of data with the classification added.
+    """
+    phases, distance = classify_phases(data, **kwargs)
+    return data.assign(Phase=phases, **{'Phase distance': distance})
+
+
+def phase_summary(phases):
+    """
+    Number and percentage of the analyses assigned to each phase.
+    """
+    counts = phases.value_counts().reindex(PHASES + [UNCLASSIFIED], fill_value=0)
+    return pd.DataFrame({'Phase': counts.index, 'Number of datapoints': counts.to_numpy(),
+                         'Percentage': 100 * counts.to_numpy() / max(len(phases), 1)})
+
+
+def write_sorted_workbook(path, data):
+    """
+    Write classified analyses (from add_phase_columns) to a spreadsheet with one sheet per phase, in the
+    order expected by inout.load_and_filter, and the unclassified analyses on a final sheet.
+
+    Args:
+        path: Filename of the spreadsheet to write.
+        data: DataFrame of classified analyses.
+
+    Returns:
+        None
+    """
+    with pd.ExcelWriter(path, mode='w') as writer:
+        for phase, sheet_name in PHASE_SHEETS.items():
+            data[data['Phase'] == phase].drop(columns=['Phase', 'Phase distance'], errors='ignore').to_excel(
+                writer, sheet_name=sheet_name, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sort unsorted point analyses into olivine, orthopyroxene, '
+                                                 'clinopyroxene and spinel.')
+    parser.add_argument('input', help='Spreadsheet of unsorted analyses (first sheet)')
+    parser.add_argument('output', help='Spreadsheet to write, with one sheet per phase')
+    parser.add_argument('--max-distance', type=float, default=3.,
+                        help='Leave analyses further than this from every phase unclassified (default 3)')
+    args = parser.parse_args()
+    classified = add_phase_columns(pd.read_excel(args.input, sheet_name=0), max_distance=args.max_distance)
+    print(phase_summary(classified['Phase']).to_string(index=False))
+    write_sorted_workbook(args.output, classified)
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Jon Elsey (ElseyJ1@cardiff.ac.uk)
+
+The analysis steps for a single mineral type (analyse_mineral), and the whole analysis of an input spreadsheet
+with all of its optional outputs (run_pipeline), shared between mineral_analysis.py and the other scripts that
+run the analysis automatically (e.g. watch_folder.py).
+
+run_pipeline takes all of its settings from a PipelineConfig and keeps all of its results in the PipelineResult
+it returns, so it can be called any number of times in the same Python session (e.g. from a notebook), e.g.
+    result = run_pipeline(PipelineConfig('INPUT.xlsx', interactive_qc=False, qc_sweep_tolerances=[0.005, 0.01]))
+    result['olivine']['sample_avg_output_data']
+"""
+
+import os
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from get_composition import check_mineral_composition, composition_table, select_point_columns
+from averaging import average_over_areas, average_over_samples, bootstrap_sample_averages
+from inout import load_and_filter, save_to_xlsx, group_output_data, save_sheet_to_xlsx, get_sheet_prefix, \
+    get_data_filename, group_point_table, OXIDE_NAMES
+from quality_checking import flag_cation_quality
+from parallel_composition import parallel_composition_table
+from thermometry import calc_two_pyroxene_temperatures, calc_olivine_spinel_temperatures
+from pointstore import write_point_store
+from gaussian_mixture import fit_mineral_mixtures
+from arrow_export import export_mineral_results
+from phase_classification import add_phase_columns, phase_summary
+from workbook_merge import merge_workbooks
+
+MINERAL_TYPES = ('olivine', 'orthopyroxene', 'clinopyroxene', 'spinel')
+
+
+def analyse_mineral(data_filename, mintype='olivine', error=None, interactive=True, n_bootstrap=0, n_workers=1,
+                    start_method=None):
+    """
+    Run the full analysis for one mineral type - load in and filter the data, calculate the
+    mineral formula, perform the cation quality check, then average over areas and samples.
+
+    Args:
+        data_filename: Excel spreadsheet containing the mineral data to be loaded in, or a DataFrame of
+                       classified analyses (see inout.load_and_filter).
+        mintype: Mineral type that you want to analyse.
+        error: Error threshold for the cation quality check. Default None, in which case the
+               default for the mineral type is used (see quality_checking.get_default_error).
+        interactive: If True (default), the user is prompted to accept or change the error
+                     threshold in the cation quality check.
+        n_bootstrap: Number of bootstrap replicates used to calculate confidence intervals on the
+                     sample averages of the oxides and ratios. Default 0, i.e. don't calculate them.
+        n_workers: Number of processes to calculate the mineral formula with (see parallel_composition.py).
+                   Default 1, i.e. in this process. Only worth it for millions of datapoints.
+        start_method: How to start the worker processes - see parallel_composition.get_worker_context.
+
+    Returns:
+        results: Dictionary of the DataFrames produced at each stage of the analysis, with keys
+                 'points' for the per-point table of every datapoint (see get_composition.composition_table),
+                 with the quality check flags in ('qc', 'Passed') etc. (use inout.group_point_table to get
+                 the quality-checked datapoints), 'cation_error' for the error threshold accepted in the
+                 quality check, 'agg_*' for the area averages, 'sample_average_*' for the sample averages,
+                 and 'output_data'/'sample_avg_output_data' for the grouped output.
+                 If n_bootstrap > 0, 'sample_average_bootstrap' holds the bootstrap confidence intervals.
+    """
+    results = {}
+    # Load in and perform data filtering - ensure that things are within sensible limits
+    data = load_and_filter(data_filename, mintype=mintype)
+    # check the mineral composition - perform the scaling, calculate Fo etc. The input data and the results
+    # are held in one per-point table, and the quality check flags the datapoints that fail rather than
+    # making filtered copies of everything
+    # (the parallel version also calculates the quality check mask for the starting error in the workers)
+    mask = None
+    if n_workers == 1:
+        points = composition_table(data, mintype=mintype)
+    else:
+        points, mask = parallel_composition_table(data, mintype=mintype, error=error, n_workers=n_workers,
+                                                  start_method=start_method)
+    del data
+
+    # quality checking
+    results['cation_error'] = flag_cation_quality(points, error=error, mintype=mintype, interactive=interactive,
+                                                  mask=mask)
+    passed = points[('qc', 'Passed')].to_numpy()
+    results['points'] = points
+
+    # Now do the same, but averaging over each area, with the quality-checked data only.
+    agg_data = average_over_areas(points.loc[passed, 'data'])
+
+    # Repeat the composition calculation
+    agg_elements, agg_ratios, agg_cat_props, agg_ox_props = check_mineral_composition(agg_data, mintype=mintype)
+    results['agg_data'] = agg_data
+    results['agg_elements'] = agg_elements
+    results['agg_ratios'] = agg_ratios
+    results['agg_cat_props'] = agg_cat_props
+    results['agg_ox_props'] = agg_ox_props
+
+    # Final averaging process - do averaging for the whole sample now.
+    results['sample_average_data'] = average_over_samples(agg_data)
+    results['sample_average_ratios'] = average_over_samples(agg_ratios, oxides=False)
+    results['sample_average_cat_props'] = average_over_samples(agg_cat_props, oxides=False)
+    results['sample_average_elements'] = average_over_samples(agg_ox_props, oxides=False)
+
+    # Bootstrap confidence intervals on the sample averages, resampling areas and the datapoints within them
+    if n_bootstrap:
+        oxides = [name for name in ['Si', 'Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Ni', 'Fe', 'Ca', 'Na']
+                  if ('data', name) in points.columns]
+        ratio_names = [col for col in points['ratios'].columns if col != 'Fe']
+        # the olivine ratios include the fayalite fraction as 'Fe', which would clash with FeO
+        columns = [('data', col) for col in ['Project Path (2)', 'Project Path (3)'] + oxides] + \
+                  [('ratios', col) for col in ratio_names]
+        bootstrap_points = select_point_columns(
+            points, columns, names=['Project Path (2)', 'Project Path (3)'] + [OXIDE_NAMES[name] for name in oxides]
+            + ratio_names)
+        results['sample_average_bootstrap'] = bootstrap_sample_averages(
+            bootstrap_points, columns=[OXIDE_NAMES[name] for name in oxides] + ratio_names, n_boot=n_bootstrap)
+
+    # Generate output data - first group together all the data
+    results['output_data'] = group_output_data(agg_data, agg_elements, agg_ratios, agg_cat_props,
+                                               mintype=mintype)
+    # likewise for the sample average data
+    results['sample_avg_output_data'] = group_output_data(results['sample_average_data'],
+                                                          results['sample_average_elements'],
+                                                          results['sample_average_ratios'],
+                                                          results['sample_average_cat_props'],
+                                                          mintype=mintype, sampleavg=True)
+    return results
+
+
+def save_mineral_output(output_filename, results, mintype='olivine'):
+    """
+    Write the area and sample averages (and bootstrap confidence intervals, if calculated)
+    from analyse_mineral to the output spreadsheet.
+
+    Args:
+        output_filename: Location/filename you want to save the output data to.
+        results: Dictionary of results from analyse_mineral.
+        mintype: Mineral type. Determines the sheet names.
+
+    Returns:
+        None
+    """
+    save_to_xlsx(output_filename, results['output_data'], avgdata=results['sample_avg_output_data'],
+                 mintype=mintype)
+    if 'sample_average_bootstrap' in results:
+        save_sheet_to_xlsx(output_filename,
+                           results['sample_average_bootstrap'].rename_axis('Sample'),
+                           sheet_name=f'{get_sheet_prefix(mintype)} bootstrap', index=True)
+
+
+@dataclass
+class PipelineConfig:
+    """
+    Settings for run_pipeline. Everything except data_filename is optional - the defaults only write the area and
+    sample averages of every mineral to the output spreadsheet, as mineral_analysis.py does with its defaults.
+
+    Attributes:
+        data_filename: Input spreadsheet. False to choose it with the file browser (see inout.get_data_filename).
+                       A list of spreadsheets is merged into one dataset, leaving out duplicated analyses (see
+                       workbook_merge.py). A DataFrame of analyses already read in, with the mineral of each in a
+                       'Phase' column (e.g. from prefetch.read_input_workbook), is used as it is.
+        output_data_fname: Output spreadsheet. Sheets already in it are replaced, others are left as they are.
+        overwrite_output: If True, start a new output spreadsheet rather than adding to an existing one.
+        mintypes: Mineral types to analyse.
+        merge_tolerance: Largest oxide difference (wt%) for analyses with the same labels in the merged
+                         spreadsheets to count as duplicates. 0 to only leave out exact duplicates.
+        merge_keep_duplicates: If True, keep the duplicated analyses in the merged data, and only report them.
+        classify_input_phases: If True, the analyses of every mineral are on the first sheet of the input
+                               spreadsheet and are sorted by phase_classification.add_phase_columns first.
+        interactive_qc: If True, the user is prompted to accept or change the cation quality check error.
+        cation_errors: Dictionary of the cation quality check error for each mineral type. Mineral types not in
+                       it use the default (see quality_checking.get_default_error).
+        n_bootstrap: Number of bootstrap replicates for confidence intervals on the sample averages. 0 to skip.
+        n_workers: Number of processes to calculate the mineral formula with (see parallel_composition.py), and
+                   to draw the sample reports with.
+        start_method: How to start those processes - 'fork', 'forkserver' or 'spawn'. Default None, i.e. fork
+                      unless other threads are running (see parallel_composition.get_worker_context).
+        depth_profiles: If True, calculate binned and rolling statistics down the core.
+        depth_window: Window width of the rolling depth statistics, in the units of the depth column.
+        depth_bin_width: Bin width of the binned depth statistics.
+        thermometry: If True, calculate two-pyroxene and olivine-spinel temperatures for each sample.
+        thermometry_pressure: Pressure (GPa) for olivine-spinel thermometry.
+        point_store_path: Folder to keep the quality-checked datapoints in (see pointstore.py). False to skip.
+        histogram_path: File to save fixed-bin histograms to (see histograms.py). False to skip.
+        mixture_fits: If True, fit Gaussian mixtures to the ratios of each sample (see gaussian_mixture.py).
+        arrow_export_path: Folder to export Parquet/Arrow datasets to (see arrow_export.py). False to skip.
+        arrow_export_format: 'parquet' or 'arrow'.
+        qc_sweep_tolerances: List of cation sum tolerances for the quality check sensitivity sweep (see
+                             qc_sweep.py). False to skip.
+        pyroxene_quadrilateral: If True, plot the pyroxene datapoints on the pyroxene quadrilateral.
+        equilibrium: If True, calculate the olivine-Opx-Cpx Fe-Mg exchange coefficients (Kd) for each sample and
+                     every pair of areas within it (see equilibrium.py), and plot them.
+        equilibrium_by_area: If True, also pair the areas of the different minerals by area name.
+        equilibrium_kd_ranges: Dictionary of {(mineral 1, mineral 2): (lowest Kd, highest Kd)} in equilibrium, to
+                               replace equilibrium.DEFAULT_KD_RANGES. Default None, i.e. the defaults.
+        recplot: If True, make the rectangle plot of recplot_x (Fo) against recplot_y (Mg#) by sample.
+        recplot_x: Mineral type for the x-axis of the rectangle plot.
+        recplot_y: Mineral type for the y-axis of the rectangle plot.
+        sample_reports: If True, save a multipage PDF report of the histograms, scatter plots and rectangle plot of
+                        each sample (see sample_reports.py).
+        sample_report_path: Folder to save the sample reports to.
+        hist_plots: Histograms to plot from the output spreadsheet at the end, as [sheet name, column name] pairs.
+        plot_path: Folder to save the plots to.
+        output_figure_fname: Filename of the rectangle plot.
+        output_figure_format: Format of the rectangle plot, e.g. 'eps' or 'png'.
+        output_figure_rasterize: If True, draw the data layers of the figures as an image in vector files.
+        output_figure_dpi: Resolution of the rasterized layers.
+        output_figure_html: If True, also save interactive HTML copies of the figures (see interactive_plots.py).
+    """
+    data_filename: str | list | pd.DataFrame | bool = False
+    output_data_fname: str = 'output_data.xlsx'
+    overwrite_output: bool = False
+    mintypes: list = field(default_factory=lambda: list(MINERAL_TYPES))
+    merge_tolerance: float = 0.01
+    merge_keep_duplicates: bool = False
+    classify_input_phases: bool = False
+    interactive_qc: bool = True
+    cation_errors: dict = field(default_factory=dict)
+    n_bootstrap: int = 0
+    n_workers: int | None = 1
+    start_method: str | None = None
+    depth_profiles: bool = False
+    depth_window: float = 10.
+    depth_bin_width: float = 10.
+    thermometry: bool = False
+    thermometry_pressure: float = 1.
+    point_store_path: str | bool = False
+    histogram_path: str | bool = False
+    mixture_fits: bool = False
+    arrow_export_path: str | bool = False
+    arrow_export_format: str = 'parquet'
+    qc_sweep_tolerances: list | bool = False
+    pyroxene_quadrilateral: bool = False
+    equilibrium: bool = False
+    equilibrium_by_area: bool = False
+    equilibrium_kd_ranges: dict | None = None
+    recplot: bool = False
+    recplot_x: str = 'olivine'
+    recplot_y: str = 'clinopyroxene'
+    sample_reports: bool = False
+    sample_report_path: str = './reports'
+    hist_plots: list = field(default_factory=list)
+    plot_path: str = './plots'
+    output_figure_fname: str = 'rectangle_plot.eps'
+    output_figure_format: str = 'eps'
+    output_figure_rasterize: bool = False
+    output_figure_dpi: int = 300
+    output_figure_html: bool = False
+
+
+@dataclass
+class PipelineResult:
+    """
+    Everything calculated by run_pipeline. The results for a single mineral type can also be got with
+    result[mintype].
+
+    Attributes:
+        config: The settings the pipeline was run with.
+        minerals: Dictionary of {mineral type: dictionary of results from analyse_mineral}.
+        merge_summary: Number of analyses and duplicates in each spreadsheet, if several were merged.
+        merge_duplicates: Every duplicated analysis and the analysis it is a copy of, if several spreadsheets were
+                          merged.
+        phase_summary: Number of analyses assigned to each phase, if classify_input_phases was set.
+        histograms: Dictionary of fixed-bin histograms, if histogram_path was set (see histograms.py).
+        mixtures: Dictionary of {mineral type: Gaussian mixture fits}, if mixture_fits was set.
+        qc_sweeps: Dictionary of {mineral type: (area_sweep, sample_sweep)}, if qc_sweep_tolerances was set
+                   (see qc_sweep.tolerance_sweep).
+        temperatures: Dictionary of {sheet name: temperatures}, if thermometry was set.
+        equilibrium: Dictionary of the Fe-Mg equilibrium tables, if equilibrium was set (see
+                     equilibrium.calc_equilibrium).
+        depth_profiles: Dictionary of {mineral type: {'profile', 'rolling', 'binned': DataFrame}}, if
+                        depth_profiles was set.
+        report_files: Filenames of the sample reports, if sample_reports was set.
+    """
+    config: PipelineConfig
+    minerals: dict = field(default_factory=dict)
+    merge_summary: pd.DataFrame | None = None
+    merge_duplicates: pd.DataFrame | None = None
+    phase_summary: pd.DataFrame | None = None
+    histograms: dict = field(default_factory=dict)
+    mixtures: dict = field(default_factory=dict)
+    qc_sweeps: dict = field(default_factory=dict)
+    temperatures: dict = field(default_factory=dict)
+    equilibrium: dict = field(default_factory=dict)
+    depth_profiles: dict = field(default_factory=dict)
+    report_files: list = field(default_factory=list)
+
+    def __getitem__(self, mintype):
+        return self.minerals[mintype]
+
+
+def _close_new_figures(open_figures):
+    """
+    Close the figures made since open_figures (a list of figure numbers) was taken, so that repeated runs in the
+    same session don't keep every figure in memory, while leaving any figures the user has open.
+    """
+    import matplotlib.pyplot as plt
+    for num in set(plt.get_fignums()) - set(open_figures):
+        plt.close(num)
+
+
+def run_pipeline(config):
+    """
+    Run the whole analysis of an input spreadsheet - analyse_mineral for each mineral type, then write the output
+    spreadsheet and make any of the optional outputs and plots turned on in config. Nothing is kept between
+    calls, so it can be run repeatedly in the same session.
+
+    Args:
+        config: PipelineConfig of the settings.
+
+    Returns:
+        result: PipelineResult holding the results.
+    """
+    result = PipelineResult(config=config)
+    output_fname = config.output_data_fname
+    if config.overwrite_output and os.path.exists(output_fname):
+        os.remove(output_fname)
+
+    input_data = config.data_filename
+    if not isinstance(input_data, pd.DataFrame):
+        input_data = get_data_filename(fname=input_data)
+    if isinstance(input_data, (list, tuple)):
+        # several spreadsheets - merged into one dataset, with the mineral of each analysis in its 'Phase' column
+        # (or unsorted, for classify_input_phases below)
+        input_data, result.merge_duplicates, result.merge_summary = merge_workbooks(
+            input_data, tolerance=config.merge_tolerance, drop_duplicates=not config.merge_keep_duplicates,
+            sorted_sheets=not config.classify_input_phases)
+        print(result.merge_summary.to_string(index=False))
+        save_sheet_to_xlsx(output_fname, result.merge_summary, sheet_name='Merge summary')
+        save_sheet_to_xlsx(output_fname, result.merge_duplicates, sheet_name='Merge duplicates')
+    if config.classify_input_phases:
+        if not isinstance(input_data, pd.DataFrame):
+            input_data = pd.read_excel(input_data, sheet_name=0)
+        input_data = add_phase_columns(input_data)
+        result.phase_summary = phase_summary(input_data['Phase'])
+        print(result.phase_summary.to_string(index=False))
+        save_sheet_to_xlsx(output_fname, result.phase_summary, sheet_name='Phase classification')
+
+    # the plotting modules (and Matplotlib) are only imported if they are needed
+    plotting = (config.qc_sweep_tolerances or config.pyroxene_quadrilateral or config.depth_profiles or
+                config.equilibrium or config.recplot or config.hist_plots)
+    if plotting:
+        import matplotlib.pyplot as plt
+        open_figures = plt.get_fignums()
+
+    for mintype in config.mintypes:
+        print(f'Analysing {mintype} data...')
+
+        # Load in, filter, calculate the mineral composition, quality check and then average
+        # over areas and samples
+        results = analyse_mineral(input_data, mintype=mintype, error=config.cation_errors.get(mintype),
+                                  interactive=config.interactive_qc, n_bootstrap=config.n_bootstrap,
+                                  n_workers=config.n_workers, start_method=config.start_method)
+        result.minerals[mintype] = results
+        prefix = get_sheet_prefix(mintype)
+
+        # Generate output file
+        save_mineral_output(output_fname, results, mintype=mintype)
+        if config.arrow_export_path:
+            export_mineral_results(config.arrow_export_path, results, mintype=mintype, fmt=config.arrow_export_format)
+        if config.point_store_path or config.histogram_path or config.mixture_fits:
+            point_data = group_point_table(results['points'])
+            if config.point_store_path:
+                write_point_store(config.point_store_path, point_data, mintype=mintype)
+            if config.histogram_path:
+                from histograms import update_histograms
+                update_histograms(result.histograms, point_data, label=f'{prefix} points')
+                update_histograms(result.histograms, results['output_data'], label=f'{prefix} data')
+            if config.mixture_fits:
+                result.mixtures[mintype] = fit_mineral_mixtures(point_data, results['output_data'], mintype=mintype)
+                save_sheet_to_xlsx(output_fname, result.mixtures[mintype], sheet_name=f'{prefix} mixtures')
+        if config.qc_sweep_tolerances:
+            from qc_sweep import tolerance_sweep, plot_tolerance_sweep
+            area_sweep, sample_sweep = tolerance_sweep(results['points'], config.qc_sweep_tolerances, mintype=mintype)
+            result.qc_sweeps[mintype] = (area_sweep, sample_sweep)
+            save_sheet_to_xlsx(output_fname, sample_sweep, sheet_name=f'{prefix} QC sweep')
+            save_sheet_to_xlsx(output_fname, area_sweep, sheet_name=f'{prefix} QC sweep areas')
+            plot_tolerance_sweep(sample_sweep, mintype=mintype, error=results['cation_error'],
+                                 output_path=config.plot_path, rasterize=config.output_figure_rasterize,
+                                 dpi=config.output_figure_dpi)
+
+    if config.histogram_path:
+        from histograms import save_histograms
+        save_histograms(config.histogram_path, result.histograms)
+
+    minerals = result.minerals
+    if config.thermometry:
+        if 'orthopyroxene' in minerals and 'clinopyroxene' in minerals:
+            result.temperatures['Two-pyroxene T'] = calc_two_pyroxene_temperatures(
+                minerals['orthopyroxene']['sample_average_data'], minerals['clinopyroxene']['sample_average_data'])
+        if 'olivine' in minerals and 'spinel' in minerals:
+            result.temperatures['Olivine-spinel T'] = calc_olivine_spinel_temperatures(
+                minerals['olivine']['sample_average_data'], minerals['spinel']['sample_average_data'],
+                pressure=config.thermometry_pressure)
+        for sheet_name, temperatures in result.temperatures.items():
+            save_sheet_to_xlsx(output_fname, temperatures, sheet_name=sheet_name, index=True)
+
+    if config.equilibrium:
+        from equilibrium import calc_equilibrium, plot_equilibrium
+        result.equilibrium = calc_equilibrium(minerals, by_area=config.equilibrium_by_area,
+                                              kd_ranges=config.equilibrium_kd_ranges)
+        for table, sheet_name in [('samples', 'Fe-Mg Kd'), ('areas', 'Fe-Mg Kd areas'),
+                                  ('area pairs', 'Fe-Mg Kd area pairs')]:
+            if table in result.equilibrium:
+                save_sheet_to_xlsx(output_fname, result.equilibrium[table], sheet_name=sheet_name)
+        if len(result.equilibrium['samples']):
+            plot_equilibrium(result.equilibrium['samples'], area_kd=result.equilibrium['area pairs'],
+                             output_path=config.plot_path, rasterize=config.output_figure_rasterize,
+                             dpi=config.output_figure_dpi)
+
+    if config.pyroxene_quadrilateral:
+        from plotting_functions import pyroxene_quadrilateral_plot
+        pyroxene_points = {mintype: group_point_table(minerals[mintype]['points']) for mintype in minerals
+                           if 'pyroxene' in mintype}
+        if pyroxene_points:
+            pyroxene_quadrilateral_plot(pyroxene_points, level='points', output_path=config.plot_path,
+                                        rasterize=config.output_figure_rasterize, dpi=config.output_figure_dpi,
+                                        html=config.output_figure_html)
+
+    if config.depth_profiles:
+        from depth_profile import depth_profile_table, binned_depth_statistics, rolling_depth_statistics, \
+            plot_depth_profiles
+        for mintype, results in minerals.items():
+            points = results['points']
+            passed = points[('qc', 'Passed')].to_numpy()
+            profile = depth_profile_table(points.loc[passed, 'data'], points.loc[passed, 'ratios'])
+            result.depth_profiles[mintype] = {
+                'profile': profile,
+                'rolling': rolling_depth_statistics(profile, window=config.depth_window),
+                'binned': binned_depth_statistics(profile, bin_width=config.depth_bin_width)}
+            save_sheet_to_xlsx(output_fname, result.depth_profiles[mintype]['binned'],
+                               sheet_name=f'{get_sheet_prefix(mintype)} depth profile')
+        plot_depth_profiles({mintype: profiles['profile'] for mintype, profiles in result.depth_profiles.items()},
+                            rolling={mintype: profiles['rolling']
+                                     for mintype, profiles in result.depth_profiles.items()},
+                            output_path=config.plot_path, rasterize=config.output_figure_rasterize,
+                            dpi=config.output_figure_dpi)
+
+    if config.recplot:
+        from plotting_functions import get_rectangle_plot_data, make_rectangle_plot
+        # group up the data to pass into make_rectangle_plot, x = Fo and y = Mg#
+        grouped_data = get_rectangle_plot_data(xdata=minerals[config.recplot_x]['output_data'],
+                                               ydata=minerals[config.recplot_y]['output_data'], x='Fo', y='Mg#')
+        make_rectangle_plot(grouped_data, config.output_figure_fname, figformat=config.output_figure_format,
+                            rasterize=config.output_figure_rasterize, dpi=config.output_figure_dpi,
+                            html=config.output_figure_html)
+
+    if config.sample_reports:
+        from sample_reports import make_sample_reports
+        result.report_files = make_sample_reports(minerals, output_path=config.sample_report_path,
+                                                  n_workers=config.n_workers, recplot_x=config.recplot_x,
+                                                  recplot_y=config.recplot_y,
+                                                  rasterize=config.output_figure_rasterize,
+                                                  dpi=config.output_figure_dpi,
+                                                  start_method=config.start_method)
+
+    if config.hist_plots:
+        from plotting_functions import load_excel_data_for_plots, plot_hist
+        data = load_excel_data_for_plots(path=output_fname)
+        for sheet_name, key in config.hist_plots:
+            if sheet_name in data and key in data[sheet_name].columns:
+                plot_hist(data, mintype=sheet_name, key=key, output_path=config.plot_path,
+                          rasterize=config.output_figure_rasterize, dpi=config.output_figure_dpi,
+                          html=config.output_figure_html)
+            _close_new_figures(open_figures)
+
+    if plotting:
+        _close_new_figures(open_figures)
+    return result
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Make the plots listed in a manifest file (see plot_manifest.json), only re-drawing the figures whose data or
+settings have changed since they were last made.
+
+For each plot, a hash is calculated from the exact data that goes into it (the plotted columns, after any
+joining of different mineral types by sample), the plot settings and the plotting code. The hashes are stored
+in plot_hashes.json in the output folder, and a plot is skipped if its hash matches and the figure exists.
+Shared work - loading the spreadsheet, splitting the '<mean> ± <2SD>' sample averages into numbers, and joining
+sheets of different mineral types by sample - is done once per run and re-used by every plot that needs it.
+
+Manifest format (JSON):
+    {
+     "data_file": "output_data.xlsx",
+     "output_path": "./plots",
+     "rcParams": {"font.size": 14, "figure.figsize": [10, 8]},
+     "plots": [
+        {"type": "hist", "sheet": "Olivine data", "key": "Fo"},
+        {"type": "scatter", "x_sheet": "Olivine data", "x": "Fo", "y_sheet": "Olivine data", "y": "NiO"},
+        {"type": "scatter", "x_sheet": "Opx average", "x": "Mg#", "y_sheet": "Cpx average", "y": "Mg#",
+         "z_sheet": "Olivine average", "z": "Fo"},
+        {"type": "quadrilateral", "sheets": ["Opx data", "Cpx data"], "level": "samples"},
+        {"type": "scatter_grid", "fname": "average_scatter_grid.png", "ncols": 5,
+         "panels": [{"x_sheet": "Olivine average", "x": "Fo", "y_sheet": "Opx average", "y": "Mg#"},
+                    {"x_sheet": "Olivine average", "x": "Fo", "y_sheet": "Cpx average", "y": "Mg#"}]}
+     ]
+    }
+Any other settings in a plot entry (e.g. "bins": 20, "gaussian_fit": true, "marker": "o") are passed on to
+plotting_functions.plot_hist, plotting_functions.scatter_plot or plotting_functions.pyroxene_quadrilateral_plot
+(for "quadrilateral" plots of the En-Fs-Wo of the pyroxene area averages - "level": "areas", the default - or
+sample averages, "level": "samples"), or plotting_functions.scatter_grid (for "scatter_grid" plots, which draw
+the scatter plots of sample averages listed in "panels" as the panels of one figure, saved to "fname"). Settings for every plot (e.g.
+{"rasterize": true, "dpi": 300}) can be given in an optional "defaults" section, and are overridden by the
+settings of each plot.
+
+Usage:
+    python plot_manifest.py plot_manifest.json [--force]
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+
+import pandas as pd
+from matplotlib import rcParams
+from matplotlib import pyplot as plt
+
+import plotting_functions as pf
+
+HASH_FNAME = 'plot_hashes.json'
+PLOT_KEYS = {'hist': ['type', 'sheet', 'key'],
+             'scatter': ['type', 'x_sheet', 'x', 'y_sheet', 'y', 'z_sheet', 'z'],
+             'quadrilateral': ['type', 'sheets', 'level'],
+             'scatter_grid': ['type', 'panels']}
+REQUIRED_KEYS = {'hist': ['sheet', 'key'], 'scatter': ['x_sheet', 'x', 'y_sheet', 'y'],
+                 'quadrilateral': ['sheets'], 'scatter_grid': ['panels']}
+
+
+def load_manifest(path):
+    """
+    Load a plot manifest and check that every plot has the settings it needs.
+
+    Returns:
+        manifest: Dictionary of the manifest contents.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    defaults = manifest.get('defaults', {})
+    manifest['plots'] = [dict(defaults, **plot) for plot in manifest.get('plots', [])]
+    for idx, plot in enumerate(manifest.get('plots', [])):
+        if plot.get('type') not in PLOT_KEYS:
+            raise ValueError(f'Plot {idx} in {path}: type must be one of {list(PLOT_KEYS)}')
+        missing = [key for key in REQUIRED_KEYS[plot['type']] if key not in plot]
+        if missing:
+            raise ValueError(f'Plot {idx} in {path}: missing {missing}')
+        for panel in plot.get('panels', [plot]):
+            if ('z_sheet' in panel) != ('z' in panel):
+                raise ValueError(f'Plot {idx} in {path}: give both z_sheet and z, or neither')
+            if panel is not plot and any(key not in panel for key in REQUIRED_KEYS['scatter']):
+                raise ValueError(f'Plot {idx} in {path}: every panel needs {REQUIRED_KEYS["scatter"]}')
+    return manifest
+
+
+def split_average_sheet(sheet):
+    """
+    Split the '<mean> ± <2SD>' columns of a sample average sheet into a numeric column of the means and a
+    '2SD_<column>' column of the 2SDs, so they only have to be parsed once (see plotting_functions.get_data_and_std).
+
+    Returns:
+        sheet: New DataFrame with the split columns.
+    """
+    sheet = sheet.copy()
+    for col in list(sheet.columns):
+        if ((sheet[col].dtype == 'O' or pd.api.types.is_string_dtype(sheet[col]))
+                and sheet[col].astype(str).str.contains('±').any()):
+            values, uncertainty = pf.get_data_and_std(sheet[col])
+            sheet[col] = values
+            sheet[f'2SD_{col}'] = uncertainty
+    return sheet
+
+
+def prepare_plot_data(data_file):
+    """
+    Load the output spreadsheet once for all of the plots, and split the sample average sheets.
+
+    Returns:
+        prepared: Dictionary with the sheets ('sheets') and a cache of sheets joined by sample ('joins').
+    """
+    sheets = pf.load_excel_data_for_plots(path=data_file)
+    for name in sheets:
+        if 'average' in name:
+            sheets[name] = split_average_sheet(sheets[name])
+    return {'sheets': sheets, 'joins': {}}
+
+
+def get_plot_sheets(prepared, plot):
+    """
+    Get the sheets for a plot. Sheets of different mineral types are restricted to the samples they have in
+    common (as in scatter_plot); each combination of sheets is only joined once per run.
+    """
+    sheets = prepared['sheets']
+    if plot['type'] == 'hist':
+        return {plot['sheet']: sheets[plot['sheet']]}
+    if plot['type'] == 'quadrilateral':
+        return {name: sheets[name] for name in plot['sheets']}
+    if plot['type'] == 'scatter_grid':
+        # scatter_grid matches up the samples of every sheet itself
+        return {panel[f'{axis}_sheet']: sheets[panel[f'{axis}_sheet']] for panel in plot['panels']
+                for axis in ['x', 'y', 'z'] if f'{axis}_sheet' in panel}
+    names = (plot['x_sheet'], plot['y_sheet'], plot.get('z_sheet', False))
+    if names[0] == names[1]:
+        return {name: sheets[name] for name in names if name}
+    if names not in prepared['joins']:
+        average = any('average' in name for name in names if name)
+        joined = pf.filter_for_scatter(sheets, names[0], names[1], mintype_z=names[2], average=average)
+        prepared['joins'][names] = {name: joined[name] for name in names if name}
+    return prepared['joins'][names]
+
+
+def get_plot_filename(plot):
+    """
+    Filename the plot is saved to by plot_hist or scatter_plot.
+    """
+    if plot['type'] == 'hist':
+        return pf.get_hist_filename(plot['sheet'], plot['key'])
+    if plot['type'] == 'quadrilateral':
+        return pf.get_quadrilateral_filename(plot['sheets'], level=plot.get('level', 'areas'))
+    if plot['type'] == 'scatter_grid':
+        return plot.get('fname', inspect.signature(pf.scatter_grid).parameters['fname'].default)
+    return pf.get_scatter_filename(plot['x_sheet'], plot['x'], plot['y_sheet'], plot['y'],
+                                   mintype_z=plot.get('z_sheet', False), var3=plot.get('z', False))
+
+
+def hash_plot(plot, sheets, style):
+    """
+    Hash everything that goes into a plot: the plotted columns (and their 2SDs), the plot settings, the
+    rcParams set in the manifest and the source code of the plotting function.
+
+    Returns:
+        digest: Hex string of the hash.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps({'plot': plot, 'style': style}, sort_keys=True).encode('utf-8'))
+    if plot['type'] == 'hist':
+        columns = [(plot['sheet'], plot['key'])]
+        func = pf.plot_hist
+    elif plot['type'] == 'quadrilateral':
+        columns = [(sheet, col) for sheet in plot['sheets'] for col in ['Sample', 'Mg', 'Fe', 'Ca']]
+        func = pf.pyroxene_quadrilateral_plot
+    elif plot['type'] == 'scatter_grid':
+        columns = [(panel[f'{axis}_sheet'], panel[axis]) for panel in plot['panels'] for axis in ['x', 'y', 'z']
+                   if axis in panel]
+        func = pf.scatter_grid
+        # the data for every panel is prepared by grid_data_table
+        hasher.update(inspect.getsource(pf.grid_data_table).encode('utf-8'))
+    else:
+        columns = [(plot['x_sheet'], plot['x']), (plot['y_sheet'], plot['y'])]
+        if 'z' in plot:
+            columns.append((plot['z_sheet'], plot['z']))
+        func = pf.scatter_plot
+    hasher.update(inspect.getsource(func).encode('utf-8'))
+    for sheet, col in columns:
+        if col not in sheets[sheet].columns:
+            raise KeyError(f'{sheet}: {col}')
+        for name in [col, f'2SD_{col}']:
+            if name in sheets[sheet].columns:
+                hasher.update(name.encode('utf-8'))
+                hasher.update(pd.util.hash_pandas_object(sheets[sheet][name], index=False).to_numpy().tobytes())
+    return hasher.hexdigest()
+
+
+def render_plot(plot, sheets, output_path):
+    """
+    Draw a single plot from the manifest and close the figure.
+    """
+    options = {key: val for key, val in plot.items() if key not in PLOT_KEYS[plot['type']]}
+    if plot['type'] == 'hist':
+        pf.plot_hist(sheets, mintype=plot['sheet'], key=plot['key'], output_path=output_path, **options)
+    elif plot['type'] == 'quadrilateral':
+        pf.pyroxene_quadrilateral_plot({name: sheets[name] for name in plot['sheets']},
+                                       level=plot.get('level', 'areas'), output_path=output_path, **options)
+    elif plot['type'] == 'scatter_grid':
+        pf.scatter_grid(sheets, plot['panels'], output_path=output_path, **options)
+    else:
+        pf.scatter_plot(sheets, plot['x_sheet'], plot['y_sheet'], mintype_z=plot.get('z_sheet', False),
+                        var1=plot['x'], var2=plot['y'], var3=plot.get('z', False), output_path=output_path,
+                        **options)
+    plt.close()
+
+
+def render_manifest(manifest_path, data_file=None, output_path=None, force=False):
+    """
+    Make every plot in a manifest whose data, settings or plotting code have changed since it was last made.
+
+    Args:
+        manifest_path: Path of the manifest JSON file.
+        data_file: Output spreadsheet to plot. Default None, i.e. the data_file given in the manifest.
+        output_path: Folder to save the plots to. Default None, i.e. the output_path given in the manifest.
+        force: If True, re-draw every plot even if it is unchanged.
+
+    Returns:
+        rendered: List of the filenames of the plots that were (re-)drawn.
+    """
+    manifest = load_manifest(manifest_path)
+    data_file = data_file or manifest.get('data_file', 'output_data.xlsx')
+    output_path = output_path or manifest.get('output_path', './plots')
+    style = manifest.get('rcParams', {})
+    rcParams.update(style)
+    os.makedirs(output_path, exist_ok=True)
+
+    hash_fname = os.path.join(output_path, HASH_FNAME)
+    hashes = {}
+    if os.path.exists(hash_fname):
+        with open(hash_fname) as f:
+            hashes = json.load(f)
+
+    prepared = prepare_plot_data(data_file)
+    rendered = []
+    skipped = 0
+    for plot in manifest.get('plots', []):
+        fname = get_plot_filename(plot)
+        try:
+            sheets = get_plot_sheets(prepared, plot)
+            digest = hash_plot(plot, sheets, style)
+        except KeyError as e:
+            print(f'Skipping {fname} - {e} not found in {data_file}')
+            continue
+        if not force and hashes.get(fname) == digest and os.path.exists(os.path.join(output_path, fname)):
+            skipped += 1
+            continue
+        render_plot(plot, sheets, output_path)
+        hashes[fname] = digest
+        rendered.append(fname)
+        # save as we go, so an interrupted run does not lose track of the plots already made
+        with open(hash_fname, 'w') as f:
+            json.dump(hashes, f, indent=1, sort_keys=True)
+    print(f'{len(rendered)} plots made, {skipped} unchanged plots skipped')
+    return rendered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Make the plots listed in a plot manifest.')
+    parser.add_argument('manifest', nargs='?', default='plot_manifest.json', help='Manifest JSON file')
+    parser.add_argument('--data', default=None, help='Output spreadsheet to plot (overrides the manifest)')
+    parser.add_argument('--output', default=None, help='Folder to save the plots to (overrides the manifest)')
+    parser.add_argument('--force', action='store_true', help='Re-draw every plot, even if unchanged')
+    args = parser.parse_args()
+    render_manifest(args.manifest, data_file=args.data, output_path=args.output, force=args.force)
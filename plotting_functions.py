@@ -7,6 +7,9 @@ import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 import numpy as np
 from inout import get_data_filename
+from histograms import histogram_stats
+from gaussian_mixture import fit_gaussian_mixtures, fit_histogram_mixture, mixture_pdf
+from interactive_plots import save_interactive_html, tooltip_labels
 import pandas as pd
 import traceback
 from scipy.stats import norm
@@ -51,7 +54,8 @@ def filter_for_scatter(data, mintype_x, mintype_y, mintype_z=False, average=Fals
     return newdata
 
 def scatter_plot(data, mintype_x, mintype_y, mintype_z=False, var1='Si', var2='Ti', var3=False,
-                 marker='x', cbar_orientation='vertical', colourmap='plasma', output_path='./plots'):
+                 marker='x', cbar_orientation='vertical', colourmap='plasma', output_path='./plots',
+                 rasterize=False, dpi=300, html=False, max_html_points=5000):
     """
     x vs y scatter plot of two variables, with an option to have a third variable included as a symbol colour scale.
 
@@ -64,6 +68,12 @@ def scatter_plot(data, mintype_x, mintype_y, mintype_z=False, var1='Si', var2='T
         cbar_orientation - optional, 'horizontal' or 'vertical', controls orientation of colour bar
         colourmap - which colour map you want to use, see Matplotlib colourmaps for details
         output_path - path relative to the run directory that you want to save figures into
+        rasterize - if True, draw the points and error bars as an image at the given dpi, keeping the axes, labels
+            and colour bar as vectors. Keeps vector files (eps, pdf, svg) of large datasets small and quick to open.
+        dpi - resolution of the rasterized layers (and of the whole figure for png/jpg) if rasterize is True
+        html - if True, also save an interactive copy of the plot as HTML, with the sample and area of each point
+            shown when the mouse is over it (see interactive_plots.py). Requires mpld3.
+        max_html_points - largest number of points to write to the HTML copy - larger datasets are thinned out.
     Returns:
 
     """
@@ -102,16 +112,16 @@ def scatter_plot(data, mintype_x, mintype_y, mintype_z=False, var1='Si', var2='T
 
     # If plotting sample average data, then need to split data + 2SD
     if 'average' in mintype_x:
-        x_data, uncertainty_x = get_data_and_std(x_data)
-        y_data, uncertainty_y = get_data_and_std(y_data)
+        x_data, uncertainty_x = get_data_and_std(x_data, sheet=data[mintype_x])
+        y_data, uncertainty_y = get_data_and_std(y_data, sheet=data[mintype_y])
         if var3:
-            z_data, uncertainty_z = get_data_and_std(z_data)
+            z_data, uncertainty_z = get_data_and_std(z_data, sheet=data[mintype_z])
 
     if not var3 and not average:
-        plt.scatter(x_data, y_data, marker=marker)
+        points = plt.scatter(x_data, y_data, marker=marker)
 
     elif not var3 and average:
-        plt.scatter(x_data, y_data, marker=marker)
+        points = plt.scatter(x_data, y_data, marker=marker)
 
         plt.errorbar(x_data.to_numpy(dtype=float), y_data.to_numpy(dtype=float), fmt='none',
                      xerr=uncertainty_x.to_numpy(dtype=float), yerr=uncertainty_y.to_numpy(dtype=float))
@@ -119,14 +129,14 @@ def scatter_plot(data, mintype_x, mintype_y, mintype_z=False, var1='Si', var2='T
     # If we want to plot 3 variables, things are a bit more complicated. We need to set the symbol colour of each
     # point to some value, corresponding to var3.
     if var3:
-        colourmap = plt.cm.get_cmap(colourmap)
+        colourmap = plt.get_cmap(colourmap)
         # Set up scaling for our colour bar data
         z_data = z_data.to_numpy(dtype=float)
         scaled_z = (z_data - z_data.min()) / np.ptp(z_data)
         colours = colourmap(scaled_z)
         # Generate scatterplot
 
-        plt.scatter(x_data.to_numpy(dtype=float), y_data.to_numpy(dtype=float)
+        points = plt.scatter(x_data.to_numpy(dtype=float), y_data.to_numpy(dtype=float)
                         , marker=marker, facecolor=colours)
 
         if average:
@@ -150,20 +160,17 @@ def scatter_plot(data, mintype_x, mintype_y, mintype_z=False, var1='Si', var2='T
     plt.ylabel(ylabel)
     #plt.show()
     # different filename depending on whether we are plotting 3 variables or not.
-    if not var3:
-        output_filename = (f'{mintype_x.strip(' ').strip('average').strip('data').strip(' ')}_{var1}_vs_'
-                           f'{mintype_y.strip(' ').strip('average').strip('data').strip(' ')}_{var2}_scatter.png')
-    else:      
-        output_filename = (f'{mintype_x.strip(' ').strip('average').strip('data').strip(' ')}_{var1}_vs_'
-                           f'{mintype_y.strip(' ').strip('average').strip('data').strip(' ')}_{var2}_vs'
-                            f'{mintype_z.strip('average').strip('data').strip(' ')}_{var3}_scatter.png')
-
-
-    plt.savefig(output_path + '/' + output_filename)
+    output_filename = get_scatter_filename(mintype_x, var1, mintype_y, var2, mintype_z=mintype_z, var3=var3)
+    save_figure(output_path + '/' + output_filename, rasterize=rasterize, dpi=dpi)
+    if html:
+        save_interactive_html(output_path + '/' + output_filename.replace('.png', '.html'),
+                              point_labels={points: tooltip_labels(data[mintype_x].loc[x_data.index])},
+                              max_points=max_html_points)
     
     
 def plot_hist(data, mintype='Olivine data', key='Si', bins=10, gaussian_fit=False,
-              normalise=False, grid=True, output_path='./plots'):
+              normalise=False, grid=True, output_path='./plots', histogram=None, mixture=False,
+              rasterize=False, dpi=300, html=False):
     """
     Plot a histogram of a given variable.
 
@@ -177,25 +184,48 @@ def plot_hist(data, mintype='Olivine data', key='Si', bins=10, gaussian_fit=Fals
         normalise - if True, then set the y-axis to a probability density function rather than a raw count.
         grid - Whether you want a grid overlaid or not, set to False if not
         output_path - where to save the plot, default is a new folder called 'plots' within the current folder
+        histogram - optional pre-binned histogram (see histograms.py) to draw instead of binning data[mintype][key].
+            data and bins are then ignored, and the x-axis is limited to the range of the non-empty bins.
+        mixture - If True, fit a Gaussian mixture (see gaussian_mixture.py, number of components chosen by BIC) and
+            plot each component and their sum over the top. Can also be the rows of a mixtures table from
+            gaussian_mixture.fit_gaussian_mixtures for a single sample, to plot a fit that has already been done.
+            This forces normalise to be True.
+        rasterize - if True, draw the histogram bars as an image at the given dpi, keeping the axes, labels and
+            legend as vectors.
+        dpi - resolution of the rasterized layers (and of the whole figure for png/jpg) if rasterize is True
+        html - if True, also save an interactive copy of the plot as HTML, with the range and height of each bar
+            shown when the mouse is over it (see interactive_plots.py). Requires mpld3.
     """
     # If plotting a Gaussian fit over the top, then we need to normalise the data to create a pdf rather than plotting
     # raw counts
     plt.figure()
     mintype = sanitise_mineral_type(mintype)
-    if gaussian_fit:
+    if gaussian_fit or mixture is not False:
         normalise = True
-    data_to_plot = data[mintype][key]
+    if histogram is not None:
+        # draw straight from the counts - one "value" at the start of each bin, weighted by its count
+        plot_bins = histogram['edges']
+        n, plot_bins, patches = plt.hist(plot_bins[:-1], bins=plot_bins, weights=histogram['counts'],
+                                         label='Raw data', density=normalise)
+        filled = np.flatnonzero(histogram['counts'])
+        if len(filled):
+            plt.xlim(plot_bins[filled[0]], plot_bins[filled[-1] + 1])
+            plot_bins = plot_bins[filled[0]:filled[-1] + 2]
+    else:
+        data_to_plot = data[mintype][key]
 
-    # If plotting sample average data, then need to split data + 2SD
-    if 'average' in mintype:
-        data_to_plot, uncertainty = get_data_and_std(data_to_plot)
+        # If plotting sample average data, then need to split data + 2SD
+        if 'average' in mintype:
+            data_to_plot, uncertainty = get_data_and_std(data_to_plot, sheet=data[mintype])
 
-    n, plot_bins, patches = plt.hist(data_to_plot, bins=bins, label='Raw data', density=normalise)
+        n, plot_bins, patches = plt.hist(data_to_plot, bins=bins, label='Raw data', density=normalise)
     # Get the correct title based on what data we input
     if 'data' in mintype:
         title = f'Histogram of {mintype.strip("data")} {key}, averaged over areas'
     elif 'average' in mintype:
         title = f'Histogram of {mintype.strip("average")}{key}, whole sample average'
+    else:
+        title = f'Histogram of {mintype} {key}'
     plt.title(title)
 
     plt.xlabel(f'{mintype.strip("data").strip('average')}{key}')
@@ -209,7 +239,10 @@ def plot_hist(data, mintype='Olivine data', key='Si', bins=10, gaussian_fit=Fals
     # create the gaussian fit if doing
     if gaussian_fit:
         fit_bins = np.linspace(plot_bins[0], plot_bins[-1], 1000)
-        mu, sigma = norm.fit(data_to_plot.astype(float))
+        if histogram is not None:
+            mu, sigma = histogram_stats(histogram)
+        else:
+            mu, sigma = norm.fit(data_to_plot.astype(float))
         # add mu and sigma to the plot title
         title += f', mean = {np.round(mu, 3)}, sigma = {np.round(sigma, 3)}'
         plt.title(title)
@@ -217,6 +250,21 @@ def plot_hist(data, mintype='Olivine data', key='Si', bins=10, gaussian_fit=Fals
         plt.plot(fit_bins, best_fit_line, label=f'Gaussian fit', linewidth=2)
         plt.legend()
 
+    # overlay a Gaussian mixture fit, one line per component plus the total
+    if mixture is not False:
+        if mixture is True:
+            if histogram is not None:
+                mixture = fit_histogram_mixture(histogram)
+            else:
+                mixture = fit_gaussian_mixtures(np.asarray(data_to_plot, dtype=float))
+        fit_bins = np.linspace(plot_bins[0], plot_bins[-1], 1000)
+        total, components = mixture_pdf(fit_bins, mixture)
+        for idx, (mu, sigma) in enumerate(zip(mixture['Mean'], mixture['Sigma'])):
+            plt.plot(fit_bins, components[:, idx], linestyle='--', linewidth=1.5,
+                     label=f'Component {idx + 1}: mean = {np.round(mu, 3)}, sigma = {np.round(sigma, 3)}')
+        plt.plot(fit_bins, total, label=f'Mixture fit ({len(mixture)} components)', linewidth=2, color='k')
+        plt.legend()
+
     if grid:
         plt.grid()
     # plt.show()
@@ -226,8 +274,289 @@ def plot_hist(data, mintype='Olivine data', key='Si', bins=10, gaussian_fit=Fals
         os.makedirs(output_path)
 
     # auto-generate the output filename and then save
-    output_filename = f'{mintype.strip(' ').strip('average').strip('data').strip(' ')}_{key}_histogram.png'
-    plt.savefig(output_path + '/' + output_filename)
+    output_filename = get_hist_filename(mintype, key)
+    save_figure(output_path + '/' + output_filename, rasterize=rasterize, dpi=dpi)
+    if html:
+        save_interactive_html(output_path + '/' + output_filename.replace('.png', '.html'),
+                              patch_labels={patch: f'{key} {patch.get_x():.4g} to '
+                                                   f'{patch.get_x() + patch.get_width():.4g}: {patch.get_height():.4g}'
+                                            for patch in patches})
+
+
+def get_hist_filename(mintype, key):
+    """
+    Filename that plot_hist saves the histogram of <key> from sheet <mintype> to.
+    """
+    return f'{mintype.strip(' ').strip('average').strip('data').strip(' ')}_{key}_histogram.png'
+
+
+def get_scatter_filename(mintype_x, var1, mintype_y, var2, mintype_z=False, var3=False):
+    """
+    Filename that scatter_plot saves the plot of var1 (from sheet mintype_x) against var2 (from mintype_y),
+    optionally coloured by var3 (from mintype_z), to.
+    """
+    if not var3:
+        return (f'{mintype_x.strip(' ').strip('average').strip('data').strip(' ')}_{var1}_vs_'
+                f'{mintype_y.strip(' ').strip('average').strip('data').strip(' ')}_{var2}_scatter.png')
+    return (f'{mintype_x.strip(' ').strip('average').strip('data').strip(' ')}_{var1}_vs_'
+            f'{mintype_y.strip(' ').strip('average').strip('data').strip(' ')}_{var2}_vs'
+            f'{mintype_z.strip('average').strip('data').strip(' ')}_{var3}_scatter.png')
+
+
+def get_axis_label(mintype, var):
+    """
+    Axis label for column var of sheet mintype, as used by scatter_plot, e.g. 'Olivine Fo'.
+    """
+    return f'{mintype.strip(' ').strip('average').strip('data')}{var}'
+
+
+def grid_data_table(data, panels):
+    """
+    Join the columns used by a grid of scatter plots of sample averages into a single table with one row per
+    sample, with the '<mean> ± <2SD>' strings split into numbers once for every panel.
+
+    Args:
+        data: Dictionary of {sheet name: DataFrame of sample averages}, e.g. from load_excel_data_for_plots.
+        panels: List of dictionaries with the sheet names and columns of each panel, as 'x_sheet', 'x',
+                'y_sheet', 'y' and optionally 'z_sheet', 'z'.
+
+    Returns:
+        table: DataFrame indexed by sample, with columns (sheet, column) and (sheet, '2SD_<column>').
+    """
+    columns = {}
+    for panel in panels:
+        for axis in ['x', 'y', 'z']:
+            if panel.get(axis):
+                sheet = sanitise_mineral_type(panel[f'{axis}_sheet'])
+                if 'average' not in sheet:
+                    raise ValueError(f'{sheet}: scatter grids can only plot sample average sheets, as they are '
+                                     f'matched up by sample')
+                columns.setdefault(sheet, [])
+                if panel[axis] not in columns[sheet]:
+                    columns[sheet].append(panel[axis])
+    table = {}
+    for sheet, keys in columns.items():
+        samples = data[sheet]['Sample'].to_numpy()
+        for key in keys:
+            values, uncertainty = get_data_and_std(data[sheet][key], sheet=data[sheet])
+            table[(sheet, key)] = pd.Series(np.asarray(values, dtype=float), index=samples)
+            table[(sheet, f'2SD_{key}')] = pd.Series(np.asarray(uncertainty, dtype=float), index=samples)
+    # samples missing from a sheet are NaN, and are left out of the panels that use that sheet
+    return pd.concat(table, axis=1)
+
+
+def scatter_grid(data, panels, ncols=5, sharex=False, sharey=False, panel_size=(4, 3.5), marker='x',
+                 colourmap='plasma', output_path='./plots', fname='average_scatter_grid.png', rasterize=False,
+                 dpi=300, html=False, max_html_points=5000):
+    """
+    Scatter plots of sample averages from different sheets (as scatter_plot) drawn as the panels of a single figure,
+    e.g. the overview of every cross-mineral combination. The data for every panel is prepared once, by
+    grid_data_table, and the figure is saved once.
+
+    Args:
+        data: Dictionary of {sheet name: DataFrame of sample averages}, e.g. from load_excel_data_for_plots.
+        panels: List of dictionaries, one per panel, of 'x_sheet', 'x', 'y_sheet', 'y' and optionally 'z_sheet',
+                'z' to colour the points by a third variable (with a colour bar for that panel).
+        ncols: Number of panels in each row of the grid.
+        sharex, sharey: Share the x/y axes between the panels, as in plt.subplots (True, False, 'row' or 'col').
+        panel_size: (width, height) of each panel, in inches.
+        marker: Marker type, see Matplotlib documentation for details.
+        colourmap: Colour map for the panels with a third variable.
+        output_path: Path relative to the run directory to save the figure into.
+        fname: Filename to save the figure to.
+        rasterize: If True, draw the points and error bars as an image at the given dpi (see save_figure).
+        dpi: Resolution of the rasterized layers if rasterize is True.
+        html: If True, also save an interactive copy of the figure as HTML, with the sample of each point shown
+              when the mouse is over it (see interactive_plots.py). Requires mpld3.
+        max_html_points: Largest number of points to write to the HTML copy.
+
+    Returns:
+        fig: The figure.
+    """
+    for idx, panel in enumerate(panels):
+        if bool(panel.get('z_sheet')) != bool(panel.get('z')):
+            raise ValueError(f'Panel {idx}: you need to specify both a z-axis sheet name and variable name')
+    table = grid_data_table(data, panels)
+    nrows = -(-len(panels) // ncols)
+    ncols = min(ncols, len(panels))
+    fig, axes = plt.subplots(nrows, ncols, sharex=sharex, sharey=sharey, squeeze=False,
+                             figsize=(panel_size[0] * ncols, panel_size[1] * nrows))
+    point_labels = {}
+    for ax, panel in zip(axes.flat, panels):
+        keys = [(sanitise_mineral_type(panel[f'{axis}_sheet']), panel[axis]) for axis in ['x', 'y', 'z']
+                if panel.get(axis)]
+        # only the samples with every variable of this panel, as filter_for_scatter
+        rows = table[keys].notna().all(axis=1).to_numpy()
+        x, y = (table[key].to_numpy()[rows] for key in keys[:2])
+        xerr, yerr = (table[(sheet, f'2SD_{key}')].to_numpy()[rows] for sheet, key in keys[:2])
+        if len(keys) == 3:
+            z = table[keys[2]].to_numpy()[rows]
+            norm_z = plt.Normalize(*((z.min(), z.max()) if len(z) else (0, 1)))
+            colours = plt.get_cmap(colourmap)(norm_z(z))
+            points = ax.scatter(x, y, marker=marker, facecolor=colours)
+            ax.errorbar(x, y, xerr=xerr, yerr=yerr, fmt='none', ecolor=colours)
+            sm = plt.cm.ScalarMappable(norm=norm_z, cmap=colourmap)
+            # drawn as an inset of the panel, so that tight_layout leaves room for it
+            fig.colorbar(sm, cax=ax.inset_axes([1.03, 0, 0.05, 1])).set_label(get_axis_label(*keys[2]))
+        else:
+            points = ax.scatter(x, y, marker=marker)
+            ax.errorbar(x, y, xerr=xerr, yerr=yerr, fmt='none')
+        ax.grid()
+        ax.set_xlabel(get_axis_label(*keys[0]))
+        ax.set_ylabel(get_axis_label(*keys[1]))
+        point_labels[points] = tooltip_labels(pd.DataFrame({'Sample': table.index[rows]}))
+    for ax in axes.flat[len(panels):]:
+        ax.set_visible(False)
+    fig.tight_layout()
+    save_figure(output_path + '/' + fname, rasterize=rasterize, dpi=dpi)
+    if html:
+        save_interactive_html(output_path + '/' + os.path.splitext(fname)[0] + '.html', fig=fig,
+                              point_labels=point_labels, max_points=max_html_points)
+    return fig
+
+
+# Corners of the En-Fs-Wo triangle in the ternary plots: En at the bottom left, Fs at the bottom right, Wo at the top
+TERNARY_CORNERS = np.array([[0., 0.], [1., 0.], [0.5, np.sqrt(3) / 2]])
+# Field boundaries of the pyroxene quadrilateral (Morimoto, 1988), as (En, Fs, Wo) end points in mol%
+QUADRILATERAL_LINES = [((100, 0, 0), (0, 100, 0)), ((50, 0, 50), (0, 50, 50)), ((100, 0, 0), (50, 0, 50)),
+                       ((0, 100, 0), (0, 50, 50)), ((55, 0, 45), (0, 55, 45)), ((80, 0, 20), (0, 80, 20)),
+                       ((95, 0, 5), (0, 95, 5)), ((50, 50, 0), (47.5, 47.5, 5)), ((27.5, 27.5, 45), (25, 25, 50))]
+QUADRILATERAL_LABELS = {'Diopside': (36.25, 16.25, 47.5), 'Hedenbergite': (16.25, 36.25, 47.5),
+                        'Augite': (40, 27.5, 32.5), 'Pigeonite': (50, 37.5, 12.5),
+                        'Enstatite': (73.75, 23.75, 2.5), 'Ferrosilite': (23.75, 73.75, 2.5)}
+
+
+def ternary_coordinates(en, fs, wo):
+    """
+    Project En, Fs and Wo (in any units, normalised to sum to 1) onto the 2D coordinates of the ternary plot.
+
+    Args:
+        en, fs, wo: Arrays of the En, Fs and Wo of each point.
+
+    Returns:
+        xy: (points x 2) array of the plot coordinates.
+    """
+    components = np.column_stack([en, fs, wo]).astype(float)
+    components /= components.sum(axis=1, keepdims=True)
+    return components @ TERNARY_CORNERS
+
+
+def get_pyroxene_components(data, sample_average=False):
+    """
+    Get the En, Fs and Wo of each row of pyroxene data - from the 'En', 'Fs' and 'Wo' columns if present (e.g.
+    per-point data from inout.group_point_table), otherwise from the Mg, Fe and Ca cations (e.g. the 'Opx data' and
+    'Cpx data' sheets of the output spreadsheet).
+
+    Args:
+        data: DataFrame of pyroxene data.
+        sample_average: If True, average the En, Fs and Wo of the rows of each sample ('Sample' or
+                        'Project Path (2)' column).
+
+    Returns:
+        components: DataFrame with columns 'En', 'Fs' and 'Wo'.
+    """
+    if all(col in data.columns for col in ['En', 'Fs', 'Wo']):
+        components = data[['En', 'Fs', 'Wo']].astype(float)
+    elif all(col in data.columns for col in ['Mg', 'Fe', 'Ca']):
+        cations = data[['Mg', 'Fe', 'Ca']].to_numpy(dtype=float)
+        cations = cations / cations.sum(axis=1, keepdims=True)
+        components = pd.DataFrame(cations, index=data.index, columns=['En', 'Fs', 'Wo'])
+    else:
+        raise ValueError('Pyroxene data needs either En, Fs and Wo columns, or Mg, Fe and Ca cation columns')
+    if sample_average:
+        sample_col = 'Sample' if 'Sample' in data.columns else 'Project Path (2)'
+        components = components.groupby(data[sample_col].to_numpy(), sort=False).mean()
+    return components
+
+
+def get_quadrilateral_filename(labels, level='areas'):
+    """
+    Filename that pyroxene_quadrilateral_plot saves the plot of the given datasets to.
+    """
+    names = '_'.join(label.replace(' average', '').replace(' data', '').strip(' ') for label in labels)
+    return f'{names}_{level}_pyroxene_quadrilateral.png'
+
+
+def pyroxene_quadrilateral_plot(data, level='areas', density=None, gridsize=80, marker='o', colourmap='viridis',
+                                output_path='./plots', fname=None, rasterize=False, dpi=300, html=False,
+                                max_html_points=5000):
+    """
+    Plot pyroxene compositions on the En-Fs-Wo pyroxene quadrilateral, with the field boundaries of Morimoto (1988).
+
+    Args:
+        data - DataFrame of pyroxene data, or dictionary of {label: DataFrame} to plot several datasets together,
+            e.g. {'Opx data': ..., 'Cpx data': ...}. See get_pyroxene_components for the columns needed.
+        level - 'points', 'areas' or 'samples', for per-point data, area averages (e.g. the 'Opx data' sheet) or
+            sample averages. For 'samples', the rows of data are averaged for each sample first.
+        density - If True, plot the number of points in hexagonal bins (on a log scale) instead of every point,
+            which is much faster for hundreds of thousands of points. Default None, i.e. only if there are more
+            than 10000 points.
+        gridsize - number of hexagonal bins across the plot in density mode.
+        marker - marker type for the individual points.
+        colourmap - colour map for the density mode.
+        output_path - where to save the plot, default is a new folder called 'plots' within the current folder
+        fname - filename to save the plot to, default from get_quadrilateral_filename.
+        rasterize - if True, draw the points or bins as an image at the given dpi, keeping the field boundaries and
+            labels as vectors.
+        dpi - resolution of the rasterized layers (and of the whole figure for png/jpg) if rasterize is True
+        html - if True, also save an interactive copy of the plot as HTML, with the sample (and area) of each point
+            shown when the mouse is over it (see interactive_plots.py). Requires mpld3.
+        max_html_points - largest number of points to write to the HTML copy - larger datasets are thinned out.
+    """
+    if level not in ['points', 'areas', 'samples']:
+        raise ValueError('level must be "points", "areas" or "samples"')
+    if isinstance(data, pd.DataFrame):
+        data = {'Pyroxene': data}
+    components = {label: get_pyroxene_components(values, sample_average=level == 'samples')
+                  for label, values in data.items()}
+    coordinates = {label: ternary_coordinates(*values.to_numpy().T) for label, values in components.items()}
+    n_points = sum(len(xy) for xy in coordinates.values())
+    if density is None:
+        density = n_points > 10000
+
+    fig, ax = plt.subplots()
+    if density:
+        xy = np.concatenate(list(coordinates.values()))
+        xy = xy[~np.isnan(xy).any(axis=1)]
+        bins = ax.hexbin(xy[:, 0], xy[:, 1], gridsize=gridsize, extent=(0, 1, 0, TERNARY_CORNERS[2, 1] / 2 + 0.02),
+                         bins='log', mincnt=1, cmap=colourmap)
+        fig.colorbar(bins, ax=ax, label='Number of points', shrink=0.6)
+    else:
+        point_labels = {}
+        for label, xy in coordinates.items():
+            points = ax.scatter(xy[:, 0], xy[:, 1], marker=marker, s=12 if level == 'points' else 30,
+                                label=label.replace(' average', '').replace(' data', '').strip(' '))
+            if level == 'samples':
+                point_labels[points] = tooltip_labels(pd.DataFrame({'Sample': components[label].index}))
+            else:
+                point_labels[points] = tooltip_labels(data[label])
+        if len(coordinates) > 1:
+            ax.legend()
+
+    # field boundaries and names
+    for start, end in QUADRILATERAL_LINES:
+        line = ternary_coordinates(*np.array([start, end]).T)
+        ax.plot(line[:, 0], line[:, 1], color='k', linewidth=0.8)
+    for name, position in QUADRILATERAL_LABELS.items():
+        (x, y), = ternary_coordinates(*np.array([position]).T)
+        ax.text(x, y, name, ha='center', va='center', fontsize='small')
+    for name, position, align in [('En', (100, 0, 0), 'right'), ('Fs', (0, 100, 0), 'left'),
+                                  ('Di', (50, 0, 50), 'right'), ('Hd', (0, 50, 50), 'left')]:
+        (x, y), = ternary_coordinates(*np.array([position]).T)
+        ax.text(x, y, f' {name} ', ha=align, va='center')
+    ax.set_aspect('equal')
+    ax.axis('off')
+    ax.set_title(f'Pyroxene quadrilateral ({level}, {n_points} points)')
+
+    # Create output path if it does not already exist
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    if fname is None:
+        fname = get_quadrilateral_filename(list(data.keys()), level=level)
+    save_figure(output_path + '/' + fname, rasterize=rasterize, dpi=dpi, bbox_inches='tight')
+    if html:
+        save_interactive_html(output_path + '/' + os.path.splitext(fname)[0] + '.html',
+                              point_labels=None if density else point_labels, max_points=max_html_points)
 
 
 def get_rectangle_plot_data(xdata=False, ydata=False, x='Fo', y='Mg#'):
@@ -278,7 +607,7 @@ def get_rectangle_plot_data(xdata=False, ydata=False, x='Fo', y='Mg#'):
 def make_rectangle_plot(grouped_data, fname, scatter=False, fill=False,
                         x='Fo', y='Mg#',
                         x_mineral='Olivine', y_mineral='Opx',
-                        figformat='eps'):
+                        figformat='eps', rasterize=False, dpi=300, html=False, max_html_points=5000):
     """
     Generate a plot of x (default Fo) vs y (default Mg#) which plots a rectangle
     over the region covered by each area of the mineral.
@@ -303,6 +632,17 @@ def make_rectangle_plot(grouped_data, fname, scatter=False, fill=False,
                                    from. This is only used for the y-label. Defaults to 'Opx' (orthopyroxene).
         figformat (str, optional): Format we want to solve the figure into. Defaults to 'eps'.
                                    Other formats include 'jpg', 'png' and 'svg'.
+        rasterize (bool, optional): If True, the datapoints and rectangles are drawn as an image at
+                                    the given dpi, while the axes, labels and legend stay as vectors.
+                                    Recommended for eps/pdf/svg output of large datasets, which
+                                    otherwise write (and open) very slowly. Defaults to False.
+        dpi (int, optional): Resolution of the rasterized layers if rasterize is True. Defaults to 300.
+        html (bool, optional): If True, also save an interactive copy of the plot (to fname with the
+                               extension replaced by .html), with the sample of each rectangle and datapoint
+                               shown when the mouse is over it (see interactive_plots.py). Requires mpld3.
+                               Defaults to False.
+        max_html_points (int, optional): Largest number of datapoints to write to the HTML copy - larger
+                                         datasets are thinned out. Defaults to 5000.
     Returns:
         None.
     """
@@ -343,12 +683,15 @@ def make_rectangle_plot(grouped_data, fname, scatter=False, fill=False,
     # so we first need to calculate the width and height
     # we can optionally fill the rectangle using fill = True or False,
     # which is an optional argument to make_rectangle_plot()
+    rectangle_labels = {}
     for idx, val in min_max.iterrows():
         width = val[f'{x}_max'] - val[f'{x}_min']
         height = val[f'{y}_max'] - val[f'{y}_min']
-        ax.add_patch(Rectangle((val[f'{x}_min'], val[f'{y}_min']), width, height,
-                               fill=fill, color=colours[i],
-                               linewidth=3))
+        rectangle = ax.add_patch(Rectangle((val[f'{x}_min'], val[f'{y}_min']), width, height,
+                                           fill=fill, color=colours[i],
+                                           linewidth=3))
+        rectangle_labels[rectangle] = (f'{idx}: {x} {val[f"{x}_min"]:.4g} to {val[f"{x}_max"]:.4g}, '
+                                       f'{y} {val[f"{y}_min"]:.4g} to {val[f"{y}_max"]:.4g}')
         i += 1
 
     # set figure visual properties - legends, grids, limits, labels
@@ -365,9 +708,57 @@ def make_rectangle_plot(grouped_data, fname, scatter=False, fill=False,
     plt.legend(markerscale=3, fontsize=15)
     figure = plt.gcf()
     figure.set_size_inches(10, 6)
-    plt.savefig(fname, format=figformat, bbox_inches='tight')
+    save_figure(fname, rasterize=rasterize, dpi=dpi, format=figformat, bbox_inches='tight')
+    if html:
+        save_interactive_html(os.path.splitext(fname)[0] + '.html', patch_labels=rectangle_labels,
+                              max_points=max_html_points)
     #plt.show()
 
+def rasterize_data_layers(fig=None, min_line_points=1000):
+    """
+    Mark the data layers of every axes in a figure - scatter points, error bars, histogram bars, rectangles and
+    shaded bands, plus any lines with at least min_line_points points - to be drawn as an image when saved.
+    The axes, ticks, labels, grid, legends and colour bars are left as vectors.
+
+    Args:
+        fig: Figure to rasterize. Default None, i.e. the current figure.
+        min_line_points: Lines with fewer points than this (e.g. fitted curves) are left as vectors.
+
+    Returns:
+        None
+    """
+    if fig is None:
+        fig = plt.gcf()
+    for ax in fig.axes:
+        if ax.get_label() == '<colorbar>':
+            continue
+        for artist in list(ax.collections) + list(ax.patches):
+            artist.set_rasterized(True)
+        for line in ax.lines:
+            if len(line.get_xdata()) >= min_line_points:
+                line.set_rasterized(True)
+
+
+def save_figure(fname, rasterize=False, dpi=300, **kwargs):
+    """
+    Save the current figure, optionally rasterizing the data layers (see rasterize_data_layers) at the given dpi.
+
+    Args:
+        fname: Filename to save the figure to.
+        rasterize: If True, rasterize the data layers.
+        dpi: Resolution of the rasterized layers. Only used if rasterize is True, otherwise the
+             matplotlib default is used as before.
+        **kwargs: Passed to plt.savefig, e.g. format, bbox_inches.
+
+    Returns:
+        None
+    """
+    if rasterize:
+        rasterize_data_layers()
+        kwargs['dpi'] = dpi
+    plt.savefig(fname, **kwargs)
+
+
 def load_excel_data_for_plots(path=False):
     fname = get_data_filename(fname=path)
     xls = pd.ExcelFile(fname)
@@ -402,8 +793,13 @@ def sanitise_mineral_type(mintype):
 
     return mintype
 
-def get_data_and_std(data_to_plot):
-    if data_to_plot.dtype == 'O':  # Pandas string datatype
+def get_data_and_std(data_to_plot, sheet=None):
+    # If the sheet has already been split into values and '2SD_<column>' columns (see
+    # plot_manifest.split_average_sheet), use those rather than parsing the strings again
+    is_string = data_to_plot.dtype == 'O' or pd.api.types.is_string_dtype(data_to_plot)
+    if sheet is not None and not is_string and f'2SD_{data_to_plot.name}' in sheet.columns:
+        return data_to_plot, sheet[f'2SD_{data_to_plot.name}'].loc[data_to_plot.index]
+    if is_string:  # Pandas string datatype
     # Remove plus minus symbol and split, so we have the data and the uncertainty
         data = data_to_plot.str.replace('±', '', regex=True).str.split(' ', expand=True)
     else:
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk store of the quality-checked data for each datapoint, so that the per-point distributions can be
+revisited (histograms, scatter plots, re-averaging) without re-running the whole analysis, even when
+the full dataset is too large to fit in memory.
+
+Each mineral type is stored in its own folder, with one binary file per column (fixed data type, read
+back as a NumPy memory map so that only the rows that are actually used are read from disk), plus:
+    schema.json - the data type of each column and the number of rows stored.
+    index.csv   - the sample and area of each block of rows (rows are sorted by sample and area when
+                  written, so each area is stored as a contiguous block).
+
+Example:
+    write_point_store('point_store', point_data, mintype='olivine')
+    fo = load_point_columns('point_store', 'olivine', columns=['Fo'], samples=['Sample 1'])['Fo']
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+INDEX_COLUMNS = ['Sample', 'Area']
+# Text columns are stored as fixed-width strings of (at least) this many characters
+MIN_STRING_LENGTH = 32
+
+
+def _store_dir(path, mintype):
+    return os.path.join(path, mintype.lower())
+
+
+def _column_fname(store_dir, column):
+    # column names such as 'Mg#' are fine as filenames, but '/' is not
+    return os.path.join(store_dir, column.replace('/', '_') + '.bin')
+
+
+def read_store_schema(path, mintype):
+    """
+    Read the schema (column data types and number of rows) of a stored mineral type.
+
+    Returns:
+        schema: Dictionary with keys 'columns' ({column: dtype string}) and 'n_rows'.
+    """
+    with open(os.path.join(_store_dir(path, mintype), 'schema.json')) as f:
+        return json.load(f)
+
+
+def read_store_index(path, mintype):
+    """
+    Read the index of a stored mineral type.
+
+    Returns:
+        index: DataFrame with one row per contiguous block of rows, with columns 'Sample', 'Area',
+               'start' and 'stop' (the block is rows start:stop).
+    """
+    return pd.read_csv(os.path.join(_store_dir(path, mintype), 'index.csv'),
+                       dtype={'Sample': str, 'Area': str})
+
+
+def write_point_store(path, point_data, mintype='olivine', append=False):
+    """
+    Write per-point data (e.g. from inout.group_point_table) to the point store.
+
+    Args:
+        path: Folder of the point store. Created if it does not already exist.
+        point_data: DataFrame of per-point data, with 'Sample' and 'Area' columns.
+        mintype: Mineral type - each mineral type is stored separately.
+        append: If False (default), any existing data for this mineral type is replaced. If True, the data is
+                added to the end of the existing data, e.g. when writing a large dataset in chunks. The columns
+                must then match those already stored.
+
+    Returns:
+        None
+    """
+    store_dir = _store_dir(path, mintype)
+    os.makedirs(store_dir, exist_ok=True)
+    schema_fname = os.path.join(store_dir, 'schema.json')
+    append = append and os.path.exists(schema_fname)
+
+    # sort by sample and area so that each area is a contiguous block of rows
+    point_data = point_data.sort_values(INDEX_COLUMNS, kind='stable')
+    columns = [col for col in point_data.columns if col not in INDEX_COLUMNS]
+
+    if append:
+        schema = read_store_schema(path, mintype)
+        if set(schema['columns']) != set(columns):
+            raise ValueError(f'Columns do not match those already stored for {mintype}')
+        index = read_store_index(path, mintype)
+    else:
+        schema = {'columns': {}, 'n_rows': 0}
+        for col in columns:
+            if pd.api.types.is_numeric_dtype(point_data[col]) or pd.api.types.is_bool_dtype(point_data[col]):
+                dtype = np.dtype('float64') if point_data[col].dtype.kind in 'fiu' else np.dtype('bool')
+            else:
+                lengths = point_data[col].astype(str).str.len()
+                # (no datapoints, e.g. if none passed the quality check - use the minimum width)
+                width = max(MIN_STRING_LENGTH, int(lengths.max()) if len(lengths) else 0)
+                dtype = np.dtype(f'U{width}')
+            schema['columns'][col] = dtype.str
+        index = pd.DataFrame(columns=INDEX_COLUMNS + ['start', 'stop'])
+
+    for col, dtype in schema['columns'].items():
+        dtype = np.dtype(dtype)
+        values = point_data[col]
+        if dtype.kind == 'U':
+            values = values.astype(str)
+            if values.str.len().max() > dtype.itemsize // 4:
+                raise ValueError(f'Values of "{col}" are longer than the stored width of {dtype.itemsize // 4}')
+        with open(_column_fname(store_dir, col), 'ab' if append else 'wb') as f:
+            np.asarray(values, dtype=dtype).tofile(f)
+
+    # one index entry for each (sample, area) block
+    keys = point_data[INDEX_COLUMNS].astype(str)
+    new_block = (keys != keys.shift()).any(axis=1).to_numpy()
+    starts = np.flatnonzero(new_block)
+    stops = np.r_[starts[1:], len(point_data)] if len(starts) else starts
+    blocks = keys.iloc[starts].reset_index(drop=True)
+    blocks['start'] = starts + schema['n_rows']
+    blocks['stop'] = stops + schema['n_rows']
+    index = pd.concat([index, blocks], ignore_index=True) if len(index) else blocks
+    index.to_csv(os.path.join(store_dir, 'index.csv'), index=False)
+
+    schema['n_rows'] += len(point_data)
+    with open(schema_fname, 'w') as f:
+        json.dump(schema, f, indent=1)
+
+
+def open_point_columns(path, mintype, columns=None):
+    """
+    Open the stored columns as read-only memory maps - no data is read from disk until it is used.
+
+    Args:
+        path: Folder of the point store.
+        mintype: Mineral type.
+        columns: Columns to open. Default None, i.e. all of them.
+
+    Returns:
+        arrays: Dictionary of {column: numpy.memmap}.
+    """
+    schema = read_store_schema(path, mintype)
+    if columns is None:
+        columns = list(schema['columns'])
+    arrays = {}
+    for col in columns:
+        if col not in schema['columns']:
+            raise KeyError(f'Column "{col}" not found in the point store for {mintype}')
+        if schema['n_rows'] == 0:
+            arrays[col] = np.empty(0, dtype=schema['columns'][col])
+        else:
+            arrays[col] = np.memmap(_column_fname(_store_dir(path, mintype), col), mode='r',
+                                    dtype=schema['columns'][col], shape=(schema['n_rows'],))
+    return arrays
+
+
+def select_rows(index, samples=None, areas=None):
+    """
+    Get the blocks of rows for the given samples and/or areas.
+
+    Args:
+        index: DataFrame from read_store_index.
+        samples: List of samples to select. Default None, i.e. all samples.
+        areas: List of areas to select. Default None, i.e. all areas.
+
+    Returns:
+        blocks: The matching rows of index, with adjacent blocks merged.
+    """
+    mask = np.ones(len(index), dtype=bool)
+    if samples is not None:
+        mask &= index['Sample'].isin([str(sample) for sample in samples]).to_numpy()
+    if areas is not None:
+        mask &= index['Area'].isin([str(area) for area in areas]).to_numpy()
+    return index[mask]
+
+
+def load_point_columns(path, mintype, columns=None, samples=None, areas=None, labels=False):
+    """
+    Load stored columns for the given samples and/or areas. Only the requested columns and rows are read.
+    If the selected rows form one contiguous block (e.g. a single sample, or everything), the arrays are
+    views of the memory maps, i.e. nothing is copied until the values are used.
+
+    Args:
+        path: Folder of the point store.
+        mintype: Mineral type.
+        columns: Columns to load. Default None, i.e. all of them.
+        samples: List of samples to select. Default None, i.e. all samples.
+        areas: List of areas to select. Default None, i.e. all areas.
+        labels: If True, also return the 'Sample' and 'Area' of each row.
+
+    Returns:
+        arrays: Dictionary of {column: array}.
+    """
+    arrays = open_point_columns(path, mintype, columns=columns)
+    index = read_store_index(path, mintype)
+    blocks = select_rows(index, samples=samples, areas=areas)
+    starts = blocks['start'].to_numpy(dtype=np.int64)
+    stops = blocks['stop'].to_numpy(dtype=np.int64)
+
+    if len(blocks) == 0:
+        rows = slice(0, 0)
+    elif np.all(starts[1:] == stops[:-1]):
+        rows = slice(starts[0], stops[-1])
+    else:
+        lengths = stops - starts
+        rows = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+    out = {col: array[rows] for col, array in arrays.items()}
+    if labels:
+        lengths = stops - starts
+        out['Sample'] = np.repeat(blocks['Sample'].to_numpy(), lengths)
+        out['Area'] = np.repeat(blocks['Area'].to_numpy(), lengths)
+    return out
+
+
+def load_point_data(path, mintype, columns=None, samples=None, areas=None):
+    """
+    As load_point_columns, but return a DataFrame with 'Sample' and 'Area' columns (i.e. in the same format
+    as inout.group_point_table), for passing into the plotting functions.
+    """
+    return pd.DataFrame(load_point_columns(path, mintype, columns=columns, samples=samples, areas=areas,
+                                           labels=True))
+
+
+def store_area_averages(path, mintype, columns, chunk_rows=10000000):
+    """
+    Re-calculate the average of the given columns for each area, directly from the point store, reading
+    chunk_rows rows at a time so that memory use does not depend on the size of the store.
+
+    Args:
+        path: Folder of the point store.
+        mintype: Mineral type.
+        columns: Numeric columns to average.
+        chunk_rows: Number of rows to read at once.
+
+    Returns:
+        averages: DataFrame indexed by ('Sample', 'Area'), with the average of each column and the
+                  number of datapoints averaged ('counts').
+    """
+    arrays = open_point_columns(path, mintype, columns=columns)
+    index = read_store_index(path, mintype)
+    starts = index['start'].to_numpy(dtype=np.int64)
+    stops = index['stop'].to_numpy(dtype=np.int64)
+    sums = np.zeros((len(index), len(columns)))
+    for chunk_start in range(0, int(stops.max(initial=0)), chunk_rows):
+        chunk_stop = chunk_start + chunk_rows
+        # the part of each block within this chunk
+        lo = np.clip(starts, chunk_start, chunk_stop) - chunk_start
+        hi = np.clip(stops, chunk_start, chunk_stop) - chunk_start
+        in_chunk = hi > lo
+        for idx, col in enumerate(columns):
+            values = np.asarray(arrays[col][chunk_start:chunk_stop], dtype=float)
+            cumsum = np.r_[0., np.cumsum(values)]
+            sums[in_chunk, idx] += cumsum[hi[in_chunk]] - cumsum[lo[in_chunk]]
+
+    # the same area may have been written in several blocks (if appended), so combine them
+    totals = pd.DataFrame(sums, columns=columns)
+    totals['counts'] = stops - starts
+    totals[INDEX_COLUMNS] = index[INDEX_COLUMNS]
+    totals = totals.groupby(INDEX_COLUMNS, sort=False).sum()
+    averages = totals[columns].div(totals['counts'], axis=0)
+    averages['counts'] = totals['counts']
+    return averages
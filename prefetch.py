@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Analyse many input spreadsheets one after another, with the next ones read in the background while the current one
+is being analysed, so the time spent waiting for pd.read_excel overlaps with the calculations.
+
+PrefetchReader starts n_threads reader threads, which each take the next spreadsheet, read all of its sheets
+(once - rather than once per mineral, as when run_pipeline is given a filename) and put it in a queue of at most
+max_prefetch spreadsheets. When the queue is full the readers wait for space (back-pressure), so at most
+max_prefetch + n_threads spreadsheets are held in memory besides the one being analysed, however many there are.
+
+The reader keeps track of how long each stage spent working and waiting (PrefetchMetrics). The run is classed by
+the time each stage spent working, which (unlike the waits) doesn't depend on how long the run was:
+    - if reading a spreadsheet took longer than analysing one (counting the reader threads as working side by side)
+      the reading can't keep up - the run is I/O-bound, and more reader threads (or faster storage) may help,
+    - otherwise the analysis can't keep up - the run is compute-bound, and more reader threads won't help.
+The waits show the same from the other side: readers waiting for space in a full queue, or the analysis waiting for
+the next spreadsheet (which always includes waiting for the first one).
+Parsing spreadsheets is mostly Python code, so reader threads mainly overlap with the parts of the analysis that
+run outside Python (NumPy/Pandas calculations, writing files) rather than with each other.
+
+Usage:
+    python prefetch.py <output folder> run1.xlsx run2.xlsx ... --threads 2 --prefetch 2
+writes the outputs of each input file to <output folder>/<name>/output_data.xlsx (as watch_folder.py does), and
+prints the metrics at the end.
+"""
+
+import argparse
+import os
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from multiprocessing import get_all_start_methods
+
+import numpy as np
+import pandas as pd
+
+from pipeline import run_pipeline, PipelineConfig
+from watch_folder import get_output_dir, parse_tolerances
+from workbook_merge import read_workbook
+
+
+def read_input_workbook(path):
+    """
+    Read every sheet of an input spreadsheet into one DataFrame, with the mineral of each analysis in a 'Phase'
+    column, which can be passed into run_pipeline (or pipeline.analyse_mineral) in place of the filename.
+    """
+    return read_workbook(path).drop(columns=['Source file', 'Source row'])
+
+
+@dataclass
+class PrefetchMetrics:
+    """
+    Time spent working and waiting by each stage of a PrefetchReader, in seconds.
+
+    Attributes:
+        n_threads: Number of reader threads.
+        n_files: Number of spreadsheets read.
+        read_times: Time taken to read each spreadsheet.
+        read_idle: Total time the reader threads waited for space in the queue (back-pressure from the analysis).
+        compute_time: Total time spent analysing the spreadsheets (between getting one and asking for the next).
+        compute_idle: Total time the analysis waited for the next spreadsheet to be read.
+        read_queue_depths: Number of spreadsheets not yet started by the readers, each time one was taken.
+        compute_queue_depths: Number of spreadsheets read and waiting in the queue, each time one was taken.
+        wall_time: Time from starting the readers to the last spreadsheet being analysed.
+    """
+    n_threads: int = 1
+    n_files: int = 0
+    read_times: list = field(default_factory=list)
+    read_idle: float = 0.
+    compute_time: float = 0.
+    compute_idle: float = 0.
+    read_queue_depths: list = field(default_factory=list)
+    compute_queue_depths: list = field(default_factory=list)
+    wall_time: float = 0.
+
+    def bound(self):
+        """
+        'I/O-bound' if the reader threads between them took longer to read the spreadsheets than the analysis
+        took to analyse them, otherwise 'compute-bound'.
+        """
+        return 'I/O-bound' if np.sum(self.read_times) / self.n_threads > self.compute_time else 'compute-bound'
+
+    def summary(self):
+        """
+        Table of the busy and idle time and the queue depths of each stage.
+
+        Returns:
+            summary: DataFrame with one row for each stage ('read' and 'compute').
+        """
+        rows = []
+        for stage, busy, idle, depths in [('read', np.sum(self.read_times), self.read_idle, self.read_queue_depths),
+                                          ('compute', self.compute_time, self.compute_idle,
+                                           self.compute_queue_depths)]:
+            rows.append({'Stage': stage, 'Busy (s)': busy, 'Idle (s)': idle,
+                         'Mean queue depth': np.mean(depths) if depths else 0.,
+                         'Max queue depth': max(depths, default=0)})
+        return pd.DataFrame(rows)
+
+
+class PrefetchReader:
+    """
+    Read spreadsheets in background threads, a bounded number ahead of the code using them (see the top of this
+    file). Iterate over it to get (path, data, error) for each spreadsheet, in the order they finish being read
+    (the order given, with one thread). error is the exception raised while reading it (data is then None), or None.
+
+    Example:
+        with PrefetchReader(paths, n_threads=2, max_prefetch=2) as reader:
+            for path, data, error in reader:
+                ...
+        print(reader.metrics.summary())
+
+    Args:
+        paths: List of filenames of the spreadsheets.
+        read: Function to read a spreadsheet, given its filename. Default read_input_workbook.
+        n_threads: Number of reader threads.
+        max_prefetch: Largest number of spreadsheets to hold in the queue, read but not yet taken.
+    """
+
+    def __init__(self, paths, read=read_input_workbook, n_threads=2, max_prefetch=2):
+        if n_threads < 1 or max_prefetch < 1:
+            raise ValueError('n_threads and max_prefetch must be at least 1')
+        self.paths = list(paths)
+        self.read = read
+        self.n_threads = n_threads
+        self.metrics = PrefetchMetrics(n_threads=min(n_threads, max(len(self.paths), 1)))
+        self._queue = queue.Queue(maxsize=max_prefetch)
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """
+        Start the reader threads.
+        """
+        self._start_time = time.perf_counter()
+        self._threads = [threading.Thread(target=self._read_loop, daemon=True, name=f'prefetch-{idx}')
+                         for idx in range(min(self.n_threads, len(self.paths)))]
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        """
+        Stop the reader threads, e.g. if the analysis stopped before every spreadsheet was taken.
+        """
+        self._stop.set()
+        for thread in self._threads:
+            # make space for any thread waiting to put a spreadsheet in the queue
+            while thread.is_alive():
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                thread.join(timeout=0.1)
+        self._threads = []
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if self._next >= len(self.paths):
+                    return
+                path = self.paths[self._next]
+                self._next += 1
+            start = time.perf_counter()
+            try:
+                item = (path, self.read(path), None)
+            except Exception as error:
+                item = (path, None, error)
+            read_time = time.perf_counter() - start
+            # wait for space in the queue, checking for close() every so often
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            with self._lock:
+                self.metrics.read_times.append(read_time)
+                self.metrics.read_idle += time.perf_counter() - start - read_time
+
+    def __iter__(self):
+        if not self._threads:
+            self.start()
+        metrics = self.metrics
+        for _ in range(len(self.paths)):
+            start = time.perf_counter()
+            with self._lock:
+                metrics.read_queue_depths.append(len(self.paths) - self._next)
+            metrics.compute_queue_depths.append(self._queue.qsize())
+            item = self._queue.get()
+            got = time.perf_counter()
+            metrics.compute_idle += got - start
+            metrics.n_files += 1
+            yield item
+            # the time until the next spreadsheet is asked for is spent analysing this one
+            metrics.compute_time += time.perf_counter() - got
+        metrics.wall_time = time.perf_counter() - self._start_time
+
+
+def analyse_workbooks(paths, output_dir, n_threads=2, max_prefetch=2, **config):
+    """
+    Run the analysis on each of several input spreadsheets, reading the next ones in the background (see the top of
+    this file), and write the outputs of each into a folder under output_dir as watch_folder.py does.
+
+    Args:
+        paths: List of filenames of the spreadsheets.
+        output_dir: Folder to write the outputs into, mirroring the layout of the input files.
+        n_threads: Number of reader threads.
+        max_prefetch: Largest number of spreadsheets to read ahead.
+        **config: Other settings for PipelineConfig, e.g. mintypes or cation_errors. The cation quality check is
+                  not interactive. Worker processes (with n_workers) are started with forkserver (or spawned)
+                  by default, rather than forked while the reader threads are running.
+
+    Returns:
+        output_filenames: Dictionary of {input file: output spreadsheet} for the files that were analysed.
+        metrics: PrefetchMetrics of the run.
+    """
+    paths = list(paths)
+    if not paths:
+        raise ValueError('No input spreadsheets given')
+    config.setdefault('start_method', 'forkserver' if 'forkserver' in get_all_start_methods() else 'spawn')
+    input_dir = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    output_filenames = {}
+    with PrefetchReader(paths, n_threads=n_threads, max_prefetch=max_prefetch) as reader:
+        for path, data, error in reader:
+            if error is not None:
+                print(f'Failed to read {path}:')
+                traceback.print_exception(error)
+                continue
+            output_path = get_output_dir(os.path.abspath(path), input_dir, output_dir)
+            os.makedirs(output_path, exist_ok=True)
+            output_filename = os.path.join(output_path, 'output_data.xlsx')
+            print(f'Analysing {path}...')
+            try:
+                run_pipeline(PipelineConfig(**dict(config, data_filename=data, output_data_fname=output_filename,
+                                                   overwrite_output=True, interactive_qc=False)))
+            except Exception:
+                print(f'Failed to process {path}:')
+                traceback.print_exc()
+                continue
+            output_filenames[path] = output_filename
+    metrics = reader.metrics
+    print(metrics.summary().to_string(index=False))
+    print(f'{metrics.n_files} files in {metrics.wall_time:.1f} s - {metrics.bound()}')
+    return output_filenames, metrics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analyse several input spreadsheets, reading the next ones in the '
+                                                 'background.')
+    parser.add_argument('output', help='Folder to write the outputs into')
+    parser.add_argument('inputs', nargs='+', help='Input spreadsheets')
+    parser.add_argument('--threads', type=int, default=2, help='Number of reader threads (default 2)')
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='Largest number of spreadsheets to read ahead (default 2)')
+    parser.add_argument('--tolerance', action='append', default=[],
+                        help='Cation sum tolerance for a mineral, e.g. olivine=0.01 (repeatable)')
+    args = parser.parse_args()
+    analyse_workbooks(args.inputs, args.output, n_threads=args.threads, max_prefetch=args.prefetch,
+                      cation_errors=parse_tolerances(args.tolerance))
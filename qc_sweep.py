@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Sensitivity of the area and sample averages to the cation quality check tolerance.
+
+Rather than re-running the analysis once per tolerance, each datapoint is assigned the smallest of the
+tolerances it passes (the masks for increasing tolerances are nested, so it passes all of the larger ones too).
+The sums and counts of each area are binned by this tolerance level and accumulated along the tolerance axis,
+which gives the area averages for every tolerance in one pass over the datapoints. The mineral formula is then
+recalculated from the area averages, and the sample averages and 2SDs are taken over the areas, as in
+pipeline.analyse_mineral.
+"""
+
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from get_composition import calc_composition
+from inout import OXIDE_NAMES
+from plotting_functions import save_figure
+from quality_checking import get_cation_count
+
+# averaged over the areas, as in averaging.average_over_areas
+AREA_AVERAGE_NAMES = ['Depth', 'Si', 'Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Ni', 'Fe', 'Ca', 'Na', 'K']
+
+
+def _group_means(codes, values, n_groups):
+    """
+    Sum, count and mean of each column of values (points x variables) for each group code, ignoring NaNs.
+    """
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.)
+    sums = np.stack([np.bincount(codes, weights=filled[:, i], minlength=n_groups)
+                     for i in range(values.shape[1])], axis=1)
+    counts = np.stack([np.bincount(codes, weights=valid[:, i], minlength=n_groups)
+                       for i in range(values.shape[1])], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return sums, counts, means
+
+
+def tolerance_sweep(points, tolerances, mintype='olivine', keys=None):
+    """
+    Calculate the area and sample averages for every cation sum tolerance in tolerances, in a single pass.
+
+    Args:
+        points: Per-point table of every datapoint (before the quality check removes any), i.e. the 'points'
+                of pipeline.analyse_mineral.
+        tolerances: List of tolerances on the cation sum, i.e. values of error in cation_quality_check.
+        mintype: Mineral type being analysed.
+        keys: Variables to give the sample averages of. Default None, i.e. all of the ratios (Fo, Mg#, CrN etc.).
+
+    Returns:
+        area_sweep: DataFrame of the area averages (oxides and ratios) for each tolerance, with columns 'Sample',
+                    'Area', 'Tolerance' and 'Number of datapoints averaged'. Areas with no datapoints within
+                    a tolerance are left out for that tolerance.
+        sample_sweep: Tidy DataFrame of the sample averages, with one row per sample, tolerance and variable,
+                      and columns 'Sample', 'Tolerance', 'Variable', 'Mean', '2SD', 'Number of areas',
+                      'Number of datapoints' and 'Datapoints kept (%)'.
+    """
+    tolerances = np.unique(np.asarray(tolerances, dtype=float))
+    if tolerances.size == 0 or np.any(tolerances <= 0):
+        raise ValueError('Tolerances must be a non-empty list of positive numbers')
+    n_tol = len(tolerances)
+    data = points['data']
+    samples = data['Project Path (2)'].to_numpy()
+    areas = data['Project Path (3)'].to_numpy()
+    names = [name for name in AREA_AVERAGE_NAMES if name in data.columns]
+
+    # the smallest tolerance each datapoint passes, i.e. |cation sum - 3 or 4| < tolerance - datapoints that
+    # fail all of them (or have no cation sum) get n_tol
+    deviation = np.abs(points[('cat_props', 'sum')].to_numpy(dtype=float) - get_cation_count(mintype))
+    level = np.searchsorted(tolerances, deviation, side='right')
+    level[np.isnan(deviation)] = n_tol
+    # as groupby, datapoints without a sample or area are not averaged
+    grouped = pd.notna(samples) & pd.notna(areas)
+    area_codes, area_index = pd.MultiIndex.from_arrays([samples[grouped], areas[grouped]]).factorize()
+    level = level[grouped]
+    n_areas = len(area_index)
+    total_points = np.bincount(area_codes, minlength=n_areas)
+
+    # bin the sums by area and tolerance level, then accumulate along the tolerance axis (the masks are nested)
+    keep = level < n_tol
+    codes = area_codes[keep] * n_tol + level[keep]
+    values = data.loc[grouped, names].to_numpy(dtype=float)[keep]
+    sums, counts, _ = _group_means(codes, values, n_areas * n_tol)
+    sums = sums.reshape(n_areas, n_tol, -1).cumsum(axis=1)
+    counts = counts.reshape(n_areas, n_tol, -1).cumsum(axis=1)
+    n_points = np.bincount(codes, minlength=n_areas * n_tol).reshape(n_areas, n_tol).cumsum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums / counts).reshape(n_areas * n_tol, -1)
+    n_points = n_points.ravel()
+    has_points = n_points > 0
+
+    # recalculate the mineral formula from the area averages, for every tolerance at once
+    means = means[has_points]
+    elements, ratios, _, _ = calc_composition({name: means[:, i] for i, name in enumerate(names)}, mintype=mintype)
+    row_area = np.repeat(np.arange(n_areas), n_tol)[has_points]
+    row_tol = np.tile(np.arange(n_tol), n_areas)[has_points]
+    area_sweep = pd.DataFrame({'Sample': area_index.get_level_values(0)[row_area],
+                               'Area': area_index.get_level_values(1)[row_area],
+                               'Tolerance': tolerances[row_tol],
+                               'Number of datapoints averaged': n_points[has_points]})
+    for i, name in enumerate(names):
+        area_sweep[OXIDE_NAMES.get(name, name)] = means[:, i]
+    # the olivine ratios include the fayalite fraction as 'Fe', which would clash with FeO
+    ratios = {('Fa' if key == 'Fe' else key): value for key, value in ratios.items()}
+    area_sweep = area_sweep.assign(**ratios)
+
+    # sample averages and 2SDs over the areas, for every tolerance
+    if keys is None:
+        keys = list(ratios.keys())
+    missing = [key for key in keys if key not in area_sweep.columns]
+    if missing:
+        raise ValueError(f'{missing} not found in the {mintype} area averages')
+    area_samples, sample_index = pd.factorize(area_index.get_level_values(0))
+    n_samples = len(sample_index)
+    codes = area_samples[row_area] * n_tol + row_tol
+    values = area_sweep[keys].to_numpy(dtype=float)
+    _, n_values, sample_means = _group_means(codes, values, n_samples * n_tol)
+    # two passes, rather than the sum of squares, to avoid losing precision for small spreads
+    squares, _, _ = _group_means(codes, np.square(values - sample_means[codes]), n_samples * n_tol)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sd = 2 * np.sqrt(squares / (n_values - 1))
+    sample_points = np.bincount(codes, weights=area_sweep['Number of datapoints averaged'].to_numpy(),
+                                minlength=n_samples * n_tol)
+    sample_total = np.bincount(area_samples, weights=total_points, minlength=n_samples)
+
+    n_keys = len(keys)
+    row_sample = np.repeat(np.arange(n_samples), n_tol)
+    has_areas = np.bincount(codes, minlength=n_samples * n_tol) > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        kept = 100 * sample_points / np.repeat(sample_total, n_tol)
+    sample_sweep = pd.DataFrame({'Sample': np.repeat(np.asarray(sample_index)[row_sample], n_keys),
+                                 'Tolerance': np.repeat(np.tile(tolerances, n_samples), n_keys),
+                                 'Variable': np.tile(keys, n_samples * n_tol),
+                                 'Mean': sample_means.ravel(),
+                                 '2SD': sd.ravel(),
+                                 'Number of areas': n_values.ravel().astype(int),
+                                 'Number of datapoints': np.repeat(sample_points, n_keys).astype(int),
+                                 'Datapoints kept (%)': np.repeat(kept, n_keys)})
+    sample_sweep = sample_sweep[np.repeat(has_areas, n_keys)].reset_index(drop=True)
+    return area_sweep, sample_sweep
+
+
+def plot_tolerance_sweep(sample_sweep, mintype='olivine', keys=None, error=None, fname=None, output_path='./plots',
+                         rasterize=False, dpi=300):
+    """
+    Plot how the sample averages (with their 2SD as a shaded band) and the percentage of datapoints kept
+    change with the cation sum tolerance.
+
+    Args:
+        sample_sweep: Sample averages from tolerance_sweep.
+        mintype: Mineral type, used for the title and filename.
+        keys: Variables to plot. Default None, i.e. all of the variables in sample_sweep.
+        error: Tolerance actually used for the analysis. If given, it is marked with a dashed line.
+        fname: Name of the file to save the figure to. Default '<mintype>_qc_sweep.png'.
+        output_path: Where to save the plot, default is a new folder called 'plots' within the current folder.
+        rasterize: If True, draw the lines and bands as an image at the given dpi (see
+                   plotting_functions.save_figure).
+        dpi: Resolution of the rasterized layers if rasterize is True.
+
+    Returns:
+        None
+    """
+    if keys is None:
+        keys = list(pd.unique(sample_sweep['Variable']))
+    if fname is None:
+        fname = f'{mintype}_qc_sweep.png'
+    samples = pd.unique(sample_sweep['Sample'])
+
+    fig, axes = plt.subplots(len(keys) + 1, 1, sharex=True, squeeze=False, figsize=(8, 3 * (len(keys) + 1)))
+    axes = axes[:, 0]
+    for ax, key in zip(axes, keys):
+        sweep = sample_sweep[sample_sweep['Variable'] == key]
+        for sample in samples:
+            stats = sweep[sweep['Sample'] == sample]
+            line, = ax.plot(stats['Tolerance'], stats['Mean'], marker='o', label=sample)
+            ax.fill_between(stats['Tolerance'], stats['Mean'] - stats['2SD'], stats['Mean'] + stats['2SD'],
+                            color=line.get_color(), alpha=0.15)
+        ax.set_ylabel(key)
+    kept = sample_sweep.drop_duplicates(['Sample', 'Tolerance'])
+    for sample in samples:
+        stats = kept[kept['Sample'] == sample]
+        axes[-1].plot(stats['Tolerance'], stats['Datapoints kept (%)'], marker='o', label=sample)
+    axes[-1].set_ylabel('Datapoints kept (%)')
+    axes[-1].set_xlabel('Cation sum tolerance')
+    for ax in axes:
+        if error is not None:
+            ax.axvline(error, color='k', linestyle='--', linewidth=1)
+        ax.grid()
+    # a legend for every sample is only readable for a handful of them
+    if 0 < len(samples) <= 10:
+        axes[0].legend(fontsize='small')
+    axes[0].set_title(f'{mintype.capitalize()} - sensitivity to the cation sum tolerance')
+
+    # Create output path if it does not already exist
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    save_figure(output_path + '/' + fname, rasterize=rasterize, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
@@ -1,29 +1,73 @@
-def cation_quality_check(data, elements, ratios, cat_props, error=0.01, mintype='olivine'):
+import numpy as np
+
+
+def get_cation_count(mintype):
     """
-    Perform a quality check on the data to remove elements that we don't wish to keep,
-    based on a user-specified error threshold applied to the cation total.
+    Get the target cation sum for the given mineral type - 3 for olivine and spinel, 4 for pyroxene.
+
+    Args:
+        mintype: Mineral type being analysed.
+
+    Returns:
+        cation_count: The expected cation sum.
+    """
+    if 'spinel' in mintype.lower() or 'olivine' in mintype.lower():
+        return 3
+    elif 'pyroxene' in mintype.lower():
+        return 4
+    else:
+        raise ValueError('Mintype must be "olivine", "spinel" or contain "pyroxene"')
+
+
+def get_default_error(mintype):
+    """
+    Get the default error threshold on the cation sum for the given mineral type -
+    0.002 for spinel, 0.01 otherwise.
+    """
+    if 'spinel' in mintype.lower():
+        return 0.002
+    return 0.01
+
+
+def cation_quality_mask(cat_props, error=None, mintype='olivine'):
+    """
+    Get a boolean mask of the datapoints that pass the cation quality check, i.e. have a cation sum
+    within the target value (3 or 4, see get_cation_count) +- error.
 
     Args:
-        data: DataFrame that you wish to perform the quality checking on.
-        elements: DataFrame containing the elements that were obtained from
-                  get_composition.check_mineral_composition.
-        ratios:
         cat_props: DataFrame of cation properties used to perform the quality check.
-        error: Default error threshold for the quality check. The user is
-               prompted whether to accept this default threshold, or change it.
-               Roughly 3 +- error for olivine, 4 +- error for pyroxene.
-        mintype: Mineral type being analysed. Default 'olivine'. If mintype has
-                 the substring 'pyroxene' within it, the target cation count is
-                 set to  4, else it is 3 if it has the substring 'olivine'.
-                 e.g. 'clinopyroxene' contains the substring 'pyroxene', so it
-                 will be set to 4.
+        error: Error threshold on the cation sum. Default None, in which case the default for the
+               mineral type is used (see get_default_error).
+        mintype: Mineral type being analysed. Default 'olivine'.
 
     Returns:
-        data: as input argument data, but with errors removed.
-        elements: as input argument elements, but with errors removed.
-        ratios: as input argument ratios, but with errors removed.
-        cat_props: as input argument cat_props, but with errors removed.
+        mask: Boolean Series, True where the datapoint passes the quality check.
+    """
+    if error is None:
+        error = get_default_error(mintype)
+    cation_count = get_cation_count(mintype)
+    return (cation_count - error < cat_props['sum']) & (cat_props['sum'] < cation_count + error)
+
+
+def choose_cation_error(cat_props, error=None, mintype='olivine', interactive=True, mask=None):
+    """
+    Report how many datapoints fail the cation quality check, and (if interactive) let the user
+    accept or change the error threshold until they are happy with the number of rejected datapoints.
 
+    Args:
+        cat_props: DataFrame of cation properties used to perform the quality check.
+        error: Starting error threshold. Default None, in which case the default for the mineral
+               type is used (see get_default_error).
+        mintype: Mineral type being analysed. Default 'olivine'.
+        interactive: If True (default), the user is prompted to accept or change the error
+                     threshold. If False, the threshold given by error is accepted.
+        mask: Optional boolean array of the datapoints that pass with the starting error threshold, if it
+              has already been calculated (e.g. by parallel_composition.parallel_composition_table). It is
+              recalculated if the threshold is changed.
+
+    Returns:
+        error: The accepted error threshold.
+        mask: Boolean Series, True where the datapoint passes the quality check with this threshold.
     """
 
     flag = True
@@ -35,36 +79,26 @@ def cation_quality_check(data, elements, ratios, cat_props, error=0.01, mintype=
     nos = ['n', 'no', 'change']
     # Keep allowing for changes to the error until the user is satisfied with
     # the number of rejected samples
-    if 'spinel' in mintype.lower(): # set starting error specifically for spinel as 0.002
-        error = 0.002
+    if error is None:  # set starting error specifically for spinel as 0.002
+        error = get_default_error(mintype)
+    cation_count = get_cation_count(mintype)
 
     while flag:
 
-        if 'spinel' in mintype.lower():
-            init_num_samples = len(cat_props['sum'])
-            cation_count = 3
-            print(f'\nCurrently accepting values within 3 ± {error}\n')
-            new_cat_props = cat_props[(cation_count - error < cat_props['sum']) &
-                                      (cat_props['sum'] < cation_count + error)]
-            ratio = 100 * (init_num_samples - len(new_cat_props['sum'])) / init_num_samples
+        init_num_samples = len(cat_props['sum'])
+        print(f'\nCurrently accepting values within {cation_count} ± {error}\n')
+        if mask is None:
+            mask = cation_quality_mask(cat_props, error=error, mintype=mintype)
+        num_removed = init_num_samples - int(mask.sum())
+        ratio = 100 * num_removed / init_num_samples
 
-        else:
-            init_num_samples = len(cat_props['sum'])
-
-            if 'olivine' in mintype.lower():
-                cation_count = 3
-                print(f'\nCurrently accepting values within 3 ± {error}\n')
-
-            elif 'pyroxene' in mintype.lower():
-                cation_count = 4
-                print(f'\nCurrently accepting values within 4 ± {error}\n')
-
-            new_cat_props = cat_props[(cation_count - error < cat_props['sum']) & (cat_props['sum'] < cation_count + error)]
-            ratio = 100 * (init_num_samples - len(new_cat_props['sum'])) / init_num_samples
-
-        print(f"Removed {init_num_samples - len(new_cat_props['sum'])} of " \
+        print(f"Removed {num_removed} of " \
               f"{init_num_samples} total samples ({ratio:.3f}%) based on current error limit")
 
+        # if not running interactively, then accept the error we were given
+        if not interactive:
+            break
+
         prompt = input('Accept this number of discarded values, or change the error limits?\n')
 
         # if not happy - make sure the user inputs a numeric value else the code
@@ -80,6 +114,7 @@ def cation_quality_check(data, elements, ratios, cat_props, error=0.01, mintype=
                     print('Please enter a numeric value for the error\n')
                 else:
                     errorflag = False
+                    mask = None
 
         # else if we are happy then move on
         elif prompt.lower().rstrip() in yesses:
@@ -87,13 +122,79 @@ def cation_quality_check(data, elements, ratios, cat_props, error=0.01, mintype=
         # else if the user put a numeric value in then use this as the error
         elif prompt.replace('.', '').rstrip().isnumeric():  # replace . as this is a non numeric type
             error = float(prompt)
+            mask = None
         # otherwise prompt the user to select a valid response
         else:
             print('Please enter yes, no or a new limit\n')
 
+    return error, mask
+
+
+def flag_cation_quality(points, error=None, mintype='olivine', interactive=True, mask=None):
+    """
+    Perform the cation quality check on a per-point table (see get_composition.composition_table),
+    adding the result as columns of the table (in place) rather than removing the datapoints
+    that fail: ('qc', 'Cation sum OK') for this check, and ('qc', 'Passed') for whether each datapoint
+    has passed every check so far.
+
+    Args:
+        points: Per-point table from get_composition.composition_table.
+        error: Error threshold for the quality check - see cation_quality_check.
+        mintype: Mineral type being analysed. Default 'olivine'.
+        interactive: If True (default), the user is prompted to accept or change the error threshold.
+        mask: Optional boolean array of the datapoints that pass with the starting error threshold, if already
+              calculated - see choose_cation_error.
+
+    Returns:
+        error: The accepted error threshold.
+    """
+    error, mask = choose_cation_error(points['cat_props'], error=error, mintype=mintype, interactive=interactive,
+                                      mask=mask)
+    mask = np.asarray(mask)
+    points[('qc', 'Cation sum OK')] = mask
+    if ('qc', 'Passed') in points.columns:
+        points[('qc', 'Passed')] = points[('qc', 'Passed')].to_numpy() & mask
+    else:
+        points[('qc', 'Passed')] = mask
+    return error
+
+
+def cation_quality_check(data, elements, ratios, cat_props, error=None, mintype='olivine', interactive=True):
+    """
+    Perform a quality check on the data to remove elements that we don't wish to keep,
+    based on a user-specified error threshold applied to the cation total.
+
+    Args:
+        data: DataFrame that you wish to perform the quality checking on.
+        elements: DataFrame containing the elements that were obtained from
+                  get_composition.check_mineral_composition.
+        ratios:
+        cat_props: DataFrame of cation properties used to perform the quality check.
+        error: Default error threshold for the quality check. The user is
+               prompted whether to accept this default threshold, or change it.
+               Roughly 3 +- error for olivine, 4 +- error for pyroxene.
+               Default None, in which case 0.002 is used for spinel and 0.01 otherwise.
+        mintype: Mineral type being analysed. Default 'olivine'. If mintype has
+                 the substring 'pyroxene' within it, the target cation count is
+                 set to  4, else it is 3 if it has the substring 'olivine'.
+                 e.g. 'clinopyroxene' contains the substring 'pyroxene', so it
+                 will be set to 4.
+        interactive: If True (default), the user is prompted to accept or change the error
+                     threshold. If False, the threshold given by error is applied directly
+                     (e.g. when running automatically over many files).
+
+    Returns:
+        data: as input argument data, but with errors removed.
+        elements: as input argument elements, but with errors removed.
+        ratios: as input argument ratios, but with errors removed.
+        cat_props: as input argument cat_props, but with errors removed.
+
+    """
+    _, mask = choose_cation_error(cat_props, error=error, mintype=mintype, interactive=interactive)
+
     # work out where the samples were removed and drop these from the DataFrame
     # i.e. discard them
-    removed_indices = cat_props.index.difference(new_cat_props.index)
+    removed_indices = cat_props.index[~mask.to_numpy()]
     cat_props = cat_props.drop(removed_indices)
     elements = elements.drop(removed_indices)
     ratios = ratios.drop(removed_indices)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+One multipage PDF report per sample, with everything about that sample in one place rather than spread over the
+plots folder:
+    page 1 - histograms of the olivine Fo, Opx and Cpx Mg# and spinel CrN of its quality-checked datapoints,
+    page 2 - scatter plots of the datapoints of each mineral (REPORT_SCATTERS), coloured by area,
+    page 3 - the rectangle plot of its area averages (Fo against Mg#), over the rectangles of every other sample.
+
+The per-point and area average tables of each mineral are grouped by sample once, and each report is sent only the
+rows of its own sample. Everything shared between the reports (the histogram bins and axis limits, so the pages of
+different samples can be compared, and the rectangles of every sample) is worked out once and given to each worker
+process when it starts. Each worker draws every report on the same three figures, clearing and re-using their axes
+for each sample, so no figures are created or kept per sample.
+
+Reports are drawn by n_workers processes at once. Only as many samples as fit in max_memory_mb (of the data sent to
+the workers) are queued at a time, so memory use stays bounded however many samples there are.
+"""
+
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+
+from inout import get_sheet_prefix, group_point_table
+from parallel_composition import get_worker_context
+from plotting_functions import rasterize_data_layers
+
+# column of the per-point data to histogram, and the columns to plot against each other, for each mineral
+REPORT_HISTOGRAMS = {'olivine': 'Fo', 'orthopyroxene': 'Mg#', 'clinopyroxene': 'Mg#', 'spinel': 'CrN'}
+REPORT_SCATTERS = {'olivine': ('Fo', 'NiO'), 'orthopyroxene': ('Mg#', 'Al2O3'),
+                   'clinopyroxene': ('Mg#', 'Al2O3'), 'spinel': ('MgN', 'CrN')}
+PAGE_SIZE = (11.69, 8.27)  # A4 landscape, in inches
+# shared settings and figures of each worker process
+_report_context = {}
+_report_figures = {}
+
+
+def get_report_filename(sample):
+    """
+    Filename of the report of a sample, with any characters that can't be in a filename replaced.
+    """
+    return re.sub(r'[^\w\-. ]', '_', str(sample)) + '_report.pdf'
+
+
+def _payload_bytes(payload):
+    """
+    Memory used by the DataFrames sent to a worker for one report.
+    """
+    return sum(int(frame.memory_usage(deep=True).sum()) for group in payload.values() for frame in group.values())
+
+
+def prepare_report_data(minerals, bins=20, recplot_x='olivine', recplot_y='clinopyroxene'):
+    """
+    Select the columns used in the reports from the results of each mineral, group them by sample and work out the
+    settings shared by every report.
+
+    Args:
+        minerals: Dictionary of {mineral type: results from pipeline.analyse_mineral}, e.g. PipelineResult.minerals.
+        bins: Number of histogram bins, over the range of every sample.
+        recplot_x: Mineral type for the x-axis (Fo) of the rectangle plot.
+        recplot_y: Mineral type for the y-axis (Mg#) of the rectangle plot.
+
+    Returns:
+        tables: Dictionary of {'points'/'areas': {mineral type: DataFrame}} of the selected columns.
+        groups: Dictionary of {sample: {'points'/'areas': {mineral type: array of the rows of that sample}}}.
+        context: Dictionary of the settings shared by every report.
+    """
+    tables = {'points': {}, 'areas': {}}
+    context = {'bins': {}, 'limits': {}, 'rectangle': None, 'recplot': (recplot_x, recplot_y)}
+    for mintype, results in minerals.items():
+        columns = ['Sample', 'Area'] + list(dict.fromkeys([REPORT_HISTOGRAMS[mintype], *REPORT_SCATTERS[mintype]]))
+        points = group_point_table(results['points'])
+        tables['points'][mintype] = points[[col for col in columns if col in points.columns]].reset_index(drop=True)
+        key = REPORT_HISTOGRAMS[mintype]
+        if key in points.columns and len(points):
+            context['bins'][mintype] = np.histogram_bin_edges(points[key].to_numpy(dtype=float), bins=bins)
+        # the range of every sample, with a margin so that points at the edges aren't cut off
+        context['limits'][mintype] = {}
+        for col in REPORT_SCATTERS[mintype]:
+            if col in points.columns and len(points):
+                low, high = points[col].min(), points[col].max()
+                margin = 0.05 * (high - low) or 0.5
+                context['limits'][mintype][col] = (low - margin, high + margin)
+    # the Fo and Mg# of every area average of the rectangle plot minerals, and the rectangle of each sample
+    for mintype, key in zip(context['recplot'], ['Fo', 'Mg#']):
+        if mintype in minerals:
+            areas = minerals[mintype]['output_data']
+            tables['areas'][mintype] = pd.DataFrame({'Sample': areas['Project Path (2)'].to_numpy(),
+                                                     'Area': areas['Project Path (3)'].to_numpy(),
+                                                     key: areas[key].to_numpy(dtype=float)})
+    if all(mintype in tables['areas'] for mintype in context['recplot']):
+        x_areas, y_areas = (tables['areas'][mintype] for mintype in context['recplot'])
+        context['rectangle'] = x_areas.groupby('Sample')['Fo'].agg(['min', 'max']).join(
+            y_areas.groupby('Sample')['Mg#'].agg(['min', 'max']), lsuffix='_x', rsuffix='_y', how='inner')
+
+    # the rows of each sample, from a single grouping of each table
+    groups = {}
+    for level, level_tables in tables.items():
+        for mintype, table in level_tables.items():
+            for sample, rows in table.groupby('Sample', sort=False).indices.items():
+                groups.setdefault(sample, {'points': {}, 'areas': {}})[level][mintype] = rows
+    return tables, groups, context
+
+
+def _init_report_worker(context):
+    """
+    Keep the shared report settings in a worker process, and set up the figures it draws every report on.
+    """
+    _report_context.clear()
+    _report_context.update(context)
+    # plain Figures, not pyplot, so nothing is kept in pyplot's list of open figures
+    for page, layout in [('histograms', (2, 2)), ('scatters', (2, 2)), ('rectangle', (1, 1))]:
+        fig = Figure(figsize=PAGE_SIZE)
+        axes = fig.subplots(*layout, squeeze=False).flatten()
+        _report_figures[page] = (fig, axes)
+
+
+def _no_data(ax, title):
+    ax.set_title(title)
+    ax.text(0.5, 0.5, 'No data', ha='center', va='center', transform=ax.transAxes)
+
+
+def _draw_histograms(points, axes):
+    for ax, mintype in zip(axes, REPORT_HISTOGRAMS):
+        key = REPORT_HISTOGRAMS[mintype]
+        title = f'{get_sheet_prefix(mintype)} {key}'
+        data = points.get(mintype)
+        if data is None or not len(data) or mintype not in _report_context['bins']:
+            _no_data(ax, title)
+            continue
+        values = data[key].to_numpy(dtype=float)
+        ax.hist(values, bins=_report_context['bins'][mintype], color='tab:blue', edgecolor='k')
+        ax.axvline(np.mean(values), color='k', linestyle='--', label=f'Mean {np.mean(values):.4g}')
+        ax.set_title(f'{title} ({len(values)} datapoints)')
+        ax.set_xlabel(key)
+        ax.set_ylabel('Number of datapoints')
+        ax.legend(fontsize='small')
+
+
+def _draw_scatters(points, axes):
+    for ax, mintype in zip(axes, REPORT_SCATTERS):
+        x, y = REPORT_SCATTERS[mintype]
+        title = f'{get_sheet_prefix(mintype)} {x} vs {y}'
+        data = points.get(mintype)
+        if data is None or not len(data) or not all(col in data.columns for col in (x, y)):
+            _no_data(ax, title)
+            continue
+        areas = data['Area'].astype(str).to_numpy()
+        names, codes = np.unique(areas, return_inverse=True)
+        colours = ax.scatter(data[x].to_numpy(dtype=float), data[y].to_numpy(dtype=float), c=codes % 10,
+                             cmap='tab10', vmin=0, vmax=9, marker='x', s=20)
+        if len(names) <= 10:
+            ax.legend(colours.legend_elements()[0], names, title='Area', fontsize='small')
+        # the same axis limits for every sample
+        limits = _report_context['limits'][mintype]
+        ax.set_xlim(*limits[x])
+        ax.set_ylim(*limits[y])
+        ax.set_title(title)
+        ax.set_xlabel(x)
+        ax.set_ylabel(y)
+        ax.grid()
+
+
+def _draw_rectangle(sample, areas, ax):
+    recplot_x, recplot_y = _report_context['recplot']
+    title = f'{get_sheet_prefix(recplot_x)} Fo vs {get_sheet_prefix(recplot_y)} Mg#'
+    rectangles = _report_context['rectangle']
+    if rectangles is None or sample not in rectangles.index:
+        _no_data(ax, title)
+        return
+    for name, row in rectangles.iterrows():
+        ax.add_patch(Rectangle((row['min_x'], row['min_y']), row['max_x'] - row['min_x'], row['max_y'] - row['min_y'],
+                               fill=name == sample, alpha=0.4 if name == sample else 1,
+                               color='tab:red' if name == sample else '0.75', linewidth=2 if name == sample else 1,
+                               label=name if name == sample else None, zorder=3 if name == sample else 2))
+    # the area averages of this sample, on each axis
+    x_areas, y_areas = areas[recplot_x], areas[recplot_y]
+    ax.plot(x_areas['Fo'], np.full(len(x_areas), rectangles.loc[sample, 'min_y']), '|', color='k',
+            markersize=12, label=f'{get_sheet_prefix(recplot_x)} areas')
+    ax.plot(np.full(len(y_areas), rectangles.loc[sample, 'min_x']), y_areas['Mg#'], '_', color='k',
+            markersize=12, label=f'{get_sheet_prefix(recplot_y)} areas')
+    # the patches aren't included in the automatic axis limits until they are drawn
+    ax.autoscale_view()
+    ax.set_title(f'{title} (other samples in grey)')
+    ax.set_xlabel(f'{get_sheet_prefix(recplot_x)} Fo')
+    ax.set_ylabel(f'{get_sheet_prefix(recplot_y)} Mg#')
+    ax.legend(fontsize='small')
+    ax.grid()
+
+
+def render_sample_report(sample, payload, output_path, rasterize=False, dpi=300):
+    """
+    Draw the report of one sample and save it as a multipage PDF. Must be run in a process set up by
+    _init_report_worker.
+
+    Args:
+        sample: Name of the sample.
+        payload: Dictionary of {'points'/'areas': {mineral type: DataFrame of the rows of this sample}}.
+        output_path: Folder to save the report to.
+        rasterize: If True, draw the datapoints as an image at the given dpi, which keeps the PDFs of samples with
+                   many datapoints small.
+        dpi: Resolution of the rasterized layers.
+
+    Returns:
+        fname: Filename of the report.
+    """
+    fname = os.path.join(output_path, get_report_filename(sample))
+    pages = [('histograms', lambda axes: _draw_histograms(payload['points'], axes)),
+             ('scatters', lambda axes: _draw_scatters(payload['points'], axes)),
+             ('rectangle', lambda axes: _draw_rectangle(sample, payload['areas'], axes[0]))]
+    with PdfPages(fname) as pdf:
+        for page, draw in pages:
+            fig, axes = _report_figures[page]
+            for ax in axes:
+                ax.clear()
+            draw(axes)
+            fig.suptitle(f'Sample {sample}')
+            fig.tight_layout()
+            if rasterize:
+                rasterize_data_layers(fig)
+            pdf.savefig(fig, dpi=dpi)
+    return fname
+
+
+def make_sample_reports(minerals, output_path='./reports', samples=None, n_workers=None, max_memory_mb=500,
+                        recplot_x='olivine', recplot_y='clinopyroxene', rasterize=False, dpi=300, start_method=None):
+    """
+    Make a multipage PDF report for every sample (see the top of this file).
+
+    Args:
+        minerals: Dictionary of {mineral type: results from pipeline.analyse_mineral}, e.g. PipelineResult.minerals.
+        output_path: Folder to save the reports to.
+        samples: List of the samples to make reports for. Default None, i.e. every sample.
+        n_workers: Number of processes to draw the reports with. Default None, i.e. the number of CPUs. 1 to draw
+                   them in this process.
+        max_memory_mb: Largest amount of sample data (MB) to queue for the workers at once.
+        recplot_x: Mineral type for the x-axis (Fo) of the rectangle plot.
+        recplot_y: Mineral type for the y-axis (Mg#) of the rectangle plot.
+        rasterize: If True, draw the datapoints as an image in the PDFs.
+        dpi: Resolution of the rasterized layers.
+        start_method: How to start the worker processes - see parallel_composition.get_worker_context.
+
+    Returns:
+        fnames: List of the filenames of the reports.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    os.makedirs(output_path, exist_ok=True)
+    tables, groups, context = prepare_report_data(minerals, recplot_x=recplot_x, recplot_y=recplot_y)
+    if samples is not None:
+        groups = {sample: groups[sample] for sample in samples if sample in groups}
+
+    def payloads():
+        # the rows of one sample at a time, only when it is about to be queued
+        for sample, rows in groups.items():
+            yield sample, {level: {mintype: tables[level][mintype].iloc[idx] for mintype, idx in level_rows.items()}
+                           for level, level_rows in rows.items()}
+
+    fnames = []
+    if n_workers == 1:
+        _init_report_worker(context)
+        for sample, payload in payloads():
+            fnames.append(render_sample_report(sample, payload, output_path, rasterize=rasterize, dpi=dpi))
+    else:
+        budget = max_memory_mb * 1024 ** 2
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=get_worker_context(start_method),
+                                 initializer=_init_report_worker,
+                                 initargs=(context,)) as executor:
+            queued = {}
+            for sample, payload in payloads():
+                size = _payload_bytes(payload)
+                # wait for reports to finish until this one fits in the memory budget (one is always allowed)
+                while queued and (sum(queued.values()) + size > budget or len(queued) >= 2 * n_workers):
+                    done, _ = wait(queued, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del queued[future]
+                        fnames.append(future.result())
+                queued[executor.submit(render_sample_report, sample, payload, output_path, rasterize=rasterize,
+                                       dpi=dpi)] = size
+            for future in queued:
+                fnames.append(future.result())
+    print(f'{len(fnames)} sample reports saved to {output_path}')
+    return fnames
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Two-pyroxene and olivine-spinel thermometry from the sample averages.
+
+Minerals are paired by sample, and the thermometers are evaluated for all samples at once as array
+expressions. The uncertainty is propagated by Monte Carlo: the sample-average oxides are perturbed
+using their 2SD (from average_over_samples), all the perturbed compositions for all samples are run through
+calc_composition in a single call, and the spread of the resulting temperatures is reported.
+
+Thermometers:
+    Two-pyroxene: Wells (1977), Contrib. Mineral. Petrol. 62, 129-139, with the enstatite activities
+                  calculated from an ideal two-site (M1, M2) model, assuming Fe and Mg are distributed
+                  equally between the sites.
+    Olivine-spinel: Ballhaus, Berry & Green (1991), Contrib. Mineral. Petrol. 107, 27-40. Depends
+                    (weakly) on pressure, given in GPa.
+"""
+
+import numpy as np
+import pandas as pd
+
+from averaging import split_sample_average
+from get_composition import calc_composition
+from inout import OXIDE_NAMES
+
+R = 8.314  # gas constant, J / mol / K
+ELEMENTS = ['Si', 'Ti', 'Al', 'Cr', 'Mn', 'Mg', 'Ni', 'Fe', 'Ca', 'Na', 'K']
+
+
+def get_sample_oxides(sample_average_data):
+    """
+    Get the average oxide concentrations and their 2SD for each sample.
+
+    Args:
+        sample_average_data: DataFrame of sample averages of the oxides from average_over_samples (with the
+                             averages as '<mean> ± <2SD>' strings), indexed by sample. The columns can be
+                             named either as in the input data (e.g. 'Si') or the output data (e.g. 'SiO2').
+
+    Returns:
+        mean: DataFrame of the average oxide concentrations, with the input data column names.
+        sd: DataFrame of the corresponding 2SDs. Where these are not available (e.g. a sample with a single
+            area) they are set to zero.
+    """
+    data = sample_average_data.rename(columns={val: key for key, val in OXIDE_NAMES.items()})
+    mean = {}
+    sd = {}
+    for element in ELEMENTS:
+        if element in data.columns:
+            mean[element], sd[element] = split_sample_average(data[element])
+    return pd.DataFrame(mean), pd.DataFrame(sd).fillna(0)
+
+
+def draw_compositions(mean, sd, n_draws=500, seed=None):
+    """
+    Generate random compositions for each sample, normally distributed about the average with a standard
+    deviation of half the 2SD. The first "draw" is the average itself.
+
+    Args:
+        mean: DataFrame of the average oxide concentrations for each sample (see get_sample_oxides).
+        sd: DataFrame of the corresponding 2SDs.
+        n_draws: Number of random compositions to generate for each sample.
+        seed: Seed for the random number generator, for reproducible results.
+
+    Returns:
+        draws: Dictionary of {element name: 1D array} of (n_draws + 1) * (number of samples) compositions, ordered
+               by draw and then by sample, which can be passed straight into calc_composition.
+    """
+    rng = np.random.default_rng(seed)
+    values = mean.to_numpy(dtype=float)
+    noise = rng.standard_normal((n_draws, *values.shape)) * sd.to_numpy(dtype=float) / 2
+    draws = np.concatenate([values[np.newaxis], values + noise])
+    # concentrations can't be negative
+    draws = np.clip(draws, 0, None).reshape(-1, values.shape[1])
+    return {name: draws[:, idx] for idx, name in enumerate(mean.columns)}
+
+
+def _empty_temperatures(name):
+    """
+    Temperature table with no samples, e.g. if no datapoints of one of the minerals passed the quality check.
+    """
+    return pd.DataFrame({col: pd.Series(dtype=float) for col in ['T (C)', '2SD_T (C)', name, f'2SD_{name}']},
+                        index=pd.Index([], name='Sample'))
+
+
+def _summarise(values, n_samples, index, name):
+    """
+    Reshape a flat array of (n_draws + 1) * n_samples values into (draws, samples), and return the
+    value for the average composition and the 2SD over the random draws for each sample.
+    """
+    values = np.asarray(values, dtype=float).reshape(-1, n_samples)
+    return pd.DataFrame({name: values[0], f'2SD_{name}': 2 * np.nanstd(values[1:], axis=0, ddof=1)},
+                        index=index)
+
+
+def two_pyroxene_temperature(opx, cpx):
+    """
+    Two-pyroxene temperature from Wells (1977):
+        T (K) = 7341 / (3.355 + 2.44 X_Fe(opx) - ln K),  K = a_En(cpx) / a_En(opx)
+    with a_En = X_Mg(M1) * X_Mg(M2).
+
+    Args:
+        opx: Orthopyroxene cations per formula unit (the elements output of calc_composition or
+             check_mineral_composition, including Al_IV).
+        cpx: The same for clinopyroxene, with the same number of rows (the pairs to evaluate).
+
+    Returns:
+        temperature: Array of temperatures in degrees C.
+        lnK: Array of ln K.
+    """
+    def enstatite_activity(px):
+        mg_number = px['Mg'] / (px['Mg'] + px['Fe'])
+        al_vi = np.clip(px['Al'] - px['Al_IV'], 0, None)
+        m2_other = px['Ca'] + px['Na'] + px.get('Mn', 0)
+        m1_other = al_vi + px['Ti'] + px['Cr']
+        x_mg_m1 = np.clip(1 - m1_other, 1e-6, 1) * mg_number
+        x_mg_m2 = np.clip(1 - m2_other, 1e-6, 1) * mg_number
+        return np.asarray(x_mg_m1 * x_mg_m2, dtype=float)
+
+    lnK = np.log(enstatite_activity(cpx) / enstatite_activity(opx))
+    x_fe_opx = np.asarray(opx['Fe'] / (opx['Fe'] + opx['Mg']), dtype=float)
+    temperature = 7341 / (3.355 + 2.44 * x_fe_opx - lnK) - 273.15
+    return temperature, lnK
+
+
+def olivine_spinel_temperature(olivine, spinel, spinel_cat_props, pressure=1.):
+    """
+    Olivine-spinel temperature from Ballhaus, Berry & Green (1991):
+        T (K) = [6530 + 280 P + (7000 + 108 P)(1 - 2 X_Fe(ol)) - 1960 (X_Mg(sp) - X_Fe2(sp))
+                 + 16150 X_Cr(sp) + 25150 (X_Fe3(sp) + X_Ti(sp))] / (R ln K_D + 4.705)
+        K_D = X_Mg(ol) X_Fe2(sp) / (X_Fe(ol) X_Mg(sp))
+
+    Args:
+        olivine: Olivine cations per formula unit (elements output of calc_composition or
+                 check_mineral_composition).
+        spinel: The same for spinel, with the same number of rows (the pairs to evaluate).
+        spinel_cat_props: cat_props output of calc_composition for the spinel, containing the ferrous (Fe2) and
+                          ferric (Fe3) iron.
+        pressure: Pressure in GPa. Default 1.
+
+    Returns:
+        temperature: Array of temperatures in degrees C.
+        lnKd: Array of ln K_D.
+    """
+    x_fe_ol = np.asarray(olivine['Fe'] / (olivine['Fe'] + olivine['Mg']), dtype=float)
+    fe2 = np.asarray(spinel_cat_props['Fe2'], dtype=float)
+    fe3 = np.clip(np.asarray(spinel_cat_props['Fe3'], dtype=float), 0, None)
+    mg = np.asarray(spinel['Mg'], dtype=float)
+    trivalent = np.asarray(spinel['Cr'] + spinel['Al'], dtype=float) + fe3
+    x_mg_sp = mg / (mg + fe2)
+    x_fe2_sp = 1 - x_mg_sp
+    x_cr_sp = np.asarray(spinel['Cr'], dtype=float) / trivalent
+    x_fe3_sp = fe3 / trivalent
+    x_ti_sp = np.asarray(spinel['Ti'], dtype=float) / trivalent
+
+    lnKd = np.log(((1 - x_fe_ol) * x_fe2_sp) / (x_fe_ol * x_mg_sp))
+    numerator = (6530 + 280 * pressure + (7000 + 108 * pressure) * (1 - 2 * x_fe_ol)
+                 - 1960 * (x_mg_sp - x_fe2_sp) + 16150 * x_cr_sp + 25150 * (x_fe3_sp + x_ti_sp))
+    temperature = numerator / (R * lnKd + 4.705) - 273.15
+    return temperature, lnKd
+
+
+def pair_samples(sample_average_x, sample_average_y):
+    """
+    Find the samples that are present in both sets of sample averages.
+
+    Returns:
+        samples: Index of the samples in common, in the order of sample_average_x.
+    """
+    return sample_average_x.index[sample_average_x.index.isin(sample_average_y.index)]
+
+
+def calc_two_pyroxene_temperatures(opx_average_data, cpx_average_data, n_draws=500, seed=None):
+    """
+    Calculate two-pyroxene temperatures for every sample with both Opx and Cpx data.
+
+    Args:
+        opx_average_data: DataFrame of Opx sample averages of the oxides, from average_over_samples.
+        cpx_average_data: The same for Cpx.
+        n_draws: Number of random compositions per sample used to propagate the uncertainty.
+        seed: Seed for the random number generator.
+
+    Returns:
+        temperatures: DataFrame indexed by sample, with the temperature (T (C)) and ln K for the average
+                      compositions, and their 2SD from the random draws.
+    """
+    samples = pair_samples(opx_average_data, cpx_average_data)
+    if len(samples) == 0:
+        return _empty_temperatures('lnK')
+    elements = {}
+    for mintype, average_data in [('orthopyroxene', opx_average_data), ('clinopyroxene', cpx_average_data)]:
+        mean, sd = get_sample_oxides(average_data.loc[samples])
+        elements[mintype], _, _, _ = calc_composition(draw_compositions(mean, sd, n_draws=n_draws, seed=seed),
+                                                      mintype=mintype)
+        # use different random numbers for the two minerals
+        seed = None if seed is None else seed + 1
+    temperature, lnK = two_pyroxene_temperature(elements['orthopyroxene'], elements['clinopyroxene'])
+    temperatures = pd.concat([_summarise(temperature, len(samples), samples, 'T (C)'),
+                              _summarise(lnK, len(samples), samples, 'lnK')], axis=1)
+    temperatures.index.name = 'Sample'
+    return temperatures
+
+
+def calc_olivine_spinel_temperatures(olivine_average_data, spinel_average_data, pressure=1.,
+                                     n_draws=500, seed=None):
+    """
+    Calculate olivine-spinel temperatures for every sample with both olivine and spinel data.
+
+    Args:
+        olivine_average_data: DataFrame of olivine sample averages of the oxides, from average_over_samples.
+        spinel_average_data: The same for spinel.
+        pressure: Pressure in GPa. Default 1.
+        n_draws: Number of random compositions per sample used to propagate the uncertainty.
+        seed: Seed for the random number generator.
+
+    Returns:
+        temperatures: DataFrame indexed by sample, with the temperature (T (C)) and ln K_D for the average
+                      compositions, and their 2SD from the random draws.
+    """
+    samples = pair_samples(olivine_average_data, spinel_average_data)
+    if len(samples) == 0:
+        return _empty_temperatures('lnKd')
+    mean, sd = get_sample_oxides(olivine_average_data.loc[samples])
+    olivine, _, _, _ = calc_composition(draw_compositions(mean, sd, n_draws=n_draws, seed=seed), mintype='olivine')
+    mean, sd = get_sample_oxides(spinel_average_data.loc[samples])
+    seed = None if seed is None else seed + 1
+    spinel, _, spinel_cat_props, _ = calc_composition(draw_compositions(mean, sd, n_draws=n_draws, seed=seed),
+                                                      mintype='spinel')
+    temperature, lnKd = olivine_spinel_temperature(olivine, spinel, spinel_cat_props, pressure=pressure)
+    temperatures = pd.concat([_summarise(temperature, len(samples), samples, 'T (C)'),
+                              _summarise(lnKd, len(samples), samples, 'lnKd')], axis=1)
+    temperatures.index.name = 'Sample'
+    return temperatures
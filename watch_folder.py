@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Watch a folder for new or changed SEM exports and run the analysis on each one automatically,
+without having to launch mineral_analysis.py by hand each time. The worker processes are started
+once, so Pandas/NumPy (and Matplotlib, if making plots) are only imported once rather than for every file.
+
+The outputs for each input file are written to a folder with the same relative path (and name) under the
+output folder, e.g. <input folder>/core1/run3.xlsx -> <output folder>/core1/run3/output_data.xlsx.
+
+Example usage:
+    python watch_folder.py <input folder> <output folder> --tolerance olivine=0.01 --tolerance spinel=0.005 --plots
+
+The cation quality check is run non-interactively - any mineral without a tolerance specified uses
+the default error (0.002 for spinel, 0.01 otherwise).
+"""
+
+import argparse
+import fnmatch
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from pipeline import run_pipeline, PipelineConfig, MINERAL_TYPES
+
+WATCH_PATTERNS = ('*.xls', '*.xlsx')
+# Histograms to generate for each processed file if plotting is enabled - pairs of [sheet name, column name]
+WATCH_HIST_PLOTS = [['Olivine data', 'Fo'],
+                    ['Opx data', 'Mg#'],
+                    ['Cpx data', 'Mg#'],
+                    ['Spinel data', 'CrN']]
+
+
+def _warm_up(plots):
+    """
+    Initialiser for the worker processes - import the (slow to import) plotting modules once per worker,
+    using a non-interactive Matplotlib backend as there is no display to draw to.
+    """
+    if plots:
+        import matplotlib
+        matplotlib.use('Agg')
+        import plotting_functions  # noqa: F401
+
+
+def scan_folder(watch_dir, patterns=WATCH_PATTERNS, exclude=None):
+    """
+    Find all of the input files within a folder (including subfolders).
+
+    Args:
+        watch_dir: Folder to search.
+        patterns: Filename patterns of the input files to look for.
+        exclude: Optional folder to skip, e.g. the output folder if it is inside watch_dir.
+
+    Returns:
+        files: Dictionary of {path: (modification time, size)} for each file found. The pair is used to
+               check whether a file has changed (or is still being written) between scans.
+    """
+    files = {}
+    exclude = os.path.abspath(exclude) if exclude else None
+    for root, dirs, fnames in os.walk(watch_dir):
+        if exclude:
+            dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != exclude]
+        for fname in fnames:
+            # skip the lock files that Excel creates while a file is open
+            if fname.startswith('~$') or not any(fnmatch.fnmatch(fname.lower(), p) for p in patterns):
+                continue
+            path = os.path.join(root, fname)
+            try:
+                stat = os.stat(path)
+            except OSError:  # file removed between listing and stat
+                continue
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def get_output_dir(input_file, watch_dir, output_dir):
+    """
+    Get the folder to write the outputs for input_file to, mirroring its location within watch_dir.
+    """
+    rel_path = os.path.relpath(input_file, watch_dir)
+    return os.path.join(output_dir, os.path.splitext(rel_path)[0])
+
+
+def process_file(input_file, output_dir, mintypes=MINERAL_TYPES, errors=None, plots=False):
+    """
+    Run the analysis on a single input file and write the output spreadsheet (and plots) into output_dir.
+
+    Args:
+        input_file: Excel spreadsheet containing the mineral data.
+        output_dir: Folder to write the outputs into. Created if it does not already exist.
+        mintypes: Mineral types to analyse.
+        errors: Dictionary of the error threshold for the cation quality check for each mineral type.
+                Mineral types not in the dictionary use the default error.
+        plots: If True, also generate the histograms in WATCH_HIST_PLOTS in <output_dir>/plots.
+
+    Returns:
+        output_filename: Path of the output spreadsheet.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_filename = os.path.join(output_dir, 'output_data.xlsx')
+    print(f'Analysing {input_file}...')
+    # start from a fresh file, else the outputs of the previous version would be kept in any sheets not
+    # written this time. The figures are closed by run_pipeline, so none are kept in a long-running process.
+    run_pipeline(PipelineConfig(data_filename=input_file, output_data_fname=output_filename, overwrite_output=True,
+                                mintypes=list(mintypes), interactive_qc=False, cation_errors=dict(errors or {}),
+                                hist_plots=WATCH_HIST_PLOTS if plots else [],
+                                plot_path=os.path.join(output_dir, 'plots')))
+    return output_filename
+
+
+def watch_folder(watch_dir, output_dir, mintypes=MINERAL_TYPES, errors=None, plots=False, poll_interval=2.,
+                 settle_time=5., max_workers=2, max_queued=None, skip_existing=False, once=False):
+    """
+    Watch watch_dir for new or changed input files, and process each one with process_file once it has
+    stopped changing (i.e. the SEM software has finished writing it).
+
+    Args:
+        watch_dir: Folder to watch (including subfolders).
+        output_dir: Folder to write the outputs into, mirroring the layout of watch_dir.
+        mintypes: Mineral types to analyse.
+        errors: Dictionary of the error threshold for the cation quality check for each mineral type.
+        plots: If True, also generate plots for each file.
+        poll_interval: Time between scans of the folder, in seconds.
+        settle_time: Time (in seconds) for which a file's size and modification time must be unchanged
+                     before it is processed, so partially-written files are not picked up.
+        max_workers: Number of files to process at once.
+        max_queued: Maximum number of files submitted to the workers at once (running or waiting). Any other
+                    files that are ready wait until there is space. Default 2 * max_workers.
+        skip_existing: If True, files already in watch_dir at startup are not processed unless they change.
+        once: If True, return once all the files currently in watch_dir have been processed rather than
+              watching indefinitely.
+
+    Returns:
+        None
+    """
+    if max_queued is None:
+        max_queued = 2 * max_workers
+    last_seen = {}  # path -> (mtime, size) from the latest scan
+    changed_at = {}  # path -> time at which (mtime, size) last changed
+    processed = {}  # path -> (mtime, size) of the version that was last processed
+    pending = {}  # future -> (path, (mtime, size))
+
+    if skip_existing:
+        processed = scan_folder(watch_dir, exclude=output_dir)
+
+    print(f'Watching {watch_dir} for new input files - press Ctrl+C to stop')
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_warm_up, initargs=(plots,)) as executor:
+        while True:
+            now = time.monotonic()
+            current = scan_folder(watch_dir, exclude=output_dir)
+            for path, signature in current.items():
+                if last_seen.get(path) != signature:
+                    last_seen[path] = signature
+                    changed_at[path] = now
+            for path in set(last_seen) - set(current):  # forget about deleted files
+                del last_seen[path], changed_at[path]
+
+            # files that have settled, are not being processed already and have not been processed in
+            # their current state - oldest first
+            in_flight = {path for path, _ in pending.values()}
+            ready = sorted((path for path, signature in current.items()
+                            if now - changed_at[path] >= settle_time and processed.get(path) != signature
+                            and path not in in_flight), key=lambda path: changed_at[path])
+            for path in ready[:max(max_queued - len(pending), 0)]:
+                future = executor.submit(process_file, path, get_output_dir(path, watch_dir, output_dir),
+                                         mintypes=mintypes, errors=errors, plots=plots)
+                pending[future] = (path, current[path])
+
+            for future in [future for future in pending if future.done()]:
+                path, signature = pending.pop(future)
+                # mark as processed even if it failed, so we don't retry until the file changes again
+                processed[path] = signature
+                try:
+                    print(f'Finished {path} -> {future.result()}')
+                except Exception:
+                    print(f'Failed to process {path}:')
+                    traceback.print_exc()
+
+            if once and not pending and all(processed.get(path) == signature
+                                             for path, signature in current.items()):
+                return
+            time.sleep(poll_interval)
+
+
+def parse_tolerances(tolerances):
+    """
+    Convert a list of 'mineral=error' strings from the command line into a dictionary.
+    """
+    errors = {}
+    for tolerance in tolerances:
+        try:
+            mintype, error = tolerance.split('=')
+            errors[mintype.strip().lower()] = float(error)
+        except ValueError:
+            raise ValueError(f'Tolerances should be given as mineral=error, e.g. olivine=0.01, not "{tolerance}"')
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Watch a folder for new SEM exports and analyse them.')
+    parser.add_argument('watch_dir', help='Folder to watch for new input files')
+    parser.add_argument('output_dir', help='Folder to write the outputs to')
+    parser.add_argument('--minerals', nargs='+', default=list(MINERAL_TYPES),
+                        help='Mineral types to analyse')
+    parser.add_argument('--tolerance', action='append', default=[],
+                        help='Cation quality check error for a mineral, e.g. olivine=0.01. Can be repeated.')
+    parser.add_argument('--plots', action='store_true', help='Also generate plots for each file')
+    parser.add_argument('--workers', type=int, default=2, help='Number of files to process at once')
+    parser.add_argument('--max-queued', type=int, default=None,
+                        help='Maximum number of files submitted to the workers at once')
+    parser.add_argument('--poll', type=float, default=2., help='Time between folder scans (s)')
+    parser.add_argument('--settle', type=float, default=5.,
+                        help='Time a file must be unchanged for before it is processed (s)')
+    parser.add_argument('--skip-existing', action='store_true',
+                        help="Don't process files that are already in the folder at startup")
+    parser.add_argument('--once', action='store_true',
+                        help='Process the files currently in the folder, then exit')
+    args = parser.parse_args()
+
+    watch_folder(args.watch_dir, args.output_dir, mintypes=args.minerals, errors=parse_tolerances(args.tolerance),
+                 plots=args.plots, poll_interval=args.poll, settle_time=args.settle, max_workers=args.workers,
+                 max_queued=args.max_queued, skip_existing=args.skip_existing, once=args.once)
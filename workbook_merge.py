@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Merge the point analyses of several input spreadsheets (e.g. the workbooks of different campaigns, or re-exports of
+the same samples) into one dataset per mineral, with any analysis that appears more than once kept only once, so
+that it isn't counted twice in the area and sample averages.
+
+Every analysis is indexed by a hash of its mineral, 'Project Path (1)', 'Project Path (2)', 'Project Path (3)' and
+'Label', and by a hash of those plus its oxide values:
+    - exact duplicates have the same labels and exactly the same oxide values (the second hash), and
+    - near duplicates have the same labels (the first hash) and every oxide within tolerance (wt%) of an earlier
+      analysis, e.g. a re-export rounded to fewer decimal places.
+Only analyses that share their labels with another are compared oxide by oxide, so the whole merge is a few
+vectorised operations however many workbooks and analyses there are. The first copy of each analysis (in the order
+the workbooks are given, then by row) is kept.
+
+Usage:
+    python workbook_merge.py campaign1.xlsx campaign2.xlsx merged.xlsx
+writes the merged analyses to a spreadsheet with one sheet per mineral, in the order expected by
+inout.load_and_filter, and lists the duplicates that were left out. Alternatively, give run_pipeline (or
+data_filename in mineral_analysis.py) a list of workbooks to merge them as part of the analysis.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from get_composition import ELEMENT_NAMES
+from phase_classification import PHASES, write_sorted_workbook
+
+LABEL_COLUMNS = ['Project Path (1)', 'Project Path (2)', 'Project Path (3)', 'Label']
+DUPLICATE_COLUMNS = ['Phase', 'Source file', 'Source row'] + LABEL_COLUMNS + ['Duplicate', 'Duplicate of file',
+                                                                             'Duplicate of row',
+                                                                             'Largest difference']
+
+
+def read_workbook(path, sorted_sheets=True):
+    """
+    Read the analyses of every mineral from an input spreadsheet into a single DataFrame.
+
+    Args:
+        path: Filename of the spreadsheet.
+        sorted_sheets: If True, the spreadsheet has one sheet per mineral, in the order expected by
+                       inout.load_and_filter (olivine, Opx, Cpx, spinel). If False, the analyses of every mineral
+                       are mixed together on the first sheet (see phase_classification.py), and no 'Phase' column
+                       is added.
+
+    Returns:
+        data: DataFrame of the analyses, with the mineral of each in a 'Phase' column (if sorted_sheets), and the
+              file and spreadsheet row number it was read from in 'Source file' and 'Source row'.
+    """
+    if sorted_sheets:
+        sheets = pd.read_excel(path, sheet_name=None)
+        frames = [sheet.assign(Phase=phase) for phase, sheet in zip(PHASES, sheets.values())]
+    else:
+        frames = [pd.read_excel(path, sheet_name=0)]
+    # the row number as shown in Excel, below the header
+    frames = [frame.assign(**{'Source file': os.path.basename(path), 'Source row': frame.index + 2})
+              for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def _hash_rows(data, columns):
+    """
+    64-bit hash of the values in the given columns of every row.
+    """
+    return pd.util.hash_pandas_object(data[columns], index=False).to_numpy()
+
+
+def find_duplicates(data, tolerance=0.01):
+    """
+    Find the analyses that are exact or near duplicates of an earlier row (see the top of this file).
+
+    Args:
+        data: DataFrame of analyses from read_workbook (or several of them concatenated).
+        tolerance: Largest difference (wt%) in any oxide for two analyses with the same labels to count as near
+                   duplicates. 0 to only find exact duplicates.
+
+    Returns:
+        duplicate: Array of '' for analyses to keep, 'exact' or 'near' for duplicates.
+        original: Array of the position of the row each duplicate is a copy of (-1 for analyses to keep).
+        difference: Array of the largest oxide difference (wt%) from that row (NaN for analyses to keep).
+    """
+    keys = [col for col in ['Phase'] + LABEL_COLUMNS if col in data.columns]
+    oxides = [name for name in ELEMENT_NAMES if name in data.columns]
+    # labels are compared as text, so that e.g. a Label read as 1 from one workbook and '1' from another match
+    labels = data[keys].astype(str)
+    label_hash = _hash_rows(labels, keys)
+    values = data[oxides].to_numpy(dtype=float)
+    exact_hash = _hash_rows(labels.assign(**{name: values[:, idx] for idx, name in enumerate(oxides)}),
+                            keys + oxides)
+
+    n_rows = len(data)
+    duplicate = np.full(n_rows, '', dtype=object)
+    original = np.full(n_rows, -1, dtype=np.int64)
+    difference = np.full(n_rows, np.nan)
+
+    # exact duplicates - a copy of the first row with the same hash
+    _, first, inverse = np.unique(exact_hash, return_index=True, return_inverse=True)
+    exact = first[inverse] != np.arange(n_rows)
+    duplicate[exact] = 'exact'
+    original[exact] = first[inverse][exact]
+    difference[exact] = 0.
+
+    # near duplicates - compare the remaining rows with every earlier row with the same labels
+    if tolerance > 0:
+        rows = np.flatnonzero(~exact)
+        candidates = pd.Series(label_hash[rows])
+        rows = rows[candidates.duplicated(keep=False).to_numpy()]
+        if len(rows):
+            pairs = pd.DataFrame({'hash': label_hash[rows], 'row': rows})
+            pairs = pairs.merge(pairs, on='hash', suffixes=('_first', '_dup'))
+            pairs = pairs[pairs['row_first'] < pairs['row_dup']]
+            first_values = values[pairs['row_first'].to_numpy()]
+            dup_values = values[pairs['row_dup'].to_numpy()]
+            # oxides missing from both match, but missing from only one gives a NaN difference, which never does
+            diff = np.where(np.isnan(first_values) & np.isnan(dup_values), 0.,
+                            np.abs(first_values - dup_values)).max(axis=1, initial=0.)
+            pairs = pairs.assign(diff=diff)[diff <= tolerance]
+            # each near duplicate is a copy of the first matching row
+            pairs = pairs.sort_values(['row_dup', 'row_first']).drop_duplicates('row_dup')
+            near = pairs['row_dup'].to_numpy()
+            duplicate[near] = 'near'
+            original[near] = pairs['row_first'].to_numpy()
+            difference[near] = pairs['diff'].to_numpy()
+    return duplicate, original, difference
+
+
+def merge_workbooks(paths, tolerance=0.01, drop_duplicates=True, sorted_sheets=True):
+    """
+    Read several input spreadsheets and merge them into a single dataset, leaving out (or only reporting) the
+    analyses that are duplicated within or between them.
+
+    Args:
+        paths: List of filenames of the spreadsheets, in order of preference - the first copy of each analysis is
+               kept.
+        tolerance: Largest difference (wt%) in any oxide for near duplicates - see find_duplicates.
+        drop_duplicates: If True, leave the duplicates out of the merged data. If False, keep them, and only list
+                         them in the report.
+        sorted_sheets: If True, each spreadsheet has one sheet per mineral - see read_workbook.
+
+    Returns:
+        data: DataFrame of the merged analyses, with the mineral of each in the 'Phase' column (if sorted_sheets),
+              which can be passed straight into pipeline.analyse_mineral (or inout.load_and_filter) in place of an
+              input spreadsheet.
+        duplicates: DataFrame listing each duplicate, the row it is a copy of and the largest oxide difference.
+        summary: DataFrame of the number of analyses read, exact and near duplicates and analyses kept for each
+                 spreadsheet (and mineral).
+    """
+    if not paths:
+        raise ValueError('No spreadsheets given to merge')
+    frames = [read_workbook(path, sorted_sheets=sorted_sheets) for path in paths]
+    # only the columns in every spreadsheet can be kept, as analyses with missing values are left out later on
+    columns = [col for col in frames[0].columns if all(col in frame.columns for frame in frames)]
+    missing = sorted({col for frame in frames for col in frame.columns} - set(columns))
+    if missing:
+        print(f'Columns not in every spreadsheet, left out of the merged data: {missing}')
+    data = pd.concat([frame[columns] for frame in frames], ignore_index=True)
+
+    duplicate, original, difference = find_duplicates(data, tolerance=tolerance)
+    is_duplicate = duplicate != ''
+    report = data.loc[is_duplicate, [col for col in DUPLICATE_COLUMNS if col in data.columns]].assign(
+        Duplicate=duplicate[is_duplicate],
+        **{'Duplicate of file': data['Source file'].to_numpy()[original[is_duplicate]],
+           'Duplicate of row': data['Source row'].to_numpy()[original[is_duplicate]],
+           'Largest difference': difference[is_duplicate]})
+
+    groups = [col for col in ['Source file', 'Phase'] if col in data.columns]
+    flags = pd.DataFrame({'Number of analyses': 1, 'Exact duplicates': duplicate == 'exact',
+                          'Near duplicates': duplicate == 'near'}, index=data.index)
+    summary = flags.groupby([data[col] for col in groups], sort=False).sum()
+    summary['Analyses kept'] = summary['Number of analyses'] - (summary['Exact duplicates'] +
+                                                                summary['Near duplicates']) * drop_duplicates
+    summary = summary.reset_index()
+    print(f'Merged {len(data)} analyses from {len(paths)} spreadsheets: {np.sum(duplicate == "exact")} exact and '
+          f'{np.sum(duplicate == "near")} near duplicates {"left out" if drop_duplicates else "found"}')
+
+    if drop_duplicates:
+        data = data[~is_duplicate]
+    data = data.drop(columns=['Source file', 'Source row']).reset_index(drop=True)
+    return data, report.reset_index(drop=True), summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the analyses of several input spreadsheets, leaving out '
+                                                 'duplicated analyses.')
+    parser.add_argument('inputs', nargs='+', help='Spreadsheets to merge, with one sheet per mineral')
+    parser.add_argument('output', help='Spreadsheet to write, with one sheet per mineral')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='Largest oxide difference (wt%%) for near duplicates (default 0.01, 0 for exact only)')
+    args = parser.parse_args()
+    merged, duplicates, merge_summary = merge_workbooks(args.inputs, tolerance=args.tolerance)
+    print(merge_summary.to_string(index=False))
+    write_sorted_workbook(args.output, merged)
+    with pd.ExcelWriter(args.output, mode='a') as writer:
+        merge_summary.to_excel(writer, sheet_name='Merge summary', index=False)
+        duplicates.to_excel(writer, sheet_name='Merge duplicates', index=False)